@@ -0,0 +1,3 @@
+"""
+Benchmarks for TcpNetLock. These are not run as part of the tests; run them with `python -m benchmarks.<name>`.
+"""
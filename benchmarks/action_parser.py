@@ -0,0 +1,81 @@
+"""
+Measures the time to parse the lines received from the clients, comparing the current `Action.from_line()`
+with the previous implementation (kept here as `LegacyAction`).
+
+Each line is parsed and used the way the server does: `is_valid()`, `name`, and the parameters only for the
+actions that have them.
+
+    $ python -m benchmarks.action_parser
+    $ python -m benchmarks.action_parser --iterations 500000
+"""
+import argparse
+import time
+
+from tcpnetlock.server.action import Action
+
+LINES = [
+    'lock,name:resource-1234',
+    'lock,name:resource-1234,client-id:worker-7@host.example.com,wait:30',
+    '.keepalive',
+    'release',
+    '.ping',
+    'release,name:resource-1234,rid:42',
+]
+
+
+class LegacyAction:
+    """The implementation of `Action` used before the lazy parameters"""
+
+    def __init__(self, action: str, params: dict):
+        self.action = action
+        self.params = params
+
+    @property
+    def name(self):
+        return self.action
+
+    def is_valid(self):
+        return \
+            len(self.action) > 0 \
+            and all(len(p) > 0 for p in self.params.keys())
+
+    @classmethod
+    def from_line(cls, line: str):
+        action, *raw_params = line.split(',')
+        params = []
+        for key, *values in [p.split(':', 1) for p in raw_params]:
+            if values:
+                assert len(values) == 1
+                param = [key.strip(), values[0].strip()]
+            else:
+                param = [key.strip(), '']
+            params.append(param)
+        return LegacyAction(action.strip(), dict(params))
+
+
+def measure(action_class, line: str, iterations: int) -> float:
+    uses_params = ',' in line
+    from_line = action_class.from_line
+    start = time.perf_counter()
+    for _ in range(iterations):
+        action = from_line(line)
+        if action.is_valid() and action.name and uses_params:
+            action.params.get('name')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", default=200000, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    args = parser.parse_args()
+
+    for line in LINES:
+        for action_class in (LegacyAction, Action):
+            elapsed = min(measure(action_class, line, args.iterations) for _ in range(args.repeat))
+            print("{name:>12} {rate:>12,.0f} lines/s  '{line}'".format(
+                name=action_class.__name__, rate=args.iterations / elapsed, line=line))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures how long clients wait to get a lock when many of them connect at once (like a deployment starting
+hundreds of `tnl_do` at the same time), with different listen backlogs.
+
+The clients connect while the server is not yet accepting connections (like a server busy serving other
+clients): the connections queue in the backlog. When the backlog is full, the kernel drops the SYNs of new
+connections, and those clients retransmit them after 1 second (and then 2, 4... seconds).
+
+    $ python -m benchmarks.connection_burst --clients 300 --backlog 5
+    $ python -m benchmarks.connection_burst --clients 300
+
+With `--max-connections`, the clients beyond the limit get 'busy' right away, and each client keeps its lock
+`--hold` seconds (so the connections stay open).
+"""
+import argparse
+import collections
+import threading
+import time
+import uuid
+
+from tcpnetlock.client.client import LockClient
+from tcpnetlock.common import ServerBusyError
+from tcpnetlock.server.server import TCPServer
+
+
+def run_client(port: int, hold: float, results: list, failures: list):
+    start = time.monotonic()
+    client = LockClient('localhost', port)
+    try:
+        client.connect()
+        assert client.lock(uuid.uuid4().hex)
+        results.append(time.monotonic() - start)
+        time.sleep(hold)
+    except ServerBusyError:
+        failures.append('busy')
+    except ConnectionError as err:
+        failures.append(type(err).__name__)
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default=300, type=int)
+    parser.add_argument("--backlog", default=None, type=int)
+    parser.add_argument("--max-connections", default=None, type=int)
+    parser.add_argument("--hold", default=0, type=float)
+    parser.add_argument("--delay", default=0.5, type=float,
+                        help="Seconds the server waits before accepting connections")
+    args = parser.parse_args()
+
+    lock_server = TCPServer('localhost', 0, backlog=args.backlog, max_connections=args.max_connections)
+    results = []
+    failures = []
+    clients = [threading.Thread(target=run_client, args=(lock_server.port, args.hold, results, failures))
+               for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    time.sleep(args.delay)
+    threading.Thread(target=lock_server.serve_forever, daemon=True).start()
+    for client in clients:
+        client.join()
+
+    granted = sorted(results)
+    print("backlog: {backlog}, clients: {clients}, granted: {granted}, failed: {failed}".format(
+        backlog=lock_server.request_queue_size, clients=args.clients, granted=len(granted),
+        failed=dict(collections.Counter(failures))))
+    print("time to lock: p50 {p50:.3f} s, p99 {p99:.3f} s, max {max:.3f} s".format(
+        p50=granted[len(granted) // 2], p99=granted[int(len(granted) * 0.99)], max=granted[-1]))
+    print("rejected connections: {}".format(lock_server.context.connections_rejected_count.count))
+    lock_server.shutdown()
+    lock_server.server_close()
+
+
+if __name__ == '__main__':
+    main()
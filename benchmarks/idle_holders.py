@@ -0,0 +1,58 @@
+"""
+Measures the CPU used by the server while lots of clients hold a lock without sending anything.
+
+The server runs in this same process, so the CPU time reported by `getrusage()` is the CPU used by the server
+threads (the clients are just open sockets).
+
+    $ python -m benchmarks.idle_holders --holders 2000 --seconds 10
+    $ python -m benchmarks.idle_holders --holders 2000 --seconds 10 --engine async
+
+Each holder uses 2 file descriptors (client and server side), check `ulimit -n`.
+"""
+import argparse
+import resource
+import threading
+import time
+import uuid
+
+from tcpnetlock.client.client import LockClient
+from tcpnetlock.cli.tnl_server import ENGINES
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--holders", default=1000, type=int)
+    parser.add_argument("--seconds", default=10, type=int)
+    parser.add_argument("--engine", default='threading', choices=sorted(ENGINES.keys()))
+    args = parser.parse_args()
+
+    lock_server = ENGINES[args.engine]('localhost', 0)
+    threading.Thread(target=lock_server.serve_forever, daemon=True).start()
+
+    prefix = uuid.uuid4().hex
+    clients = []
+    for index in range(args.holders):
+        client = LockClient('localhost', lock_server.port)
+        client.connect()
+        assert client.lock('{}-{}'.format(prefix, index))
+        clients.append(client)
+
+    time.sleep(1)  # let the server settle
+    cpu_start, wall_start = cpu_seconds(), time.monotonic()
+    time.sleep(args.seconds)
+    cpu_used, wall_used = cpu_seconds() - cpu_start, time.monotonic() - wall_start
+
+    print("engine={engine} holders={holders} wall={wall:.2f}s cpu={cpu:.4f}s cpu/wall={ratio:.4%}".format(
+        engine=args.engine, holders=args.holders, wall=wall_used, cpu=cpu_used, ratio=cpu_used / wall_used))
+
+    for client in clients:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures the time to import the modules used by the command line tools and the client, using
+`python -X importtime` in a new interpreter for each run (so nothing is cached in `sys.modules`).
+
+Prints the cumulative import time of each entry point (the best of `--repeat` runs), and with `--details`,
+the modules that took longer to import.
+
+    $ python -m benchmarks.import_time
+    $ python -m benchmarks.import_time --details tcpnetlock.cli.tnl_do
+"""
+import argparse
+import subprocess
+import sys
+
+MODULES = [
+    'tcpnetlock.client.client',
+    'tcpnetlock.cli.tnl_do',
+    'tcpnetlock.cli.tnl_client',
+    'tcpnetlock.cli.tnl_server',
+]
+
+
+def import_times(module: str) -> dict:
+    """Imports `module` in a new interpreter. Returns the cumulative import time (in microseconds) by module"""
+    completed_process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                       stderr=subprocess.PIPE, check=True)
+    times = {}
+    for line in completed_process.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", default=5, type=int)
+    parser.add_argument("--details", default=None, help="Module to show the slowest imports of")
+    parser.add_argument("--top", default=15, type=int)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        best = min(import_times(module)[module] for _ in range(args.repeat))
+        print("{module:>30} {ms:>8.1f} ms".format(module=module, ms=best / 1000))
+
+    if args.details:
+        times = import_times(args.details)
+        print()
+        for name, cumulative in sorted(times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+            print("{name:>30} {ms:>8.1f} ms".format(name=name, ms=cumulative / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures how many lock requests per second the server handles, with the server using one process
+(`--workers 0`) or many (ShardedTCPServer).
+
+The server runs in this process (the workers in their own processes); the clients run in `--clients`
+processes, each one acquiring and releasing locks with different names, one after the other.
+
+    $ python -m benchmarks.lock_throughput --clients 8 --workers 0
+    $ python -m benchmarks.lock_throughput --clients 8 --workers 4
+
+The clients use CPU too: to see the server scale, the machine needs more cores than `--workers`.
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+import uuid
+
+from tcpnetlock.client.client import LockClient
+from tcpnetlock.server.async_server import AsyncTCPServer
+from tcpnetlock.server.multiprocess import ShardedTCPServer
+
+
+def run_client(port: int, seconds: float, results):
+    prefix = uuid.uuid4().hex
+    count = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        client = LockClient('localhost', port)
+        client.connect()
+        assert client.lock('{}-{}'.format(prefix, count))
+        client.release()
+        client.close()
+        count += 1
+    results.put(count)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default=4, type=int)
+    parser.add_argument("--workers", default=0, type=int)
+    parser.add_argument("--seconds", default=5, type=float)
+    args = parser.parse_args()
+
+    if args.workers:
+        lock_server = ShardedTCPServer('localhost', 0, workers=args.workers)
+    else:
+        lock_server = AsyncTCPServer('localhost', 0)
+    threading.Thread(target=lock_server.serve_forever, daemon=True).start()
+
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=run_client, args=(lock_server.port, args.seconds, results))
+               for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    total = sum(results.get() for _ in clients)
+    for client in clients:
+        client.join()
+
+    print("workers: {workers}, clients: {clients}: {rate:,.0f} locks/s".format(
+        workers=args.workers, clients=args.clients, rate=total / args.seconds))
+    lock_server.shutdown()
+    lock_server.server_close()
+
+
+if __name__ == '__main__':
+    main()
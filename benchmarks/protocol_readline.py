@@ -0,0 +1,86 @@
+"""
+Measures the time `Protocol.readline()` takes to split the received data in lines, comparing the current
+implementation (`recv_into()` over a preallocated buffer) with the previous one (`recv(128)` + `bytearray.extend()`
++ `split()`), kept here as `LegacyProtocol`.
+
+The socket is replaced by an in-memory stream, so only the buffering and parsing is measured.
+
+    $ python -m benchmarks.protocol_readline
+    $ python -m benchmarks.protocol_readline --lines 200000 --line-length 200
+"""
+import argparse
+import time
+
+from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.constants import NEW_LINE_BINARY
+from tcpnetlock.protocol import Protocol
+
+
+class MemorySocket:
+    """Implements the subset of the socket interface used by Protocol, returning the data from `payload`"""
+
+    def __init__(self, payload: bytes):
+        self._payload = memoryview(payload)
+        self._position = 0
+
+    def gettimeout(self):
+        return None
+
+    def recv(self, max_bytes):
+        data = self._payload[self._position:self._position + max_bytes].tobytes()
+        self._position += len(data)
+        return data
+
+    def recv_into(self, buffer):
+        data = self._payload[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class LegacyProtocol:
+    """The implementation of `Protocol.readline()` used before the preallocated buffer"""
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.buffer = bytearray()
+
+    def readline(self):
+        while self.buffer.find(NEW_LINE_BINARY) < 0:
+            recv_data = self.socket.recv(128)
+            if not recv_data:
+                raise ClientDisconnected()
+            self.buffer.extend(recv_data)
+        head, tail = self.buffer.split(NEW_LINE_BINARY, 1)
+        self.buffer = tail
+        return head.decode()
+
+
+def measure(protocol_class, payload: bytes, lines: int) -> float:
+    protocol = protocol_class(MemorySocket(payload))
+    start = time.perf_counter()
+    for _ in range(lines):
+        protocol.readline()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", default=100000, type=int)
+    parser.add_argument("--line-length", default=None, type=int,
+                        help="Length of the lines. By default, measures some typical lengths")
+    parser.add_argument("--repeat", default=3, type=int)
+    args = parser.parse_args()
+
+    line_lengths = [args.line_length] if args.line_length else [8, 40, 200, 1000]
+    for line_length in line_lengths:
+        payload = (b'x' * line_length + NEW_LINE_BINARY) * args.lines
+        for protocol_class in (LegacyProtocol, Protocol):
+            elapsed = min(measure(protocol_class, payload, args.lines) for _ in range(args.repeat))
+            print("{name:>15} line-length={length:<5} lines={lines} time={elapsed:.3f}s ({rate:,.0f} lines/s)".format(
+                name=protocol_class.__name__, length=line_length, lines=args.lines, elapsed=elapsed,
+                rate=args.lines / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the clients connected over TCP (loopback) with the clients connected to the Unix domain socket
+of the server (`tcpnetlock_server --unix-socket PATH`, clients using 'unix:PATH').
+
+Measures:
+    - connection rate: connections per second, each one acquiring and releasing a lock
+    - latency: round trip of a keepalive sent while holding a lock (no new connection)
+
+The server (an AsyncTCPServer, and an AsyncUnixServer sharing its Context) runs in this process,
+the client in other process.
+
+    $ python -m benchmarks.unix_socket --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from tcpnetlock.client.client import LockClient
+from tcpnetlock.server.async_server import AsyncTCPServer
+from tcpnetlock.server.async_server import AsyncUnixServer
+
+
+def connection_rate(host: str, port: int, seconds: float) -> float:
+    prefix = uuid.uuid4().hex
+    count = 0
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        client = LockClient(host, port)
+        client.connect()
+        assert client.lock('{}-{}'.format(prefix, count))
+        client.release()
+        client.close()
+        count += 1
+    return count / (time.monotonic() - start)
+
+
+def keepalive_latencies(host: str, port: int, seconds: float) -> list:
+    client = LockClient(host, port)
+    client.connect()
+    assert client.lock(uuid.uuid4().hex)
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        client.keepalive()
+        latencies.append(time.perf_counter() - start)
+    client.release()
+    client.close()
+    return sorted(latencies)
+
+
+def run_client(host: str, port: int, seconds: float, results):
+    rate = connection_rate(host, port, seconds)
+    latencies = keepalive_latencies(host, port, seconds)
+    results.put((rate, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", default=3, type=float)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'tcpnetlock.sock')
+    tcp_server = AsyncTCPServer('localhost', 0)
+    unix_server = AsyncUnixServer(path, context=tcp_server.context)
+    for lock_server in (tcp_server, unix_server):
+        threading.Thread(target=lock_server.serve_forever, daemon=True).start()
+
+    for name, host in (('tcp', 'localhost'), ('unix', 'unix:' + path)):
+        results = multiprocessing.Queue()
+        client = multiprocessing.Process(target=run_client, args=(host, tcp_server.port, args.seconds, results))
+        client.start()
+        rate, p50, p99 = results.get()
+        client.join()
+        print("{name:>4}: {rate:,.0f} connections/s, keepalive round trip p50 {p50:.1f} us, p99 {p99:.1f} us".format(
+            name=name, rate=rate, p50=p50 * 1e6, p99=p99 * 1e6))
+
+    for lock_server in (unix_server, tcp_server):
+        lock_server.shutdown()
+        lock_server.server_close()
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import argparse
 import logging
 
+from tcpnetlock.common import TcpKeepalive
+
 logger = logging.getLogger(__name__)
 
 
@@ -68,6 +70,29 @@ class PositiveInteger:
         return int_value
 
 
+def add_tcp_keepalive_arguments(parser: argparse.ArgumentParser):
+    """Adds the arguments to enable kernel-level detection of dead peers (see `get_tcp_keepalive()`)"""
+    parser.add_argument("--tcp-keepalive-idle", default=0, type=PositiveInteger(),
+                        help="Enable TCP keepalive: seconds without traffic before the kernel starts sending "
+                             "probes to the peer (default 0, disabled unless --tcp-user-timeout is used, "
+                             "in which case the system default is used)")
+    parser.add_argument("--tcp-keepalive-interval", default=5, type=PositiveInteger(allow_zero=False),
+                        help="Seconds between TCP keepalive probes (default %(default)s)")
+    parser.add_argument("--tcp-keepalive-count", default=3, type=PositiveInteger(allow_zero=False),
+                        help="Unanswered TCP keepalive probes before the connection is dropped (default %(default)s)")
+    parser.add_argument("--tcp-user-timeout", default=0, type=PositiveInteger(),
+                        help="Drop the connection if sent data is not acknowledged in this many seconds "
+                             "(TCP_USER_TIMEOUT, only in Linux; default 0, disabled)")
+
+
+def get_tcp_keepalive(args) -> TcpKeepalive:
+    """Returns the TcpKeepalive for the arguments added by `add_tcp_keepalive_arguments()`, or None if disabled"""
+    if not args.tcp_keepalive_idle and not args.tcp_user_timeout:
+        return None
+    return TcpKeepalive(idle=args.tcp_keepalive_idle, interval=args.tcp_keepalive_interval,
+                        count=args.tcp_keepalive_count, user_timeout=args.tcp_user_timeout or None)
+
+
 """
 Example:
 
@@ -80,7 +105,7 @@ class Main(utils.BaseMain):
                             default='localhost')
 
         parser.add_argument("--port",
-                            default=server.TCPServer.DEFAULT_PORT,
+                            default=constants.DEFAULT_PORT,
                             type=int)
 
     def main(self):
@@ -5,7 +5,7 @@ import time
 
 from tcpnetlock.client import client
 from tcpnetlock.cli import common
-from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.common import ServerBusyError
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +13,7 @@ logger = logging.getLogger(__name__)
 ERR_CONNECTION_REFUSED = 2
 ERR_CONNECTION_FAILED = 3
 ERR_UNKNOWN = 4
+ERR_SERVER_BUSY = 5
 
 ERR_TCP_DISCONNECT_WHILE_HOLDING_LOCK = 122
 ERR_LOCK_NOT_GRANTED = 123
@@ -35,14 +36,19 @@ class Main(common.BaseMain):
         """.format(not_granted=ERR_LOCK_NOT_GRANTED)
 
         self.parser.add_argument("lock_name")
-        self.parser.add_argument("--host", default=self.DEFAULT_HOST)
+        self.parser.add_argument("--host", default=self.DEFAULT_HOST,
+                                 help="Host of the server, or 'unix:<path>' to use a Unix domain socket")
         self.parser.add_argument("--port", default=self.DEFAULT_PORT, type=int)
         self.parser.add_argument("--client-id", default=self.DEFAULT_CLIENT_ID)
+        self.parser.add_argument("--wait", default=0, type=common.PositiveInteger(),
+                                 help="Seconds the server should wait for the lock to be released (default 0)")
         self.parser.add_argument("--keep-alive", default=False, action='store_true')
         self.parser.add_argument("--keep-alive-secs", default=15, type=int)
+        common.add_tcp_keepalive_arguments(self.parser)
 
     def main(self):
-        lock_client = client.LockClient(self.args.host, self.args.port, client_id=self.args.client_id)
+        lock_client = client.LockClient(self.args.host, self.args.port, client_id=self.args.client_id,
+                                        tcp_keepalive=common.get_tcp_keepalive(self.args))
 
         try:
             lock_client.connect()
@@ -56,7 +62,7 @@ class Main(common.BaseMain):
             sys.exit(ERR_CONNECTION_FAILED)
 
         try:
-            granted = lock_client.lock(self.args.lock_name)
+            granted = lock_client.lock(self.args.lock_name, wait=self.args.wait)
             if not granted:
                 logger.debug("Lock '%s' not granted. Exiting...", self.args.lock_name)
                 print("ERROR: lock '{lock}' not granted by server".format(lock=self.args.lock_name), file=sys.stderr)
@@ -68,23 +74,23 @@ class Main(common.BaseMain):
                     time.sleep(self.args.keep_alive_secs)
                     lock_client.keepalive()
             else:
-                while True:
-                    logger.debug("Checking connection...")
-                    try:
-                        lock_client.check_connection()
-                    except ClientDisconnected as err:
-                        logger.debug("Unexpected disconnection while holding the lock '%s'. "
-                                     "Server was killed?", self.args.lock_name)
-                        print("ERROR: Unexpected disconnection while holding the lock '{lock}'. "
-                              "Server was killed?".format(lock=self.args.lock_name),
-                              file=sys.stderr)
-                        sys.exit(ERR_TCP_DISCONNECT_WHILE_HOLDING_LOCK)
-
-                    time.sleep(5)
+                logger.debug("Waiting for the connection to be closed...")
+                lock_client.wait_until_lost()
+                logger.debug("Unexpected disconnection while holding the lock '%s'. "
+                             "Server was killed?", self.args.lock_name)
+                print("ERROR: Unexpected disconnection while holding the lock '{lock}'. "
+                      "Server was killed?".format(lock=self.args.lock_name),
+                      file=sys.stderr)
+                sys.exit(ERR_TCP_DISCONNECT_WHILE_HOLDING_LOCK)
 
         except SystemExit as err:
             sys.exit(err.code)
 
+        except ServerBusyError as err:
+            logger.debug("Server busy", exc_info=True)
+            print(str(err), file=sys.stderr)
+            sys.exit(ERR_SERVER_BUSY)
+
         except BaseException as err:
             logger.debug("Error while getting or having the lock", exc_info=True)
             print(str(err), file=sys.stderr)
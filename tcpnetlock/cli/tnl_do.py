@@ -1,30 +1,32 @@
 import logging
 import os
-import queue
 import subprocess
 import sys
-import threading
 import time
 
 from tcpnetlock import constants
 from tcpnetlock.cli import common
 from tcpnetlock.client import client
-from tcpnetlock.server import server
+from tcpnetlock.common import ServerBusyError
 
 logger = logging.getLogger(__name__)
 
 
 ERR_INVALID_OPTIONS = 2  # like unix commands
+ERR_SERVER_BUSY = 122
 ERR_LOCK_NOT_GRANTED = 123
 ERR_EXECUTING_COMMAND = 124
 ERR_CONNECTION_REFUSED = 125
 ERR_FILE_NOT_FOUND = 127  # like bash
 
+LOCK_FD_ENV = 'TCPNETLOCK_LOCK_FD'
+"""Environment variable with the file descriptor of the connection holding the lock (with --exec)"""
+
 
 class Main(common.BaseMain):
 
     DEFAULT_HOST = os.environ.get('TCPNETLOCK_HOST', 'localhost')
-    DEFAULT_PORT = os.environ.get('TCPNETLOCK_PORT', str(server.TCPServer.DEFAULT_PORT))
+    DEFAULT_PORT = os.environ.get('TCPNETLOCK_PORT', str(constants.DEFAULT_PORT))
     DEFAULT_CLIENT_ID = os.environ.get('TCPNETLOCK_CLIENT_ID')
 
     def add_app_arguments(self):
@@ -41,12 +43,21 @@ class Main(common.BaseMain):
                             help="Name of the lock to acquire")
 
         parser.add_argument("--host",
-                            default=self.DEFAULT_HOST)
+                            default=self.DEFAULT_HOST,
+                            help="Host of the server, or 'unix:<path>' to connect to the Unix domain socket of "
+                                 "a server running on this host")
 
         parser.add_argument("--port",
                             default=self.DEFAULT_PORT,
                             type=common.PositiveInteger())
 
+        parser.add_argument("--wait",
+                            default=0,
+                            type=common.PositiveInteger(),
+                            help="If the lock is held by other client, how many seconds the server should wait "
+                                 "for it to be released. The lock is handed off as soon as it's released "
+                                 "(default 0, do not wait)")
+
         parser.add_argument("--retry",
                             default=0,
                             type=common.PositiveInteger(),
@@ -69,11 +80,26 @@ class Main(common.BaseMain):
                             default=15,
                             type=common.PositiveInteger())
 
+        parser.add_argument("--keep-alive-timeout",
+                            default=0,
+                            type=common.PositiveInteger(),
+                            help="If the server doesn't receive a keep-alive in this many seconds, it revokes "
+                                 "the lock (default 0, never). Requires --keep-alive")
+
+        parser.add_argument("--exec",
+                            default=False,
+                            action='store_true',
+                            help="Once the lock is granted, replace this process with the command (like the shell "
+                                 "'exec'). The connection is inherited by the command, which holds the lock until "
+                                 "it exits (or closes the file descriptor in ${fd_env})".format(fd_env=LOCK_FD_ENV))
+
         parser.add_argument("--shell",
                             default=False,
                             action='store_true',
                             help="Invoke the command with a shell (useful if you're using piping or redirecting)")
 
+        common.add_tcp_keepalive_arguments(parser)
+
         parser.add_argument("command",
                             nargs='+',
                             help="Command to execute (if lock is granted)")
@@ -81,6 +107,15 @@ class Main(common.BaseMain):
     def validate_and_fix_parameters(self):
         assert self.args
 
+        if self.args.exec and self.args.keep_alive:
+            self.parser.error("--keep-alive can't be used with --exec (there's no process left to send them)")
+
+        if self.args.keep_alive_timeout:
+            if not self.args.keep_alive:
+                self.parser.error("--keep-alive-timeout requires --keep-alive")
+            if self.args.keep_alive_timeout <= self.args.keep_alive_secs:
+                self.parser.error("--keep-alive-timeout must be greater than --keep-alive-secs")
+
         # --- Get 'command' to use (depending on value of '--shell')
         if self.args.shell:
             if len(self.args.command) != 1:
@@ -105,40 +140,28 @@ class Main(common.BaseMain):
                                   "You must specify the lock name with --lock-name")
                 sys.exit(ERR_INVALID_OPTIONS)
 
-    def start_keepalive_thread(self, lock_client: client.LockClient):
-        keepalive_queue = queue.Queue()
-
-        def loop_keepalives():
-            while True:
-                logger.debug("Sleeping for %s before sending keep-alive", self.args.keep_alive_secs)
-                for _ in range(self.args.keep_alive_secs):
-                    try:
-                        msg = keepalive_queue.get(block=True, timeout=1)
-                        if msg is None:
-                            logger.info("Shutting down keepalive thread...")
-                            return
-                        else:
-                            logger.warning("Invalid message '%s' received from Queue. This is rare.", msg)
-                    except queue.Empty:
-                        pass
-                logger.info("Sending keepalive")
-                lock_client.keepalive()
-
-        keepalive_thread = threading.Thread(target=loop_keepalives, daemon=True)
-        keepalive_thread.start()
-
-        return keepalive_thread, keepalive_queue
-
-    def stop_keepalive_thread(self, keepalive_thread, keepalive_queue):
-        if keepalive_thread is None or keepalive_queue is None:
-            return
+    def exec_command(self, lock_client: client.LockClient):
+        """Replaces this process with the command, which inherits the connection (and so, the lock)"""
+        fd = lock_client.fileno()
+        os.set_inheritable(fd, True)
+        os.environ[LOCK_FD_ENV] = str(fd)
+        if self.args.shell:
+            args = ['/bin/sh', '-c', self.args.command[0]]
+        else:
+            args = self.args.command
+
+        logger.info("Lock '%s' was granted. Executing command '%s'", self.args.lock_name, self.args.command)
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
         try:
-            keepalive_queue.put(None)
-            keepalive_thread.join(2)
-            if keepalive_thread.is_alive():
-                logger.warning("keepalive_thread still alive: %s", keepalive_thread)
-        except:  # noqa: E722 we need to ignore any error
-            logger.warning("Error occurred while stopping background thread")
+            os.execvp(args[0], args)
+        except FileNotFoundError:
+            sys.stderr.write("ERROR: command not found: '{command}'\n".format(command=args[0]))
+            sys.exit(ERR_FILE_NOT_FOUND)
+        except OSError as err:
+            sys.stderr.write("ERROR: couldn't execute '{command}': {err}\n".format(command=args[0], err=err))
+            sys.exit(ERR_EXECUTING_COMMAND)
 
     def main(self):
         self.validate_and_fix_parameters()
@@ -148,14 +171,28 @@ class Main(common.BaseMain):
             tries.pop()
 
             # --- Try to get lock
-            lock_client = client.LockClient(self.args.host, self.args.port, client_id=self.args.client_id)
+            lock_client = client.LockClient(self.args.host, self.args.port, client_id=self.args.client_id,
+                                            tcp_keepalive=common.get_tcp_keepalive(self.args))
             try:
                 lock_client.connect()
-            except ConnectionRefusedError:
+            except (ConnectionRefusedError, FileNotFoundError):
+                # FileNotFoundError: the Unix domain socket doesn't exist ('unix:<path>')
                 logger.error("Connection refused. Server: '%s:%s'", self.args.host, self.args.port)
                 sys.exit(ERR_CONNECTION_REFUSED)
 
-            granted = lock_client.lock(self.args.lock_name)
+            try:
+                granted = lock_client.lock(self.args.lock_name, wait=self.args.wait,
+                                           keepalive_timeout=self.args.keep_alive_timeout)
+            except ServerBusyError:
+                lock_client.close()
+                if tries:
+                    logger.info("Server busy. Still %s retries pending. Will retry in %s seconds...",
+                                len(tries), self.args.retry_wait)
+                    time.sleep(self.args.retry_wait)
+                    continue
+                logger.error("Server busy (too many connections). Exiting...")
+                sys.exit(ERR_SERVER_BUSY)
+
             if not granted:
                 if tries:
                     logger.info("Lock '%s' not granted. Still %s retries pending. Will retry in %s seconds...",
@@ -165,11 +202,12 @@ class Main(common.BaseMain):
                     logger.info("Lock '%s' not granted. Exiting...", self.args.lock_name)
                     sys.exit(ERR_LOCK_NOT_GRANTED)
 
-        # --- Send keepalive from thread
+        if self.args.exec:
+            self.exec_command(lock_client)
+
+        # --- Send keepalives from the (shared) keepalive scheduler thread
         if self.args.keep_alive:
-            keepalive_thread, keepalive_queue = self.start_keepalive_thread(lock_client)
-        else:
-            keepalive_thread = keepalive_queue = None
+            lock_client.start_keepalives(self.args.keep_alive_secs)
 
         # --- Call command
         logger.info("Lock '%s' was granted. Proceeding with command '%s'", self.args.lock_name, self.args.command)
@@ -187,11 +225,7 @@ class Main(common.BaseMain):
         except KeyboardInterrupt:
             pass
 
-        # --- Cleanup
-        self.stop_keepalive_thread(keepalive_thread, keepalive_queue)
-
-        # Release AFTER keepalive thread is stopped.
-        # Otherwise, the 2 threads could be concurrently reading/writing to the socket
+        # --- Cleanup: stops the keepalives (without waiting for any thread) and releases the lock
         lock_client.release()
 
         # --- Exit with same 'exit status' of the process we have just ran
@@ -1,8 +1,15 @@
 import logging
 import sys
+import threading
 
 from tcpnetlock import __version__ as tcpnetlock_version
+from tcpnetlock import constants
+from tcpnetlock.server import action_handlers as handlers
+from tcpnetlock.server import async_server
 from tcpnetlock.server import server
+from tcpnetlock.server.lock_table import LockTable
+from tcpnetlock.server.metrics import MetricsServer
+from tcpnetlock.server.multiprocess import ShardedTCPServer
 from tcpnetlock.cli import common
 
 logger = logging.getLogger(__name__)
@@ -11,32 +18,134 @@ logger = logging.getLogger(__name__)
 ERR_SERVER_BIND = 2
 ERR_HANDLING_REQUESTS = 3
 
+ENGINES = {
+    'threading': server.TCPServer,
+    'async': async_server.AsyncTCPServer,
+}
+
+UNIX_ENGINES = {
+    'threading': server.UnixServer,
+    'async': async_server.AsyncUnixServer,
+}
+
 
 class Main(common.BaseMain):
 
     def add_app_arguments(self):
         self.parser.add_argument("--listen", default='localhost')
-        self.parser.add_argument("--port", default=server.TCPServer.DEFAULT_PORT, type=int)
+        self.parser.add_argument("--port", default=constants.DEFAULT_PORT, type=int)
+        self.parser.add_argument("--engine", default='threading', choices=sorted(ENGINES.keys()),
+                                 help="'threading' serves each connection in its own thread, "
+                                      "'async' serves all the connections from a single thread using an event loop")
+        self.parser.add_argument("--lock-table-shards", default=LockTable.DEFAULT_SHARDS,
+                                 type=common.PositiveInteger(allow_zero=False),
+                                 help="Number of partitions of the table of locks. Each partition has its own mutex, "
+                                      "so requests for locks in different partitions never contend "
+                                      "(default: $TCPNETLOCK_LOCK_TABLE_SHARDS or %(default)s)")
+        self.parser.add_argument("--metrics-port", default=None, type=common.PositiveInteger(allow_zero=False),
+                                 help="Serve metrics in OpenMetrics format (for Prometheus) over HTTP on this port")
+        self.parser.add_argument("--metrics-listen", default=None,
+                                 help="Address where the metrics are served (default: same as --listen)")
+        self.parser.add_argument("--workers", default=0, type=common.PositiveInteger(),
+                                 help="Serve the locks from this many processes (each one owning part of the lock "
+                                      "names, and using the 'async' engine). Sessions, and requests for many locks "
+                                      "owned by different processes, are refused (default 0: single process)")
+        self.parser.add_argument("--listen-backlog", default=None, type=common.PositiveInteger(allow_zero=False),
+                                 help="Connections not yet accepted the kernel queues (default: the maximum "
+                                      "allowed by the system). Raise net.core.somaxconn to allow bigger values")
+        self.parser.add_argument("--max-connections", default=None, type=common.PositiveInteger(allow_zero=False),
+                                 help="While this many connections are open, new connections are refused with "
+                                      "a 'busy' response (default: no limit)")
+        self.parser.add_argument("--handshake-timeout", default=30, type=common.PositiveInteger(),
+                                 help="Close the connections that don't send a request in this many seconds "
+                                      "(default %(default)s, 0 to disable)")
+        self.parser.add_argument("--unix-socket", default=None, metavar='PATH',
+                                 help="Also listen on a Unix domain socket, for clients running on this host "
+                                      "(they connect to 'unix:PATH'). The locks are the same for both sockets")
+        self.parser.add_argument("--no-tcp", default=False, action='store_true',
+                                 help="Don't listen on TCP (requires --unix-socket)")
+        common.add_tcp_keepalive_arguments(self.parser)
 
     @property
     def version(self):
         return tcpnetlock_version
 
+    def create_server(self):
+        tcp_keepalive = common.get_tcp_keepalive(self.args)
+        if self.args.workers:
+            return ShardedTCPServer(self.args.listen, self.args.port, lock_table_shards=self.args.lock_table_shards,
+                                    tcp_keepalive=tcp_keepalive, workers=self.args.workers,
+                                    backlog=self.args.listen_backlog, handshake_timeout=self.args.handshake_timeout)
+        return ENGINES[self.args.engine](self.args.listen, self.args.port,
+                                         lock_table_shards=self.args.lock_table_shards, tcp_keepalive=tcp_keepalive,
+                                         backlog=self.args.listen_backlog, max_connections=self.args.max_connections,
+                                         handshake_timeout=self.args.handshake_timeout)
+
+    def create_servers(self) -> list:
+        """Returns the servers to run. The first one is the main server: the rest share its Context"""
+        servers = []
+        if not self.args.no_tcp:
+            servers.append(self.create_server())
+        if self.args.unix_socket:
+            context = servers[0].context if servers else None
+            # The connections of both servers are counted together (the Context is shared)
+            unix_server = UNIX_ENGINES[self.args.engine](self.args.unix_socket,
+                                                         lock_table_shards=self.args.lock_table_shards,
+                                                         context=context, backlog=self.args.listen_backlog,
+                                                         max_connections=self.args.max_connections,
+                                                         handshake_timeout=self.args.handshake_timeout)
+            if servers:
+                # A shutdown request received on any socket stops the main server (and then, the rest)
+                unix_server.dispatcher.actions.register(constants.ACTION_SERVER_SHUTDOWN,
+                                                        handlers.ShutdownActionHandler(servers[0]))
+            servers.append(unix_server)
+        return servers
+
     def main(self):
-        logger.info("Started server v%s listening on %s:%s", self.version, self.args.listen, self.args.port)
+        if self.args.workers and self.args.metrics_port:
+            self.parser.error("--metrics-port is not supported with --workers")
+        if self.args.workers and self.args.unix_socket:
+            self.parser.error("--unix-socket is not supported with --workers")
+        if self.args.workers and self.args.max_connections:
+            self.parser.error("--max-connections is not supported with --workers")
+        if self.args.no_tcp and not self.args.unix_socket:
+            self.parser.error("--no-tcp requires --unix-socket")
+
+        if not self.args.no_tcp:
+            logger.info("Started server v%s listening on %s:%s (engine: %s)",
+                        self.version, self.args.listen, self.args.port, self.args.engine)
+        if self.args.unix_socket:
+            logger.info("Started server v%s listening on unix:%s (engine: %s)",
+                        self.version, self.args.unix_socket, self.args.engine)
+        servers = []
         try:
-            lock_server = server.TCPServer(self.args.listen, self.args.port)
+            servers = self.create_servers()
+            lock_server = servers[0]
+            if self.args.metrics_port:
+                metrics_server = MetricsServer(lock_server.context, self.args.metrics_listen or self.args.listen,
+                                               self.args.metrics_port)
+                metrics_server.start()
+                logger.info("Serving metrics on http://%s:%s/metrics", *metrics_server.server_address[:2])
         except BaseException as err:
             logger.debug('Error while bind()ing...', exc_info=True)
             print(str(err) or 'Error detected while creating server', file=sys.stderr)
+            for created_server in servers:
+                created_server.server_close()
             sys.exit(ERR_SERVER_BIND)
 
+        for other_server in servers[1:]:
+            threading.Thread(target=other_server.serve_forever, daemon=True).start()
         try:
             lock_server.serve_forever()
         except BaseException as err:
             logger.debug('Error while handling requests...', exc_info=True)
             print(str(err) or 'Error while handling requests', file=sys.stderr)
             sys.exit(ERR_HANDLING_REQUESTS)
+        finally:
+            for other_server in servers[1:]:
+                other_server.shutdown()
+            for created_server in servers:
+                created_server.server_close()  # stops the workers, removes the Unix domain socket
 
 
 def main():
@@ -1,6 +1,8 @@
-import json
 import logging
+import socket
 
+from tcpnetlock import constants
+from tcpnetlock.common import ServerBusyError
 from tcpnetlock.protocol import Protocol
 
 logger = logging.getLogger(__name__)
@@ -29,33 +31,64 @@ class ClientAction:
             )
         return response_code
 
-    def read_valid_response(self):
-        line = self.protocol.readline()
+    def read_valid_response(self, timeout: float = None):
+        line = self.protocol.readline(timeout=timeout)
+        if line is None:
+            raise socket.timeout("No response from server in {timeout} seconds".format(timeout=timeout))
+        if line == constants.RESPONSE_SERVER_BUSY:
+            # Sent instead of the response to the first request, if the server is serving too many connections
+            raise ServerBusyError("Server busy: too many connections")
         response_code = self.parse_and_validate_response(line)
         return response_code
 
     def get_message(self, **kwargs):
         return self.message
 
-    def handle(self, **kwargs):
+    def handle(self, timeout: float = None, **kwargs):
+        """Sends the message and returns the response. Raises socket.timeout if not received in `timeout` seconds"""
         message = self.get_message(**kwargs)
         logger.debug("Sending message to server: %s", message)
         self.protocol.send(message)
-        return self.read_valid_response()
+        return self.read_valid_response(timeout=timeout)
 
 
 class AcquireLockClientAction(ClientAction):
 
     GENERATE_CUSTOM_MESSAGE = True
 
-    def get_message(self, lock_name, **kwargs):
+    def get_message(self, lock_name=None, **kwargs):
         client_id = kwargs.pop('client_id')
-        message = "lock,name:{lock_name}".format(lock_name=lock_name)
+        wait = kwargs.pop('wait', None)
+        lock_names = kwargs.pop('lock_names', None)
+        keepalive_timeout = kwargs.pop('keepalive_timeout', None)
+        if lock_names:
+            message = "lock,names:{lock_names}".format(lock_names=constants.LOCK_NAMES_SEPARATOR.join(lock_names))
+        else:
+            message = "lock,name:{lock_name}".format(lock_name=lock_name)
         if client_id:
             message += ",client-id:{client_id}".format(client_id=client_id)
+        if wait:
+            message += ",wait:{wait}".format(wait=wait)
+        if keepalive_timeout:
+            message += ",keepalive-timeout:{timeout}".format(timeout=keepalive_timeout)
         return message
 
 
+class AcquireLeaseClientAction(AcquireLockClientAction):
+    """Acquires a lock with 'ttl'. The response includes the token of the lease, if it was granted"""
+
+    def get_message(self, lock_name=None, **kwargs):
+        ttl = kwargs.pop('ttl')
+        return super().get_message(lock_name, **kwargs) + ",ttl:{ttl}".format(ttl=ttl)
+
+    def parse_and_validate_response(self, line: str):
+        response_code = super().parse_and_validate_response(line)
+        token = None
+        if response_code == constants.RESPONSE_OK:
+            _, token = line.split(",token:", maxsplit=1)
+        return response_code, token
+
+
 class GetStatsClientAction(ClientAction):
 
     def parse_and_validate_response(self, line: str):
@@ -66,5 +99,31 @@ class GetStatsClientAction(ClientAction):
                 valid_response_codes=self.valid_responses,
                 line=line
             )
+        import json  # imported here: only needed for stats, and the clients must start fast
         stats = json.loads(json_encoded_dict)
         return response_code, stats
+
+
+class SessionClientAction(ClientAction):
+    """
+    Action sent inside a session. The request id is added to the message, and the response
+    must include the same request id.
+    """
+
+    def __init__(self, protocol: Protocol, message: str, valid_responses: list, request_id: int):
+        super().__init__(protocol, message, valid_responses)
+        self.request_id = str(request_id)
+
+    def get_message(self, **kwargs):
+        message = "{action},rid:{rid}".format(action=self.message, rid=self.request_id)
+        for key, value in sorted(kwargs.items()):
+            message += ",{key}:{value}".format(key=key, value=value)
+        return message
+
+    def parse_and_validate_response(self, line: str):
+        response_code, *params = line.split(",")
+        params = dict(param.split(":", 1) for param in params)
+        assert params.get('rid') == self.request_id, (
+            "Invalid request id in response. Expected: '{expected}'. Full line: {line}".format(
+                expected=self.request_id, line=line))
+        return super().parse_and_validate_response(line)
@@ -1,33 +1,64 @@
+import itertools
 import logging
 import socket
+import threading
+import typing
 
 from tcpnetlock import common
 from tcpnetlock import constants
+from tcpnetlock.client.action import AcquireLeaseClientAction
 from tcpnetlock.client.action import AcquireLockClientAction, GetStatsClientAction
 from tcpnetlock.client.action import ClientAction
+from tcpnetlock.client.action import SessionClientAction
+from tcpnetlock.common import TcpKeepalive
 from tcpnetlock.common import Utils
 from tcpnetlock.protocol import Protocol
-from tcpnetlock.server import server
 
 logger = logging.getLogger(__name__)
 
 
+def create_socket(host: str, port: int, tcp_keepalive: TcpKeepalive = None) -> typing.Tuple[socket.socket, object]:
+    """
+    Returns the socket to connect to the server, and the address to connect to: a Unix domain socket if `host`
+    is 'unix:<path>', or a TCP socket (with the TCP keepalives enabled, if `tcp_keepalive` is set)
+    """
+    if host.startswith(constants.UNIX_ADDRESS_PREFIX):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), host[len(constants.UNIX_ADDRESS_PREFIX):]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if tcp_keepalive is not None:
+        tcp_keepalive.apply(sock)
+    return sock, (host, port)
+
+
+def format_address(address) -> str:
+    """Formats an address returned by `create_socket()` as accepted by LockClient (ex: for logging)"""
+    if isinstance(address, str):
+        return constants.UNIX_ADDRESS_PREFIX + address
+    return '{}:{}'.format(*address)
+
+
 class LockClient:
-    DEFAULT_PORT = server.TCPServer.DEFAULT_PORT
+    DEFAULT_PORT = constants.DEFAULT_PORT
 
-    def __init__(self, host='localhost', port=DEFAULT_PORT, client_id=None):
+    def __init__(self, host='localhost', port=DEFAULT_PORT, client_id=None, tcp_keepalive: TcpKeepalive = None):
         """
         Creates a client to connect to the server.
 
-        :param host: hostname of the server
+        :param host: hostname of the server, or 'unix:<path>' to connect to the Unix domain socket of
+            a server running on the same host (`port` is ignored)
         :param port: port to connect
+        :param tcp_keepalive: if set, the kernel detects a dead server (or network) using TCP keepalives,
+            and the connection fails (see TcpKeepalive)
         """
         self._host = host
         self._port = port
         self._acquired = None
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket, self._address = create_socket(host, port, tcp_keepalive)
         self._protocol = Protocol(self._socket)
         self._client_id = client_id
+        self._io_lock = threading.Lock()
+        """Serializes the requests, so keepalives sent from the KeepaliveScheduler don't interleave with others"""
+        self._keepalive_scheduler = None
         Utils.validate_client_id(client_id)
 
     def connect(self):
@@ -37,14 +68,19 @@ class LockClient:
         :raises ConnectionRefusedError if connection is refused
         :return:
         """
-        logger.info("Connecting to '%s:%s'...", self._host, self._port)
-        self._socket.connect((self._host, self._port))
+        logger.info("Connecting to '%s'...", format_address(self._address))
+        self._socket.connect(self._address)
 
-    def lock(self, name: str) -> bool:
+    def lock(self, name: str, wait: float = None, keepalive_timeout: float = None) -> bool:
         """
         Tries to acquire a lock
 
         :param name: lock name
+        :param wait: if the lock is held by other client, how many seconds the server should wait for it to be
+            released before returning (waiting clients are granted the lock in FIFO order).
+            By default the server doesn't wait.
+        :param keepalive_timeout: if set, the server revokes the lock (and closes the connection) when it
+            receives nothing from the client for that many seconds. Use `keepalive()` to keep the lock.
         :return: boolean indicating if lock as acquired or not
         """
         if not Utils.valid_lock_name(name):
@@ -56,12 +92,83 @@ class LockClient:
             [constants.RESPONSE_OK,
              constants.RESPONSE_LOCK_NOT_GRANTED,
              constants.RESPONSE_ERR]
-        ).handle(lock_name=name, client_id=self._client_id)
+        ).handle(lock_name=name, client_id=self._client_id, wait=wait, keepalive_timeout=keepalive_timeout)
 
         # FIXME: raise specific exception if RESPONSE_ERR is received (ex: InvalidClientId)
         self._acquired = bool(response_code == constants.RESPONSE_OK)
         return self._acquired
 
+    def lock_many(self, names: list, wait: float = None, keepalive_timeout: float = None) -> bool:
+        """
+        Tries to acquire many locks at once: the server grants all of them, or none.
+
+        :param names: lock names
+        :param wait: how many seconds the server should wait for the locks (see `lock()`)
+        :param keepalive_timeout: revoke the locks if the client is silent for that many seconds (see `lock()`)
+        :return: boolean indicating if the locks were acquired or not
+        """
+        for name in names:
+            if not Utils.valid_lock_name(name):
+                raise common.InvalidLockNameError("Lock name is invalid: '{lock_name}'".format(lock_name=name))
+        if not names:
+            raise common.InvalidLockNameError("At least one lock name must be provided")
+
+        response_code = AcquireLockClientAction(
+            self._protocol,
+            None,
+            [constants.RESPONSE_OK,
+             constants.RESPONSE_LOCK_NOT_GRANTED,
+             constants.RESPONSE_ERR]
+        ).handle(lock_names=names, client_id=self._client_id, wait=wait,
+                 keepalive_timeout=keepalive_timeout)
+
+        self._acquired = bool(response_code == constants.RESPONSE_OK)
+        return self._acquired
+
+    def lease(self, name: str, ttl: float) -> typing.Optional[str]:
+        """
+        Tries to acquire a lock as a lease: the lock is held for `ttl` seconds, even after the connection
+        is closed (the server closes it after responding). Use the returned token to renew or release the lease
+        (using a new connection).
+
+        :param name: lock name
+        :param ttl: seconds the lease is valid, unless it's renewed
+        :return: the token of the lease, or None if the lock wasn't acquired
+        """
+        if not Utils.valid_lock_name(name):
+            raise common.InvalidLockNameError("Lock name is invalid: '{lock_name}'".format(lock_name=name))
+
+        response_code, token = AcquireLeaseClientAction(
+            self._protocol,
+            None,
+            [constants.RESPONSE_OK,
+             constants.RESPONSE_LOCK_NOT_GRANTED,
+             constants.RESPONSE_ERR]
+        ).handle(lock_name=name, client_id=self._client_id, ttl=ttl)
+        self._acquired = bool(response_code == constants.RESPONSE_OK)
+        return token
+
+    def renew(self, token: str, ttl: float = None) -> bool:
+        """
+        Postpones the expiration of a lease (`ttl` seconds from now, by default the ttl used to acquire it).
+        Returns False if the lease doesn't exist (ex: it already expired).
+        """
+        message = "{action},token:{token}".format(action=constants.ACTION_RENEW, token=token)
+        if ttl:
+            message += ",ttl:{ttl}".format(ttl=ttl)
+        response_code = ClientAction(self._protocol,
+                                     message,
+                                     [constants.RESPONSE_OK, constants.RESPONSE_ERR]).handle()
+        return response_code == constants.RESPONSE_OK
+
+    def release_lease(self, token: str) -> bool:
+        """Releases a lease. Returns False if the lease doesn't exist (ex: it already expired)"""
+        message = "{action},token:{token}".format(action=constants.ACTION_RELEASE, token=token)
+        response_code = ClientAction(self._protocol,
+                                     message,
+                                     [constants.RESPONSE_RELEASED, constants.RESPONSE_ERR]).handle()
+        return response_code == constants.RESPONSE_RELEASED
+
     def server_shutdown(self):
         """Send order to shutdown the server"""
         return ClientAction(self._protocol,
@@ -80,17 +187,45 @@ class LockClient:
                                     constants.ACTION_STATS,
                                     constants.RESPONSE_STATS_COMING).handle()
 
-    def keepalive(self):
-        """Send a keepalive to the server"""
-        return ClientAction(self._protocol,
-                            constants.ACTION_KEEPALIVE,
-                            [constants.RESPONSE_STILL_ALIVE]).handle()
+    def top(self, count: int = None):
+        """Get the lock names with most grants, 'not-granted' responses and time held"""
+        message = constants.ACTION_TOP
+        if count:
+            message += ",count:{count}".format(count=count)
+        return GetStatsClientAction(self._protocol,
+                                    message,
+                                    constants.RESPONSE_TOP_COMING).handle()
+
+    def keepalive(self, timeout: float = None):
+        """Send a keepalive to the server. Raises socket.timeout if the response isn't received in `timeout` seconds"""
+        with self._io_lock:
+            return ClientAction(self._protocol,
+                                constants.ACTION_KEEPALIVE,
+                                [constants.RESPONSE_STILL_ALIVE]).handle(timeout=timeout)
+
+    def start_keepalives(self, interval: float, scheduler=None):
+        """
+        Sends a keepalive every `interval` seconds, from the thread of `scheduler` (a KeepaliveScheduler, by default
+        the one shared by all the clients of the process), until the lock is released or the client is closed.
+        """
+        # Imported here, so clients that don't send keepalives don't pay for it at startup
+        from tcpnetlock.client.keepalive import KeepaliveScheduler
+        self.stop_keepalives()
+        self._keepalive_scheduler = scheduler or KeepaliveScheduler.default()
+        self._keepalive_scheduler.add(self, interval)
+
+    def stop_keepalives(self):
+        if self._keepalive_scheduler is not None:
+            self._keepalive_scheduler.remove(self)
+            self._keepalive_scheduler = None
 
     def release(self):
         """Release the held lock"""
-        return ClientAction(self._protocol,
-                            constants.ACTION_RELEASE,
-                            [constants.RESPONSE_RELEASED]).handle()
+        self.stop_keepalives()
+        with self._io_lock:
+            return ClientAction(self._protocol,
+                                constants.ACTION_RELEASE,
+                                [constants.RESPONSE_RELEASED]).handle()
 
     def check_connection(self):
         """
@@ -98,8 +233,36 @@ class LockClient:
         """
         self._protocol.check_connection()
 
+    def fileno(self) -> int:
+        """Returns the file descriptor of the connection. The lock is held while it's open (in any process)"""
+        return self._socket.fileno()
+
+    def wait_until_lost(self, timeout: float = None) -> bool:
+        """
+        Blocks until the connection with the server is closed or reset (so the lock is lost, or will be released
+        as soon as the server notices the disconnection), and returns True. Returns False if `timeout` seconds
+        pass first. Uses no CPU while waiting (the thread sleeps in `poll()`/`select()` on the socket).
+
+        Must not be called while other thread uses the client (ex: sending keepalives).
+        """
+        return self._protocol.wait_until_closed(timeout)
+
+    def on_lost(self, callback) -> threading.Thread:
+        """
+        Calls `callback` (from a new daemon thread) when the connection with the server is lost.
+        See `wait_until_lost()`.
+        """
+        def watch():
+            self.wait_until_lost()
+            callback()
+
+        thread = threading.Thread(target=watch, name='tcpnetlock-lost-watcher', daemon=True)
+        thread.start()
+        return thread
+
     def close(self):
         """Close the socket. As a result of the disconnection, the lock will be released at the server."""
+        self.stop_keepalives()
         logger.debug("Closing the socket...")
         self._protocol.close()
 
@@ -111,3 +274,105 @@ class LockClient:
         """
         assert self._acquired in (True, False)  # Fail if lock() wasn't called
         return self._acquired
+
+
+class LockSession:
+    DEFAULT_PORT = LockClient.DEFAULT_PORT
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, client_id=None, tcp_keepalive: TcpKeepalive = None):
+        """
+        Creates a client to acquire many locks over a single connection to the server.
+        When the session is closed, the server releases all the locks held by the session.
+
+        :param host: hostname of the server, or 'unix:<path>' (see LockClient)
+        :param port: port to connect
+        :param tcp_keepalive: if set, the kernel detects a dead server using TCP keepalives (see LockClient)
+        """
+        self._host = host
+        self._port = port
+        self._socket, self._address = create_socket(host, port, tcp_keepalive)
+        self._protocol = Protocol(self._socket)
+        self._client_id = client_id
+        self._request_ids = itertools.count(1)
+        self._held = set()
+        Utils.validate_client_id(client_id)
+
+    def connect(self):
+        """
+        Connects to server and starts the session.
+
+        :raises ConnectionRefusedError if connection is refused
+        """
+        logger.info("Connecting to '%s'...", format_address(self._address))
+        self._socket.connect(self._address)
+        message = constants.ACTION_SESSION
+        if self._client_id:
+            message += ",client-id:{client_id}".format(client_id=self._client_id)
+        ClientAction(self._protocol, message, [constants.RESPONSE_OK]).handle()
+
+    def _handle(self, action: str, valid_responses: list, **kwargs):
+        return SessionClientAction(self._protocol, action, valid_responses, next(self._request_ids)).handle(**kwargs)
+
+    def lock(self, name: str) -> bool:
+        """
+        Tries to acquire a lock
+
+        :param name: lock name
+        :return: boolean indicating if lock as acquired or not
+        """
+        if not Utils.valid_lock_name(name):
+            raise common.InvalidLockNameError("Lock name is invalid: '{lock_name}'".format(lock_name=name))
+
+        response_code = self._handle(constants.ACTION_LOCK,
+                                     [constants.RESPONSE_OK,
+                                      constants.RESPONSE_LOCK_NOT_GRANTED,
+                                      constants.RESPONSE_ERR],
+                                     name=name)
+        acquired = bool(response_code == constants.RESPONSE_OK)
+        if acquired:
+            self._held.add(name)
+        return acquired
+
+    def lock_many(self, names: list) -> bool:
+        """
+        Tries to acquire many locks at once: the server grants all of them, or none.
+
+        :param names: lock names
+        :return: boolean indicating if the locks were acquired or not
+        """
+        for name in names:
+            if not Utils.valid_lock_name(name):
+                raise common.InvalidLockNameError("Lock name is invalid: '{lock_name}'".format(lock_name=name))
+        if not names:
+            raise common.InvalidLockNameError("At least one lock name must be provided")
+
+        response_code = self._handle(constants.ACTION_LOCK,
+                                     [constants.RESPONSE_OK,
+                                      constants.RESPONSE_LOCK_NOT_GRANTED,
+                                      constants.RESPONSE_ERR],
+                                     names=constants.LOCK_NAMES_SEPARATOR.join(names))
+        acquired = bool(response_code == constants.RESPONSE_OK)
+        if acquired:
+            self._held.update(names)
+        return acquired
+
+    def release(self, name: str):
+        """Release a lock held by the session"""
+        response_code = self._handle(constants.ACTION_RELEASE, [constants.RESPONSE_RELEASED], name=name)
+        self._held.discard(name)
+        return response_code
+
+    def keepalive(self):
+        """Send a keepalive to the server"""
+        return self._handle(constants.ACTION_KEEPALIVE, [constants.RESPONSE_STILL_ALIVE])
+
+    def close(self):
+        """Close the socket. As a result of the disconnection, all the locks of the session will be released"""
+        logger.debug("Closing the socket...")
+        self._held.clear()
+        self._protocol.close()
+
+    @property
+    def held(self) -> frozenset:
+        """Returns the names of the locks held by the session"""
+        return frozenset(self._held)
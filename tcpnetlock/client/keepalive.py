@@ -0,0 +1,76 @@
+import logging
+import threading
+
+from tcpnetlock.timers import Timer
+from tcpnetlock.timers import TimerThread
+
+logger = logging.getLogger(__name__)
+
+
+class KeepaliveScheduler:
+    """
+    Sends the keepalives of many clients (LockClient instances holding a lock) from a single thread.
+
+    The thread sleeps until the next keepalive is due (see TimerThread): clients holding locks cause no wakeups
+    between keepalives, and `remove()` takes effect immediately (there is no thread to stop).
+
+    Keepalives of different clients are sent one after the other: a client whose server is slow to respond
+    delays the keepalives of the rest, up to `interval` seconds. A client that gets no valid response in that
+    time (or any other error) is removed, and gets no more keepalives.
+    """
+
+    _default = None
+    _default_mutex = threading.Lock()
+
+    def __init__(self, timers: TimerThread = None):
+        self._timers = timers or TimerThread(name='tcpnetlock-keepalives')
+        self._mutex = threading.Lock()
+        self._scheduled = {}
+        """The pending Timer of each client"""
+
+    @classmethod
+    def default(cls) -> 'KeepaliveScheduler':
+        """Returns the scheduler shared by all the clients of the process"""
+        with cls._default_mutex:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def add(self, lock_client, interval: float):
+        """Sends a keepalive using `lock_client` every `interval` seconds, until `remove()` is called"""
+        with self._mutex:
+            previous = self._scheduled.get(lock_client)
+            if previous is not None:
+                previous.cancel()
+            self._scheduled[lock_client] = self._schedule(lock_client, interval)
+
+    def remove(self, lock_client):
+        with self._mutex:
+            timer = self._scheduled.pop(lock_client, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _schedule(self, lock_client, interval: float) -> Timer:
+        return self._timers.schedule(interval, lambda: self._send(lock_client, interval))
+
+    def _send(self, lock_client, interval: float):
+        if lock_client not in self:
+            return
+        try:
+            logger.debug("Sending keepalive")
+            lock_client.keepalive(timeout=interval)
+        except Exception:
+            if lock_client in self:
+                logger.warning("Error detected while sending keepalive. Keepalives will not be sent anymore",
+                               exc_info=True)
+            self.remove(lock_client)
+            return
+        with self._mutex:
+            if lock_client in self._scheduled:
+                self._scheduled[lock_client] = self._schedule(lock_client, interval)
+
+    def __contains__(self, lock_client) -> bool:
+        return lock_client in self._scheduled
+
+    def __len__(self):
+        return len(self._scheduled)
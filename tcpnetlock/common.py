@@ -1,3 +1,7 @@
+import itertools
+import socket
+import threading
+
 import tcpnetlock.constants
 
 
@@ -22,6 +26,12 @@ class ClientDisconnected(TcpNetLockException):
     pass
 
 
+class LineTooLongError(TcpNetLockException):
+    """
+    Raised by Protocol when the peer sends a line longer than the maximum allowed.
+    """
+
+
 class InvalidClientIdError(TcpNetLockException):
     """
     Raised by the client if the provided client-id is not valid.
@@ -34,6 +44,54 @@ class InvalidLockNameError(TcpNetLockException):
     """
 
 
+class ServerBusyError(TcpNetLockException):
+    """
+    Raised by the client if the server refused the connection because it's serving too many connections.
+    The server closes the connection: retry later, with a new connection.
+    """
+
+
+class TcpKeepalive:
+    """
+    Kernel-level detection of dead peers, for the sockets of clients and servers. The kernel sends TCP keepalive
+    probes after `idle` seconds without traffic, every `interval` seconds, and drops the connection after `count`
+    probes are not answered. If `user_timeout` is set, the connection is also dropped when data sent stays
+    unacknowledged for that many seconds (TCP_USER_TIMEOUT).
+
+    A dead peer is found in about `idle + interval * count` seconds, without waking up the application: a blocked
+    `recv()` fails once the kernel drops the connection.
+
+    Options not available in the platform are skipped.
+    """
+
+    __slots__ = ('idle', 'interval', 'count', 'user_timeout')
+
+    def __init__(self, idle: int = 30, interval: int = 5, count: int = 3, user_timeout: float = None):
+        self.idle = idle
+        self.interval = interval
+        self.count = count
+        self.user_timeout = user_timeout
+
+    def apply(self, sock: socket.socket):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # macOS names TCP_KEEPIDLE as TCP_KEEPALIVE
+        idle_option = getattr(socket, 'TCP_KEEPIDLE', getattr(socket, 'TCP_KEEPALIVE', None))
+        options = (
+            (idle_option, self.idle),
+            (getattr(socket, 'TCP_KEEPINTVL', None), self.interval),
+            (getattr(socket, 'TCP_KEEPCNT', None), self.count),
+        )
+        if self.user_timeout:
+            options += ((getattr(socket, 'TCP_USER_TIMEOUT', None), int(self.user_timeout * 1000)),)
+        for option, value in options:
+            if option is not None and value:
+                sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+    def __str__(self):
+        return "TcpKeepalive: idle: {idle}, interval: {interval}, count: {count}, user_timeout: {user_timeout}".format(
+            idle=self.idle, interval=self.interval, count=self.count, user_timeout=self.user_timeout)
+
+
 class Utils:
 
     @staticmethod
@@ -54,17 +112,57 @@ class Utils:
             raise InvalidClientIdError("The provided client-id is not valid")
 
 
-class Counter:
-    """Counter, just that.
-    We don't care about atomicity.
+_thread_slots = threading.local()
+_next_thread_slot = itertools.count()
+
+
+def get_thread_slot() -> int:
+    """
+    Returns a number identifying the calling thread, assigned round-robin the first time a thread calls it
+    (unlike `threading.get_ident()`, consecutive threads get consecutive numbers: use it modulo the number
+    of shards to spread the threads over them)
     """
+    try:
+        return _thread_slots.slot
+    except AttributeError:
+        slot = _thread_slots.slot = next(_next_thread_slot)
+        return slot
+
+
+class _CounterCell:
+    """One of the cells of a StripedCounter, incremented by the threads assigned to it"""
+
+    __slots__ = ('value', 'mutex')
+
+    def __init__(self):
+        self.value = 0
+        self.mutex = threading.Lock()
+
+
+class StripedCounter:
+    """
+    Counter that is exact when incremented from many threads, without a lock shared by all of them on `incr()`.
+
+    The counter is split in `CELLS` cells, each with its own mutex. The threads are assigned to the cells
+    round-robin (see `get_thread_slot()`), so threads incrementing at the same time rarely wait for each other.
+    `count` adds up the cells. The memory used is fixed, no matter how many threads increment the counter
+    (ex: one per connection).
+    """
+
+    CELLS = 16
 
     def __init__(self):
-        self._count = 0
+        self._cells = tuple(_CounterCell() for _ in range(self.CELLS))
 
     @property
     def count(self):
-        return self._count
+        total = 0
+        for cell in self._cells:
+            with cell.mutex:
+                total += cell.value
+        return total
 
     def incr(self):
-        self._count += 1
+        cell = self._cells[get_thread_slot() % self.CELLS]
+        with cell.mutex:
+            cell.value += 1
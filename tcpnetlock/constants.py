@@ -1,5 +1,9 @@
 import re
 
+DEFAULT_PORT = 7654
+UNIX_ADDRESS_PREFIX = 'unix:'
+"""Clients connect to a Unix domain socket when the host is 'unix:<path>'"""
+
 RESPONSE_OK = 'ok'
 RESPONSE_ERR = 'err'
 RESPONSE_INVALID_ACTION = 'bad-action'
@@ -9,14 +13,21 @@ RESPONSE_RELEASED = 'released'
 RESPONSE_SHUTTING_DOWN = 'shutting-down'
 RESPONSE_PONG = 'pong'
 RESPONSE_STATS_COMING = 'stats'
+RESPONSE_TOP_COMING = 'top'
 RESPONSE_STILL_ALIVE = 'alive'
+RESPONSE_SERVER_BUSY = 'busy'
 
 ACTION_LOCK = 'lock'
 ACTION_RELEASE = 'release'
+ACTION_RENEW = 'renew'
+ACTION_SESSION = 'session'
 ACTION_SERVER_SHUTDOWN = '.server-shutdown'
 ACTION_PING = '.ping'
 ACTION_KEEPALIVE = '.keepalive'
 ACTION_STATS = '.stats'
+ACTION_TOP = '.top'
+
+LOCK_NAMES_SEPARATOR = ';'
 
 VALID_LOCK_NAME_RE = re.compile(r'^[a-zA-Z0-9_-]+$')
 VALID_CLIENT_ID_RE = re.compile(r'^[a-zA-Z0-9\.@_-]+$')
@@ -1,8 +1,12 @@
 import logging
+import os
+import selectors
 import socket
+import time
 
 from tcpnetlock.constants import NEW_LINE_BINARY
 from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.common import LineTooLongError
 
 logger = logging.getLogger(__name__)
 
@@ -11,12 +15,35 @@ class Protocol:
     """
     Encapsulates the read/write operations on the socket for the string, line-oriented protocol used
     by the server and client.
+
+    Received data is read with `recv_into()` into a buffer owned by the connection (no bytes object per `recv()`).
+    The buffer starts small (`INITIAL_BUFFER_SIZE`: lines are usually tens of bytes, and a connection holding
+    a lock costs little memory), and grows only when a line doesn't fit or a read fills it (the peer sends lines
+    faster than they're read), up to `max_buffer_size`.
+    The buffer is scanned incrementally: each received byte is looked at only once while searching for the end
+    of the line.
+
+    Lines longer than `max_line_length` raise LineTooLongError as soon as the data received is enough to know
+    the line is too long (without waiting for the end of the line).
     """
-    # FIXME: control length of line
 
-    def __init__(self, sock: socket.socket):
+    MAX_LINE_LENGTH = int(os.environ.get('TCPNETLOCK_MAX_LINE_LENGTH', '4096'))
+    MIN_BUFFER_SIZE = 4096
+    """The buffer can grow up to this size, even if `max_line_length` is smaller (ex: for pipelined lines)"""
+    INITIAL_BUFFER_SIZE = 256
+
+    def __init__(self, sock: socket.socket, max_line_length: int = None):
         self.socket = sock
-        self.buffer = bytearray()
+        self.max_line_length = max_line_length or self.MAX_LINE_LENGTH
+        self.max_buffer_size = max(self.MIN_BUFFER_SIZE, self.max_line_length + 1)
+        self._buffer = bytearray(min(self.INITIAL_BUFFER_SIZE, self.max_buffer_size))
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        """Position of the first byte not yet returned as part of a line"""
+        self._end = 0
+        """Position after the last byte received"""
+        self._scan = 0
+        """Position where the search for the end of line must continue (bytes before it don't contain it)"""
 
     def close(self):
         logger.debug("socket.close()")
@@ -26,27 +53,83 @@ class Protocol:
         logger.debug("socket.sendall('%s')", message)
         self.socket.sendall((message + '\n').encode())
 
+    def _find_end_of_line(self) -> int:
+        """
+        Returns the position of the end of the first line in the buffer, or -1 if there is no full line.
+        Raises LineTooLongError if the line is (or will be, once fully received) too long.
+        """
+        position = self._buffer.find(NEW_LINE_BINARY, self._scan, self._end)
+        if position >= 0:
+            self._scan = position
+            line_length = position - self._start
+        else:
+            self._scan = self._end
+            line_length = self._end - self._start
+        if line_length > self.max_line_length:
+            raise LineTooLongError("Line longer than {max} bytes".format(max=self.max_line_length))
+        return position
+
     def _line_in_buffer(self):
-        return self.buffer.find(NEW_LINE_BINARY) >= 0
+        return self._find_end_of_line() >= 0
+
+    def _get_line_from_buffer(self, position: int) -> str:
+        """Returns the line ending at `position` (as returned by `_find_end_of_line()`)"""
+        line = self._buffer[self._start:position].decode()
+        self._start = self._scan = position + 1
+        if self._start == self._end:
+            # Common case: all the data received was consumed, reuse the buffer from the beginning
+            self._start = self._end = self._scan = 0
+        return line
+
+    def _recv(self, max_bytes: int = None):
+        """Receives data into the buffer. Raises ClientDisconnected if socket is closed"""
+        if self._end == len(self._buffer):
+            # The buffer was filled by the last read: more data is probably waiting, grow the buffer (if possible)
+            # so each read gets more of it
+            self._make_room(1, grow=True)
+        view = self._view[self._end:] if max_bytes is None else self._view[self._end:self._end + max_bytes]
+        received = self.socket.recv_into(view)
+        if not received:
+            raise ClientDisconnected()
+        self._end += received
 
-    def _get_line_from_buffer(self) -> str:
-        assert self._line_in_buffer()
-        head, tail = self.buffer.split(NEW_LINE_BINARY, 1)
-        self.buffer = tail
-        return head.decode()
+    def _make_room(self, size: int, grow: bool = False):
+        """
+        Makes room for `size` more bytes after the data received: moves the pending data to the beginning of
+        the buffer, and grows the buffer if that's not enough (or if `grow` is True, and the buffer can grow).
+        Raises LineTooLongError if the buffer can't grow more (the pending data is a line too long, or lines
+        not read yet: the peer doesn't wait for the responses)
+        """
+        if self._start > 0:
+            pending = self._end - self._start
+            self._buffer[:pending] = self._view[self._start:self._end]
+            self._scan -= self._start
+            self._start, self._end = 0, pending
+        if grow and len(self._buffer) < self.max_buffer_size:
+            size = max(size, len(self._buffer) + 1 - self._end)
+        if self._end + size <= len(self._buffer):
+            return
+        if self._end + size > self.max_buffer_size:
+            raise LineTooLongError("Buffer full: {size} bytes pending".format(size=self._end))
+        new_size = len(self._buffer)
+        while new_size < self._end + size:
+            new_size *= 2
+        buffer = bytearray(min(new_size, self.max_buffer_size))
+        buffer[:self._end] = self._view[:self._end]
+        self._view.release()
+        self._buffer, self._view = buffer, memoryview(buffer)
 
     def _readline_blocking(self) -> str:
         """Returns line, or raises ClientDisconnected if socket is closed"""
-        logger.debug('Disabling socket timeout (will block)')
-        self.socket.settimeout(None)
+        if self.socket.gettimeout() is not None:
+            logger.debug('Disabling socket timeout (will block)')
+            self.socket.settimeout(None)
         while True:
             logger.debug('Reading from socket')
-            recv_data = self.socket.recv(128)
-            if not recv_data:
-                raise ClientDisconnected()
-            self.buffer.extend(recv_data)
-            if self._line_in_buffer():
-                return self._get_line_from_buffer()
+            self._recv()
+            position = self._find_end_of_line()
+            if position >= 0:
+                return self._get_line_from_buffer(position)
 
     def _readline_non_blocking(self, timeout: int) -> str:
         """Wait for up to `timeout` for a line"""
@@ -54,19 +137,48 @@ class Protocol:
         logger.debug('Setting socket timeout to %s', timeout)
         self.socket.settimeout(timeout)
         while True:
-            if self._line_in_buffer():
-                return self._get_line_from_buffer()
+            position = self._find_end_of_line()
+            if position >= 0:
+                return self._get_line_from_buffer(position)
             try:
                 logger.debug('Reading from socket')
-                recv_data = self.socket.recv(128)
-                if recv_data:
-                    self.buffer.extend(recv_data)
-                else:
-                    raise ClientDisconnected()
+                self._recv()
             except socket.timeout:
                 logger.debug('Reading from socket TIMED OUT')
                 return None
 
+    def feed(self, data: bytes):
+        """
+        Adds `data` to the buffer, as if it was received from the socket (ex: data received by other process,
+        before the connection was handed off to this one).
+        """
+        if self._end + len(data) > len(self._buffer):
+            self._make_room(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def pending_data(self) -> bytes:
+        """Returns the data received and not yet returned by `readline()`"""
+        return bytes(self._view[self._start:self._end])
+
+    def has_line(self) -> bool:
+        """Returns True if there is a full line in the buffer (so `readline()` will not touch the socket)"""
+        return self._line_in_buffer()
+
+    def read_available(self):
+        """
+        Reads the data available in the socket, without waiting for more. Used when the socket is non-blocking
+        and the caller knows it is readable (ex: reported by a selector).
+
+        Raises ClientDisconnected if socket is closed, and LineTooLongError if the pending line is too long.
+        """
+        try:
+            logger.debug('Reading available data from socket')
+            self._recv()
+        except BlockingIOError:
+            return
+        self._find_end_of_line()
+
     def readline(self, timeout=None) -> str:
         """
         Reads socket and returns a line.
@@ -76,14 +188,40 @@ class Protocol:
         :return: line or None
         """
 
-        if self._line_in_buffer():
-            return self._get_line_from_buffer()
+        position = self._find_end_of_line()
+        if position >= 0:
+            return self._get_line_from_buffer(position)
 
         if timeout is None:
             return self._readline_blocking()
         else:
             return self._readline_non_blocking(timeout=timeout)
 
+    def wait_until_closed(self, timeout: float = None, interrupt: socket.socket = None) -> bool:
+        """
+        Blocks until the peer closes (or resets) the connection, and returns True. Returns False if `timeout`
+        seconds pass first, or as soon as `interrupt` (if given) is readable. The thread sleeps in the selector
+        meanwhile: an idle connection costs no wakeups.
+
+        Data received in the meantime is kept in the buffer (and read by `readline()`).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_READ)
+            if interrupt is not None:
+                selector.register(interrupt, selectors.EVENT_READ)
+            while True:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                events = selector.select(remaining)
+                if not events or any(key.fileobj is interrupt for key, _ in events):
+                    return False
+                try:
+                    self._recv()
+                except (ClientDisconnected, ConnectionError):
+                    return True
+                except (BlockingIOError, socket.timeout):
+                    pass
+
     def check_connection(self):
         """
         Raises ClientDisconnected if connection is closed (this is used to detect cases like if the server died).
@@ -91,11 +229,6 @@ class Protocol:
         # FIXME: must be a better way to implement this check :/
         self.socket.settimeout(1)
         try:
-            recv_data = self.socket.recv(1)
+            self._recv(max_bytes=1)
         except socket.timeout:
             return  # this is not a guaranty that TCP connection still exists
-
-        if recv_data:
-            self.buffer.extend(recv_data)
-        else:
-            raise ClientDisconnected()
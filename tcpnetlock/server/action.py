@@ -1,31 +1,60 @@
 class Action:
+    """
+    A request received from the client: the action name, and the parameters.
 
-    def __init__(self, action: str, params: dict):
+    This is created for every line received, so it's kept cheap: the parameters are parsed only when
+    `params` is accessed (for actions like '.keepalive' or '.ping' they are never parsed), and the common
+    shapes ('release', 'lock,name:<name>') avoid splitting and intermediate lists.
+    """
+
+    __slots__ = ('action', '_params', '_raw_params')
+
+    def __init__(self, action: str, params: dict = None, raw_params: str = None):
         self.action = action
-        self.params = params
+        self._params = params
+        self._raw_params = raw_params
+        """The text after the first ',' of the line. Parsed (and discarded) when `params` is accessed"""
 
     @property
     def name(self):
         return self.action
 
+    @property
+    def params(self) -> dict:
+        if self._params is None:
+            self._params = self._parse_params(self._raw_params)
+            self._raw_params = None
+        return self._params
+
     def is_valid(self):
         # action, and param keys must be non-empty
-        return \
-            len(self.action) > 0 \
-            and all(len(p) > 0 for p in self.params.keys())
+        if not self.action:
+            return False
+        if self._params is None and self._raw_params is None:
+            return True
+        return all(self.params.keys())
+
+    @staticmethod
+    def _parse_params(raw_params: str) -> dict:
+        if raw_params is None:
+            return {}
+        if ',' not in raw_params:
+            # Single parameter (ex: 'lock,name:<name>')
+            key, _, value = raw_params.partition(':')
+            return {key.strip(): value.strip()}
+        params = {}
+        for raw_param in raw_params.split(','):
+            key, _, value = raw_param.partition(':')
+            params[key.strip()] = value.strip()
+        return params
 
     @classmethod
     def from_line(cls, line: str):
-        action, *raw_params = line.split(',')
-        params = []
-        for key, *values in [p.split(':', 1) for p in raw_params]:
-            if values:
-                assert len(values) == 1
-                param = [key.strip(), values[0].strip()]
-            else:
-                param = [key.strip(), '']
-            params.append(param)
-        return Action(action.strip(), dict(params))
+        action, comma, raw_params = line.partition(',')
+        if not comma:
+            # No parameters (ex: '.keepalive', 'release')
+            return cls(action.strip())
+        return cls(action.strip(), raw_params=raw_params)
 
     def __str__(self):
         if self.params:
@@ -1,67 +1,109 @@
+import functools
 import json
 import logging
+import math
 import resource
+import socket
+import time
+import typing
 
 from tcpnetlock import constants as const
 from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.common import LineTooLongError
 from tcpnetlock.protocol import Protocol
 from tcpnetlock.server.action import Action
 from tcpnetlock.server.context import Context
+from tcpnetlock.server.lock import Lock
+from tcpnetlock.server.lock import Waiter
+from tcpnetlock.server.registry import ActionRegistry
+from tcpnetlock.timers import Deadline
 
 logger = logging.getLogger(__name__)
 
 
 __all__ = [
+    'StatelessActionHandler',
     'ShutdownActionHandler',
     'PingActionHandler',
     'StatsActionHandler',
+    'TopActionHandler',
+    'InvalidRequestActionHandler',
+    'LineTooLongActionHandler',
+    'InvalidActionActionHandler',
     'InvalidLockActionHandler',
+    'InvalidParameterActionHandler',
     'LockNotGrantedActionHandler',
+    'LockActionHandler',
+    'RenewLeaseActionHandler',
+    'ReleaseLeaseActionHandler',
+    'LockWaitActionHandler',
+    'InteractiveActionHandler',
     'LockGrantedActionHandler',
+    'SessionActionHandler',
     'InnerReleaseLockActionHandler',
     'InnerKeepAliveActionHandler',
+    'InnerInvalidActionActionHandler',
 ]
 
 
-class ActionHandler:
-    def __init__(self, protocol: Protocol, action: Action):
-        self.protocol = protocol
-        self.action = action
+def get_lock_names(action: Action) -> typing.Optional[typing.List[str]]:
+    """
+    Returns the lock names requested by the client: the 'name' parameter, or the 'names' parameter, with
+    many lock names separated by ';'. Returns None if a lock name is missing or invalid.
+    """
+    if 'names' in action.params:
+        if 'name' in action.params:
+            return None
+        lock_names = [lock_name.strip() for lock_name in action.params['names'].split(const.LOCK_NAMES_SEPARATOR)]
+    else:
+        lock_names = [action.params.get('name')]
 
+    if not all(lock_name and const.VALID_LOCK_NAME_RE.match(lock_name) for lock_name in lock_names):
+        return None
+    return lock_names
 
-class ShutdownActionHandler(ActionHandler):
 
-    def __init__(self, *args, **kwargs):
-        self.server = kwargs.pop('server')
-        super().__init__(*args, **kwargs)
+class StatelessActionHandler:
+    """
+    Base class for handlers that keep no per-request state: a single instance, created when the server starts,
+    serves all the requests.
+
+    The instance is called with the protocol and the action. It sends the response and closes the connection
+    (returning None), or returns the ActionHandler that will serve the connection from now on.
+    """
+
+    def __call__(self, protocol: Protocol, action: Action) -> typing.Optional['ActionHandler']:
+        raise NotImplementedError()
+
+
+class ShutdownActionHandler(StatelessActionHandler):
+
+    def __init__(self, server):
+        self.server = server
 
     def can_proceed(self):
         # FIXME: assert connections came from localhost
         return True
 
-    def handle_action(self):
+    def __call__(self, protocol: Protocol, action: Action):
         if not self.can_proceed():
             pass  # FIXME: do something
-        self.protocol.send(const.RESPONSE_SHUTTING_DOWN)
+        protocol.send(const.RESPONSE_SHUTTING_DOWN)
         self.server.shutdown()
-        self.protocol.close()
-
+        protocol.close()
 
-class PingActionHandler(ActionHandler):
 
-    def handle_action(self):
-        self.protocol.send(const.RESPONSE_PONG)
-        self.protocol.close()
+class PingActionHandler(StatelessActionHandler):
 
+    def __call__(self, protocol: Protocol, action: Action):
+        protocol.send(const.RESPONSE_PONG)
+        protocol.close()
 
-class StatsActionHandler(ActionHandler):
 
-    def __init__(self, *args, **kwargs):
-        self._context = self.__pop_context(kwargs)
-        super().__init__(*args, **kwargs)
+class StatsActionHandler(StatelessActionHandler):
 
-    def __pop_context(self, kwargs) -> Context:
-        return kwargs.pop('context')
+    def __init__(self, context: Context):
+        self._context = context
 
     def _get_maxrss(self):
         try:
@@ -70,111 +112,637 @@ class StatsActionHandler(ActionHandler):
             logger.warning("resource.getrusage() failed", exc_info=True)
             return 'n/a'
 
-    def handle_action(self):
+    def __call__(self, protocol: Protocol, action: Action):
         stats = {
             'lock_count': len(self._context.locks),
+            'lease_count': len(self._context.leases),
+            'lock_table_shards': self._context.locks.shard_count,
+            'lock_table_contention': self._context.locks.contention(),
             'maxrss': self._get_maxrss(),
         }
         stats.update(self._context.counters())
-        self.protocol.send("{},{}".format(const.RESPONSE_STATS_COMING, json.dumps(stats)))
-        self.protocol.close()
+        stats.update(self._context.histograms())
+        protocol.send("{},{}".format(const.RESPONSE_STATS_COMING, json.dumps(stats)))
+        protocol.close()
 
 
-class InvalidActionActionHandler(ActionHandler):
-    def handle_action(self):
-        logger.warning("Received invalid action: '%s'", self.action.name)
-        self.protocol.send(const.RESPONSE_INVALID_ACTION)
-        self.protocol.close()
+class InvalidRequestActionHandler(StatelessActionHandler):
 
+    def __call__(self, protocol: Protocol, action: Action):
+        logger.warning("Received invalid request: '%s'", action)
+        protocol.send(const.RESPONSE_INVALID_REQUEST)
+        protocol.close()
 
-class InvalidLockActionHandler(ActionHandler):
-    def __init__(self, *args, **kwargs):
-        self.lock_name = kwargs.pop('lock_name')
-        super().__init__(*args, **kwargs)
 
-    def handle_action(self):
-        logger.warning("Received invalid lock name: '%s'", self.lock_name)
-        self.protocol.send(const.RESPONSE_ERR + ',invalid lock name')
-        self.protocol.close()
+class LineTooLongActionHandler(StatelessActionHandler):
+    """Rejects a client that sent a line longer than allowed. The line itself is not read (`action` is None)"""
 
+    def __call__(self, protocol: Protocol, action: Action):
+        logger.warning("Received line too long (max %s bytes). Will close the connection.",
+                       protocol.max_line_length)
+        try:
+            protocol.send(const.RESPONSE_INVALID_REQUEST)
+        except OSError:
+            pass
+        protocol.close()
 
-class LockNotGrantedActionHandler(ActionHandler):
-    def __init__(self, *args, **kwargs):
-        self.lock_name = kwargs.pop('lock_name')
-        super().__init__(*args, **kwargs)
 
-    def handle_action(self):
-        logger.info("Lock NOT granted: %s", self.lock_name)
-        self.protocol.send(const.RESPONSE_LOCK_NOT_GRANTED)
-        self.protocol.close()
+class InvalidActionActionHandler(StatelessActionHandler):
+
+    def __call__(self, protocol: Protocol, action: Action):
+        logger.warning("Received invalid action: '%s'", action.name)
+        protocol.send(const.RESPONSE_INVALID_ACTION)
+        protocol.close()
+
+
+class InvalidLockActionHandler(StatelessActionHandler):
+
+    def __call__(self, protocol: Protocol, action: Action):
+        logger.warning("Received invalid lock name: '%s'", action.params.get('names', action.params.get('name')))
+        protocol.send(const.RESPONSE_ERR + ',invalid lock name')
+        protocol.close()
+
+
+class InvalidParameterActionHandler(StatelessActionHandler):
+
+    def __init__(self, param: str):
+        self.param = param
+
+    def __call__(self, protocol: Protocol, action: Action):
+        logger.warning("Received invalid value for '%s': '%s'", self.param, action.params.get(self.param))
+        protocol.send(const.RESPONSE_ERR + ',invalid ' + self.param)
+        protocol.close()
+
+
+class TopActionHandler(StatelessActionHandler):
+    """
+    Responds with the lock names with most grants, 'not-granted' responses and time held (see TopLocks).
+    The optional 'count' parameter is how many lock names to return for each one.
+    """
+
+    DEFAULT_COUNT = 10
+    MAX_COUNT = 20
+
+    invalid_count = InvalidParameterActionHandler('count')
+
+    def __init__(self, context: Context):
+        self._context = context
+
+    def __call__(self, protocol: Protocol, action: Action):
+        try:
+            count = int(action.params.get('count', self.DEFAULT_COUNT))
+        except ValueError:
+            count = 0
+        if not 0 < count <= self.MAX_COUNT:
+            return self.invalid_count(protocol, action)
+        top = self._context.top_locks.top(count)
+        protocol.send("{},{}".format(const.RESPONSE_TOP_COMING, json.dumps(top)))
+        protocol.close()
+
+
+class LockNotGrantedActionHandler(StatelessActionHandler):
+
+    def __call__(self, protocol: Protocol, action: Action):
+        logger.info("Lock NOT granted: %s", action.params.get('names', action.params.get('name')))
+        protocol.send(const.RESPONSE_LOCK_NOT_GRANTED)
+        protocol.close()
+
+
+def get_seconds(action: Action, param: str) -> typing.Optional[float]:
+    """Returns the value of the parameter as seconds (0 if not present), or None if the value is invalid"""
+    try:
+        seconds = float(action.params.get(param, 0))
+    except ValueError:
+        return None
+    if not math.isfinite(seconds) or seconds < 0:
+        return None
+    return seconds
+
+
+class LockActionHandler(StatelessActionHandler):
+    """
+    Handles the lock requests. If the lock is granted, returns a LockGrantedActionHandler that already owns
+    the lock. If the lock is busy and the client asked to wait for it, a LockWaitActionHandler is returned.
+
+    If the request includes 'ttl', the lock is granted as a lease: it's held (even after the connection
+    is closed) until it's released using the token sent in the response, or until it expires.
+
+    If the request includes 'keepalive-timeout', the lock is revoked (and the connection closed) when the client
+    doesn't send anything for that many seconds.
+    """
+
+    invalid_lock = InvalidLockActionHandler()
+    invalid_wait = InvalidParameterActionHandler('wait')
+    invalid_ttl = InvalidParameterActionHandler('ttl')
+    invalid_keepalive_timeout = InvalidParameterActionHandler('keepalive-timeout')
+    not_granted = LockNotGrantedActionHandler()
+
+    def __init__(self, context: Context):
+        self._context = context
+
+    def __call__(self, protocol: Protocol, action: Action):
+        requested = time.monotonic()
+        lock_names = get_lock_names(action)
+        if lock_names is None:
+            return self.invalid_lock(protocol, action)
+
+        wait = get_seconds(action, 'wait')
+        if wait is None:
+            return self.invalid_wait(protocol, action)
+
+        ttl = get_seconds(action, 'ttl')
+        if ttl is None or ('ttl' in action.params and ttl == 0):
+            return self.invalid_ttl(protocol, action)
+        if ttl and wait:
+            # Waiting for a lease is not supported
+            return self.invalid_wait(protocol, action)
+
+        keepalive_timeout = get_seconds(action, 'keepalive-timeout')
+        if keepalive_timeout is None or ('keepalive-timeout' in action.params and (keepalive_timeout == 0 or ttl)):
+            # Leases have no connection to keep alive
+            return self.invalid_keepalive_timeout(protocol, action)
+
+        # When many locks are requested, they're acquired in a canonical order (sorted by name)
+        locks = self._context.locks.reference_all(lock_names)
+
+        # Acquire lock and proceed, or return failure.
+        # If multiple concurrent clients try to get the lock, only one will proceed
+        acquired = self._context.locks.acquire_non_blocking_all(locks)
+        if acquired == len(locks):
+            self._context.record_granted(locks)
+            if ttl:
+                return self._grant_lease(protocol, action, locks, ttl, requested)
+            return LockGrantedActionHandler(protocol, action, locks=locks, context=self._context, requested=requested,
+                                            keepalive_timeout=keepalive_timeout)
+        elif wait > 0:
+            return LockWaitActionHandler(protocol, action, locks=locks, acquired=acquired,
+                                         lock_table=self._context.locks, context=self._context, wait=wait,
+                                         requested=requested, keepalive_timeout=keepalive_timeout)
+        else:
+            # All or nothing: release the locks acquired before finding the busy one
+            for lock in locks[:acquired]:
+                lock.release()
+            self._context.locks.dereference_all(locks)
+            self._context.record_not_granted(locks[acquired])
+            return self.not_granted(protocol, action)
+
+    def _grant_lease(self, protocol: Protocol, action: Action, locks: typing.List[Lock], ttl: float,
+                     requested: float):
+        for lock in locks:
+            lock.update(action.params.get('client-id'))
+        self._context.time_to_grant.record(time.monotonic() - requested)
+        lease = self._context.leases.create(locks, ttl)
+        protocol.send("{},token:{}".format(const.RESPONSE_OK, lease.token))
+        protocol.close()
+
+
+class RenewLeaseActionHandler(StatelessActionHandler):
+    """Postpones the expiration of a lease. The optional 'ttl' parameter replaces the ttl of the lease"""
+
+    invalid_token = InvalidParameterActionHandler('token')
+    invalid_ttl = InvalidParameterActionHandler('ttl')
+
+    def __init__(self, context: Context):
+        self._context = context
+
+    def __call__(self, protocol: Protocol, action: Action):
+        token = action.params.get('token')
+        if not token:
+            return self.invalid_token(protocol, action)
+        ttl = get_seconds(action, 'ttl')
+        if ttl is None or ('ttl' in action.params and ttl == 0):
+            return self.invalid_ttl(protocol, action)
+
+        if self._context.leases.renew(token, ttl):
+            protocol.send(const.RESPONSE_OK)
+        else:
+            logger.info("Lease NOT renewed, unknown token: '%s'", token)
+            protocol.send(const.RESPONSE_ERR + ',unknown token')
+        protocol.close()
+
+
+class ReleaseLeaseActionHandler(StatelessActionHandler):
+    """Releases a lease, using the token sent when the lease was granted"""
+
+    invalid_token = InvalidParameterActionHandler('token')
+
+    def __init__(self, context: Context):
+        self._context = context
+
+    def __call__(self, protocol: Protocol, action: Action):
+        token = action.params.get('token')
+        if not token:
+            return self.invalid_token(protocol, action)
+
+        if self._context.leases.release(token):
+            protocol.send(const.RESPONSE_RELEASED)
+        else:
+            logger.info("Lease NOT released, unknown token: '%s'", token)
+            protocol.send(const.RESPONSE_ERR + ',unknown token')
+        protocol.close()
 
 
-class LockGrantedActionHandler(ActionHandler):
+class ActionHandler:
+    """
+    Base class for handlers that keep state while serving a connection (ex: the locks held by the client).
+    An instance is created for each connection that needs it.
+    """
+
+    def __init__(self, protocol: Protocol, action: Action):
+        self.protocol = protocol
+        self.action = action
+
+
+class LockWaitActionHandler(ActionHandler):
+    """
+    Handles a lock request with 'wait': the client is queued in the Lock, and it is granted the lock as soon
+    as the holder releases it (in FIFO order). If the lock is not granted after `wait` seconds,
+    the client receives 'not-granted'.
+
+    When many locks are requested, they are acquired one by one, in the order of `locks` (sorted by name),
+    so clients waiting for overlapping sets of locks can't deadlock. The client gets all of them or none.
+
+    The locks must be already referenced in the LockTable, and the first `acquired` ones must be already held.
+
+    `handle_action()` blocks while waiting (watching the connection meanwhile, so a client that disconnects
+    leaves the queue right away). Servers that can't block use `start_waiting()`, `timed_out()` and `abandon()`
+    instead, and switch to the handler returned by `granted()` once all the locks are held.
+    """
 
     def __init__(self, *args, **kwargs):
-        self.lock = kwargs.pop('lock')
-        self.lock_name = kwargs.pop('lock_name')
+        self.locks = kwargs.pop('locks')
+        self.acquired = kwargs.pop('acquired')
+        self.lock_table = kwargs.pop('lock_table')
+        self.context = kwargs.pop('context')
+        self.wait = kwargs.pop('wait')
+        self.requested = kwargs.pop('requested')
+        self.keepalive_timeout = kwargs.pop('keepalive_timeout', 0)
         super().__init__(*args, **kwargs)
-        self.client_id = self.action.params.get('client-id')
+        self.waiter = None
+
+    @property
+    def lock_name(self):
+        return ';'.join(lock.name for lock in self.locks)
 
     def handle_action(self):
+        logger.info("Waiting up to %s seconds for lock: %s", self.wait, self.lock_name)
+        deadline = time.monotonic() + self.wait
+        while self.acquired < len(self.locks):
+            if not self._wait_for_next_lock(deadline):
+                return
+            self.acquired += 1
+        return self.granted().handle_action()
+
+    def _wait_for_next_lock(self, deadline: float) -> bool:
+        """
+        Waits until `deadline` for the next lock. The thread sleeps in a selector, woken up by the releaser of
+        the lock or by the client disconnecting. Returns True if the lock was acquired; otherwise the wait
+        was already ended (by sending 'not-granted' or by abandoning it) and the locks were released.
+
+        A client that sends a line too long while waiting is disconnected, like the event-loop server does.
+        """
+        wakeup, notify = socket.socketpair()
         try:
-            self._handle_action()
-        except ClientDisconnected:
-            logger.info("ClientDisconnected: lock will be released: %s", self.lock)
+            self.waiter = Waiter(functools.partial(self._wake_up, notify))
+            if self.locks[self.acquired].add_waiter(self.waiter):
+                return True
+            try:
+                closed = self.protocol.wait_until_closed(max(0.0, deadline - time.monotonic()), interrupt=wakeup)
+            except LineTooLongError:
+                logger.warning("Received line too long (max %s bytes). Will close the connection.",
+                               self.protocol.max_line_length)
+                self.protocol.close()
+                closed = True
+            except Exception:
+                self.abandon()  # don't leave the waiter queued: the lock would be handed off to nobody
+                raise
+            if closed:
+                self.abandon()
+                return False
+            return not self.timed_out()
+        finally:
+            self.waiter = None
+            wakeup.close()
+            notify.close()
+
+    @staticmethod
+    def _wake_up(notify: socket.socket):
+        try:
+            notify.send(b'\0')
+        except OSError:
+            pass  # the waiting thread already noticed it got the lock, and closed the socket
+
+    def start_waiting(self, on_granted) -> bool:
+        """
+        Acquires the pending locks, in order. Returns True once all the locks are held.
+
+        If a lock is busy, the client is queued and False is returned. `on_granted` will be called when that
+        lock is handed off to the client (from the thread that released it), and then `start_waiting()` must be
+        called again to continue with the rest of the locks.
+        """
+        if self.waiter is None:
+            logger.info("Waiting up to %s seconds for lock: %s", self.wait, self.lock_name)
+        elif self.waiter.granted:
+            self.acquired += 1
+        self.waiter = None
+
+        while self.acquired < len(self.locks):
+            waiter = Waiter(on_granted)
+            if not self.locks[self.acquired].add_waiter(waiter):
+                self.waiter = waiter
+                return False
+            self.acquired += 1
+        return True
 
-    def _handle_action(self):
-        self.lock.update(self.lock_name, self.client_id)
-        self.protocol.send(const.RESPONSE_OK)
-        logger.info("Lock granted: %s", self.lock)
+    def _cancel_wait(self) -> bool:
+        """Returns False if the wait couldn't be cancelled because the lock was already handed off to the client"""
+        if self.waiter is None or self.locks[self.acquired].cancel_waiter(self.waiter):
+            return True
+        return False
+
+    def timed_out(self) -> bool:
+        """
+        Cancels the wait and sends 'not-granted'. Returns False if it was too late: the lock was already
+        handed off to the client (and `on_granted` was or will be called).
+        """
+        if not self._cancel_wait():
+            return False
+        self.not_granted()
+        return True
 
-        while True:
-            line = self.protocol.readline(timeout=1.0)
-            if line is None:
-                continue
+    def abandon(self):
+        """The client disconnected while waiting"""
+        logger.info("Client disconnected while waiting for lock: %s", self.lock_name)
+        if not self._cancel_wait():
+            self.acquired += 1  # the lock was handed off to the client in the meantime
+        self._release_acquired()
 
-            inner_action = Action.from_line(line)
-            logger.debug("Inner action: '%s' for lock %s", inner_action, self.lock)
+    def _release_acquired(self):
+        for lock in self.locks[:self.acquired]:
+            lock.release()
+        self.lock_table.dereference_all(self.locks)
 
-            # FIXME: handle 'invalid requests' here too
+    def granted(self) -> 'LockGrantedActionHandler':
+        """Returns the handler to use now that the client owns all the locks"""
+        assert self.acquired == len(self.locks)
+        self.context.record_granted(self.locks)
+        return LockGrantedActionHandler(self.protocol, self.action, locks=self.locks, context=self.context,
+                                        requested=self.requested, keepalive_timeout=self.keepalive_timeout)
 
-            if inner_action.name == const.ACTION_RELEASE:
-                return InnerReleaseLockActionHandler(self.protocol, inner_action, lock=self.lock).handle_action()
-            if inner_action.name == const.ACTION_KEEPALIVE:
-                InnerKeepAliveActionHandler(self.protocol, inner_action, lock=self.lock).handle_action()
-            else:
-                InnerInvalidActionActionHandler(self.protocol, inner_action, lock=self.lock).handle_action()
+    def not_granted(self):
+        self._release_acquired()
+        self.context.record_not_granted(self.locks[self.acquired])
+        LockActionHandler.not_granted(self.protocol, self.action)
 
 
-class InnerReleaseLockActionHandler(ActionHandler):
+class InteractiveActionHandler(ActionHandler):
+    """
+    Base class for handlers that keep the connection open, handling the lines sent by the client, until
+    the client disconnects or `handle_inner_line()` returns True.
 
-    def __init__(self, *args, **kwargs):
-        self.lock = kwargs.pop('lock')
-        super().__init__(*args, **kwargs)
+    `handle_action()` blocks until that happens. Servers that can't block (like the event-loop server) call
+    `start()`, `handle_inner_line()` and `finish()` by themselves.
+    """
 
     def handle_action(self):
-        logger.info("Releasing lock: %s", self.lock)
-        self.protocol.send(const.RESPONSE_RELEASED)
-        self.protocol.close()
+        try:
+            self.start()
+            # Block until the client sends something or disconnects: an idle client costs no wakeups
+            while True:
+                line = self.protocol.readline()
+                if self.handle_inner_line(line):
+                    return
+        except (ClientDisconnected, ConnectionError):
+            self.client_disconnected()
+        except LineTooLongError:
+            logger.warning("Received line too long (max %s bytes). Will close the connection.",
+                           self.protocol.max_line_length)
+            self.protocol.close()
+        finally:
+            self.finish()
+
+    def start(self):
+        raise NotImplementedError()
+
+    def handle_inner_line(self, line: str) -> bool:
+        """Handles a line received from the client. Returns True if the connection was closed"""
+        raise NotImplementedError()
+
+    def client_disconnected(self):
+        raise NotImplementedError()
+
+    def finish(self):
+        """Called once the connection is closed (by the client or by `handle_inner_line()`)"""
+        raise NotImplementedError()
+
+
+class InnerReleaseLockActionHandler:
+    """Releases the locks (and closes the connection). Called with the LockGrantedActionHandler and the action"""
+
+    def __call__(self, holder: 'LockGrantedActionHandler', action: Action) -> bool:
+        logger.info("Releasing lock: %s", holder.lock)
+        holder.protocol.send(const.RESPONSE_RELEASED)
+        holder.close()
+        return True
+
 
+class InnerKeepAliveActionHandler:
 
-class InnerKeepAliveActionHandler(ActionHandler):
+    def __call__(self, holder: 'LockGrantedActionHandler', action: Action) -> bool:
+        logger.debug("Received keepalive from client. Lock: %s", holder.lock)
+        holder.protocol.send(const.RESPONSE_STILL_ALIVE)
+        return False
+
+
+class InnerInvalidActionActionHandler:
+
+    def __call__(self, holder: 'LockGrantedActionHandler', action: Action) -> bool:
+        logger.debug("Received invalid action from client. Lock: %s", holder.lock)
+        holder.protocol.send(const.RESPONSE_INVALID_ACTION)
+        return False
+
+
+class LockGrantedActionHandler(InteractiveActionHandler):
+    """
+    Handles the connection of the client that holds the lock (or the locks, if many were requested together).
+    The locks must be already acquired (and referenced in the LockTable), and they are released when the client
+    sends 'release' or disconnects.
+
+    `requested` is when the lock request was received (time.monotonic()), to record the time to grant.
+
+    If `keepalive_timeout` is set, the locks are revoked when the client sends nothing (usually '.keepalive')
+    for that many seconds: the socket is shut down from the timers thread, so the server serving the connection
+    sees it closed and releases the locks as if the client disconnected.
+
+    The actions received from the client are looked up in `inner_actions`: the handlers are called with this
+    instance and the action, and return True if they closed the connection.
+    """
+
+    inner_actions = ActionRegistry(default=InnerInvalidActionActionHandler())
+    inner_actions.register(const.ACTION_RELEASE, InnerReleaseLockActionHandler())
+    inner_actions.register(const.ACTION_KEEPALIVE, InnerKeepAliveActionHandler())
 
     def __init__(self, *args, **kwargs):
-        self.lock = kwargs.pop('lock')
+        self.locks = kwargs.pop('locks')
+        self.context = kwargs.pop('context')
+        self.requested = kwargs.pop('requested')
+        self.keepalive_timeout = kwargs.pop('keepalive_timeout', 0)
         super().__init__(*args, **kwargs)
+        self.lock_table = self.context.locks
+        self.client_id = self.action.params.get('client-id')
+        self.keepalive_deadline = None
+
+    @property
+    def lock(self):
+        """The held lock, or a description of the held locks if many were requested (for logging)"""
+        if len(self.locks) == 1:
+            return self.locks[0]
+        return ', '.join(str(lock) for lock in self.locks)
+
+    def start(self):
+        for lock in self.locks:
+            lock.update(self.client_id)
+        self.context.time_to_grant.record(time.monotonic() - self.requested)
+        self.protocol.send(const.RESPONSE_OK)
+        logger.info("Lock granted: %s", self.lock)
+        if self.keepalive_timeout:
+            self.keepalive_deadline = Deadline(self.context.timers, self.keepalive_timeout, self._revoke)
+
+    def _revoke(self):
+        """Called from the timers thread when the client didn't send anything in `keepalive_timeout` seconds"""
+        logger.warning("No keepalive received in %s seconds. Lock will be revoked: %s",
+                       self.keepalive_timeout, self.lock)
+        self.context.lock_revoked_count.incr()
+        try:
+            # Wakes up the reader of the socket (a blocked thread or the event loop), that releases the locks
+            self.protocol.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # already closed
+
+    def close(self):
+        if self.keepalive_deadline is not None:
+            # The deadline must not shut down the socket once it's closed (the fd could be reused)
+            self.keepalive_deadline.cancel()
+        self.protocol.close()
 
-    def handle_action(self):
-        logger.debug("Received keepalive from client. Lock: %s", self.lock)
-        self.protocol.send(const.RESPONSE_STILL_ALIVE)
+    def handle_inner_line(self, line: str) -> bool:
+        if self.keepalive_deadline is not None:
+            self.keepalive_deadline.touch()
+        inner_action = Action.from_line(line)
+        logger.debug("Inner action: '%s' for lock %s", inner_action, self.lock)
+
+        # FIXME: handle 'invalid requests' here too
+
+        return self.inner_actions.get(inner_action.name)(self, inner_action)
+
+    def client_disconnected(self):
+        logger.info("ClientDisconnected: lock will be released: %s", self.lock)
 
+    def finish(self):
+        if self.keepalive_deadline is not None:
+            self.keepalive_deadline.cancel()
+        self.context.record_released(self.locks)
+        for lock in self.locks:
+            lock.release()
+        self.lock_table.dereference_all(self.locks)
 
-class InnerInvalidActionActionHandler(ActionHandler):
+
+class SessionActionHandler(InteractiveActionHandler):
+    """
+    Handles a session: the client acquires, keeps alive and releases many locks over the same connection.
+    Each request includes a request id ('rid'), which is included in the response.
+
+    All the locks held by the session are released when the client disconnects.
+    """
 
     def __init__(self, *args, **kwargs):
-        self.lock = kwargs.pop('lock')
+        self.context = kwargs.pop('context')
         super().__init__(*args, **kwargs)
+        self.client_id = self.action.params.get('client-id')
+        self.locks = {}
+        """Locks held by the session, by name"""
 
-    def handle_action(self):
-        logger.debug("Received invalid action from client. Lock: %s", self.lock)
-        self.protocol.send(const.RESPONSE_INVALID_ACTION)
+    def start(self):
+        self.protocol.send(const.RESPONSE_OK)
+        logger.info("Session started. client-id: '%s'", self.client_id or '')
+
+    def _respond(self, response_code: str, request_id: str, reason: str = None):
+        response = "{code},rid:{rid}".format(code=response_code, rid=request_id)
+        if reason:
+            response += ",reason:{reason}".format(reason=reason)
+        self.protocol.send(response)
+
+    def handle_inner_line(self, line: str) -> bool:
+        inner_action = Action.from_line(line)
+        logger.debug("Session action: '%s'", inner_action)
+
+        request_id = inner_action.params.get('rid')
+        if not inner_action.is_valid() or not request_id:
+            logger.warning("Received invalid request in session: '%s'", line)
+            self.protocol.send(const.RESPONSE_INVALID_REQUEST)
+            return False
+
+        self.session_actions.get(inner_action.name)(self, inner_action, request_id)
+        return False
+
+    def _keepalive(self, inner_action: Action, request_id: str):
+        logger.debug("Received keepalive from session. Locks: %s", len(self.locks))
+        self._respond(const.RESPONSE_STILL_ALIVE, request_id)
+
+    def _invalid_action(self, inner_action: Action, request_id: str):
+        logger.debug("Received invalid action in session: '%s'", inner_action.name)
+        self._respond(const.RESPONSE_INVALID_ACTION, request_id)
+
+    def _lock(self, inner_action: Action, request_id: str):
+        lock_names = get_lock_names(inner_action)
+        if lock_names is None:
+            return self._respond(const.RESPONSE_ERR, request_id, 'invalid lock name')
+        for param in ('wait', 'ttl', 'keepalive-timeout'):
+            if param in inner_action.params:
+                return self._respond(const.RESPONSE_ERR, request_id, '{} is not supported in sessions'.format(param))
+
+        requested = time.monotonic()
+        locks = self.context.locks.reference_all(lock_names)
+        acquired = self.context.locks.acquire_non_blocking_all(locks)
+        if acquired == len(locks):
+            self.context.record_granted(locks)
+            self.context.time_to_grant.record(time.monotonic() - requested)
+            for lock in locks:
+                lock.update(self.client_id)
+                self.locks[lock.name] = lock
+                logger.info("Lock granted (session): %s", lock)
+            self._respond(const.RESPONSE_OK, request_id)
+        else:
+            for lock in locks[:acquired]:
+                lock.release()
+            self.context.locks.dereference_all(locks)
+            self.context.record_not_granted(locks[acquired])
+            logger.info("Lock NOT granted (session): %s", ';'.join(lock_names))
+            self._respond(const.RESPONSE_LOCK_NOT_GRANTED, request_id)
+
+    def _release(self, inner_action: Action, request_id: str):
+        lock = self.locks.pop(inner_action.params.get('name'), None)
+        if lock is None:
+            return self._respond(const.RESPONSE_ERR, request_id, 'lock not held')
+        logger.info("Releasing lock (session): %s", lock)
+        self._release_lock(lock)
+        self._respond(const.RESPONSE_RELEASED, request_id)
+
+    def _release_lock(self, lock):
+        self.context.record_released([lock])
+        lock.release()
+        self.context.locks.dereference(lock)
+
+    def client_disconnected(self):
+        logger.info("ClientDisconnected: %s locks held by the session will be released", len(self.locks))
+
+    def finish(self):
+        locks, self.locks = self.locks, {}
+        for lock in locks.values():
+            self._release_lock(lock)
+
+    session_actions = ActionRegistry(default=_invalid_action)
+    """The handlers are called with the session, the action and the request id"""
+    session_actions.register(const.ACTION_LOCK, _lock)
+    session_actions.register(const.ACTION_RELEASE, _release)
+    session_actions.register(const.ACTION_KEEPALIVE, _keepalive)
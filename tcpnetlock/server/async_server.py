@@ -0,0 +1,400 @@
+import collections
+import errno
+import logging
+import selectors
+import socket
+import threading
+import time
+
+from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.common import LineTooLongError
+from tcpnetlock.common import TcpKeepalive
+from tcpnetlock.protocol import Protocol
+from tcpnetlock.server import action_handlers as handlers
+from tcpnetlock.server.context import Context
+from tcpnetlock.server.dispatch import Dispatcher
+from tcpnetlock.server.server import TCPServer
+from tcpnetlock.server.server import reject_connection
+from tcpnetlock.server.server import remove_stale_unix_socket
+from tcpnetlock.server.server import unlink_unix_socket
+from tcpnetlock.timers import Timer
+from tcpnetlock.timers import TimerHeap
+
+"""
+Event-loop implementation of the lock server.
+
+All the connections are served from a single thread, using `selectors`. The protocol, the Context and the
+action handlers are the same used by the threaded TCPServer: the difference is that the handlers are driven
+by the event loop (a line is dispatched once the selector reports the socket is readable), instead of
+blocking a thread per connection.
+
+A client holding a lock costs one registered file descriptor and a `Connection` instance.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    """State of a client connection served by the event loop"""
+
+    __slots__ = ('server', 'protocol', 'fileno', 'handler', 'timer', 'accepted')
+
+    def __init__(self, server: 'AsyncTCPServer', protocol: Protocol):
+        self.server = server
+        self.protocol = protocol
+        self.fileno = protocol.socket.fileno()
+        """Kept to unregister the connection, even if the handler already closed the socket"""
+        self.handler = None
+        """LockWaitActionHandler while waiting for a lock, InteractiveActionHandler once the connection is kept open
+        (ex: the lock was granted)"""
+        self.timer = None
+        """Pending timer: the handshake deadline (until the request is received), or the wait for the lock"""
+        self.accepted = time.monotonic()
+
+    @property
+    def closed(self) -> bool:
+        return self.protocol.socket.fileno() == -1
+
+    def on_readable(self, read: bool = True):
+        """Reads the data available (unless `read` is False: the data is already in the buffer), and serves it"""
+        try:
+            if read:
+                self.protocol.read_available()
+            self._handle_lines()
+        except ClientDisconnected:
+            if self.handler is None:
+                logger.info("Client disconnected before getting line.")
+            elif isinstance(self.handler, handlers.InteractiveActionHandler):
+                self.handler.client_disconnected()
+            self._close()
+        except LineTooLongError:
+            if self.handler is None:
+                self.server.dispatcher.line_too_long(self.protocol, None)
+            else:
+                logger.warning("Received line too long (max %s bytes). Will close the connection.",
+                               self.protocol.max_line_length)
+            self._close()
+        except OSError:
+            logger.info("Error detected while serving client. Will close the connection.", exc_info=True)
+            self._close()
+        except Exception:  # an error serving a client must not stop the event loop
+            logger.exception("Unexpected error while serving client. Will close the connection.")
+            self._close()
+
+    def _handle_lines(self):
+        # While waiting for the lock, received lines are kept in the buffer
+        while self.protocol.has_line() and not isinstance(self.handler, handlers.LockWaitActionHandler):
+            line = self.protocol.readline()
+            if self.handler is None:
+                self._handle_request(line)
+            elif self.handler.handle_inner_line(line):
+                self._close()
+            if self.closed:
+                return
+
+    def _handle_request(self, line: str):
+        self._cancel_timer()  # the handshake deadline
+        handler = self.server.dispatcher.dispatch(self.protocol, line)
+        self.server.context.request_latency.record(time.monotonic() - self.accepted)
+        if handler is None:
+            # The response was sent, and the connection closed
+            self._close()
+        elif isinstance(handler, handlers.InteractiveActionHandler):
+            # From now on, the lines received are handled by this handler
+            self.handler = handler
+            handler.start()
+        elif isinstance(handler, handlers.LockWaitActionHandler):
+            self.handler = handler
+            self.timer = self.server.call_later(handler.wait, self._on_wait_timeout)
+            self._on_lock_granted()
+
+    def _lock_handed_off(self):
+        # Called from the thread that released the lock
+        self.server.call_soon_threadsafe(self._on_lock_granted)
+
+    def _on_lock_granted(self):
+        if not isinstance(self.handler, handlers.LockWaitActionHandler):
+            return  # the connection was closed while the notification was pending
+        if not self.handler.start_waiting(self._lock_handed_off):
+            return  # waiting for the next lock
+        self._cancel_timer()
+        self.handler = self.handler.granted()
+        try:
+            self.handler.start()
+            self._handle_lines()
+        except (ClientDisconnected, OSError):
+            logger.info("Error detected while granting lock. Will close the connection.", exc_info=True)
+            self._close()
+
+    def _on_handshake_timeout(self):
+        self.timer = None
+        if self.handler is not None or self.closed:
+            return
+        logger.info("No request received in %s seconds. Will close the connection.", self.server.handshake_timeout)
+        self.server.context.handshake_timeout_count.incr()
+        self._close()
+
+    def _on_wait_timeout(self):
+        self.timer = None
+        if not isinstance(self.handler, handlers.LockWaitActionHandler):
+            return
+        try:
+            if not self.handler.timed_out():
+                return  # the lock was granted in the meantime, `_on_lock_granted()` will be called
+        except OSError:
+            logger.info("Error detected while sending response. Will close the connection.", exc_info=True)
+        self.handler = None
+        self._close()
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def _close(self):
+        if not self.server.unregister(self):
+            return  # already closed
+        self.server.context.connections_closed_count.incr()
+        self._cancel_timer()
+        if isinstance(self.handler, handlers.LockWaitActionHandler):
+            self.handler.abandon()
+        elif self.handler is not None:
+            self.handler.finish()
+        self.handler = None
+        self.protocol.close()
+
+
+class AsyncTCPServer:
+    """
+    Lock server that serves all the connections from a single thread, using an event loop.
+    Exposes the same interface used from TCPServer (`serve_forever()`, `shutdown()`, `port`).
+    """
+    allow_reuse_address = True
+    request_queue_size = TCPServer.request_queue_size
+    DEFAULT_PORT = TCPServer.DEFAULT_PORT
+
+    connection_class = Connection
+
+    ACCEPT_RETRY_DELAY = 0.1
+    """Seconds new connections are not accepted after running out of file descriptors (or memory)"""
+
+    ACCEPT_RETRY_ERRNOS = frozenset([errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM])
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, lock_table_shards=None,
+                 tcp_keepalive: TcpKeepalive = None, context: Context = None, backlog: int = None,
+                 max_connections: int = None, handshake_timeout: float = None):
+        """
+        :param backlog: size of the queue of connections not yet accepted (see TCPServer)
+        :param max_connections: while this many connections are open, new connections are refused with 'busy'
+        :param handshake_timeout: connections that don't send the request in this many seconds are closed
+        """
+        if backlog:
+            self.request_queue_size = backlog
+        self.max_connections = max_connections
+        self.handshake_timeout = handshake_timeout
+        self.socket = self._create_socket(host, port)
+        self.socket.setblocking(False)
+
+        self._context = context or Context(lock_table_shards=lock_table_shards)
+        self._dispatcher = Dispatcher(self, self._context)
+        self._tcp_keepalive = tcp_keepalive
+        self._selector = selectors.DefaultSelector()
+        self._connections = {}
+        self._timers = TimerHeap()
+        self._pending_callbacks = collections.deque()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._shutdown_request = False
+        self._is_shut_down = threading.Event()
+        self._loop_thread_ident = None
+        self._accepting = False
+
+    def _create_socket(self, host, port) -> socket.socket:
+        """Returns the socket watched for new connections (see `_accept()`)"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if self.allow_reuse_address:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+            sock.listen(self.request_queue_size)
+        except:  # noqa: E722 we re-raise the exception
+            sock.close()
+            raise
+        return sock
+
+    @property
+    def dispatcher(self) -> Dispatcher:
+        return self._dispatcher
+
+    @property
+    def context(self) -> Context:
+        return self._context
+
+    @property
+    def port(self):
+        return self.socket.getsockname()[1]
+
+    def serve_forever(self):
+        self._loop_thread_ident = threading.get_ident()
+        self._is_shut_down.clear()
+        self._set_accepting(True)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ, self._drain_wakeup)
+        try:
+            while not self._shutdown_request:
+                timeout = 0 if self._pending_callbacks else self._timers.next_timeout()
+                for key, _ in self._selector.select(timeout):
+                    key.data()
+                self._timers.run_expired()
+                self._run_pending_callbacks()
+        finally:
+            self._set_accepting(False)
+            self._selector.unregister(self._wakeup_reader)
+            self._shutdown_request = False
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """
+        Stops the event loop. If called from a thread other than the one running the loop,
+        waits until the loop finished.
+        """
+        self._shutdown_request = True
+        self._wakeup()
+        if threading.get_ident() != self._loop_thread_ident:
+            self._is_shut_down.wait()
+
+    def server_close(self):
+        """Closes the listening socket and all the client connections (releasing the locks)"""
+        for connection in list(self._connections.values()):
+            connection._close()
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        self.socket.close()
+
+    def call_later(self, delay: float, callback) -> Timer:
+        """Schedules `callback` to be called from the event loop in `delay` seconds. Must be called from the loop"""
+        return self._timers.schedule(delay, callback)
+
+    def call_soon_threadsafe(self, callback):
+        """Schedules `callback` to be called from the event loop. Can be called from any thread"""
+        self._pending_callbacks.append(callback)
+        if threading.get_ident() != self._loop_thread_ident:
+            self._wakeup()
+
+    def _run_pending_callbacks(self):
+        for _ in range(len(self._pending_callbacks)):
+            callback = self._pending_callbacks.popleft()
+            try:
+                callback()
+            except Exception:  # an error in a callback must not stop the event loop
+                logger.exception("Exception detected while running callback")
+
+    def unregister(self, connection: Connection) -> bool:
+        """Stops watching the connection. Returns False if the connection was already unregistered"""
+        if self._connections.pop(connection.fileno, None) is None:
+            return False
+        self._selector.unregister(connection.fileno)
+        return True
+
+    def _set_accepting(self, accepting: bool):
+        """Starts or stops watching the listening socket for new connections"""
+        if accepting == self._accepting:
+            return
+        if accepting:
+            self._selector.register(self.socket, selectors.EVENT_READ, self._accept)
+        else:
+            self._selector.unregister(self.socket)
+        self._accepting = accepting
+
+    def _accept(self):
+        try:
+            sock, client_address = self.socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            return self._accept_failed(err)
+        logger.debug("Accepted connection from %s", client_address)
+        self._add_connection(sock)
+
+    def _accept_failed(self, err: OSError):
+        """
+        Handles an error accepting a connection, without stopping the event loop. When out of file descriptors,
+        the pending connection keeps the listening socket readable: it's not watched for `ACCEPT_RETRY_DELAY`
+        seconds, instead of retrying in a busy loop (the connections already open are served meanwhile).
+        """
+        if err.errno not in self.ACCEPT_RETRY_ERRNOS:
+            logger.warning("Error accepting connection: %s", err)
+            return
+        logger.error("Error accepting connection: %s. Will retry in %s seconds", err, self.ACCEPT_RETRY_DELAY)
+        self._set_accepting(False)
+        self.call_later(self.ACCEPT_RETRY_DELAY, lambda: self._set_accepting(True))
+
+    def _add_connection(self, sock: socket.socket, received: bytes = None):
+        """Serves a new connection. `received` is data already received from the client (if any)"""
+        if self.max_connections and self._context.active_connections >= self.max_connections:
+            logger.debug("Too many connections (%s). Refusing connection", self.max_connections)
+            self._context.connections_rejected_count.incr()
+            reject_connection(sock)
+            return
+        self._context.requests_count.incr()
+        sock.setblocking(False)
+        if self._tcp_keepalive is not None:
+            self._tcp_keepalive.apply(sock)
+        connection = self.connection_class(self, Protocol(sock))
+        self._connections[connection.fileno] = connection
+        self._selector.register(connection.fileno, selectors.EVENT_READ, connection.on_readable)
+        if self.handshake_timeout:
+            connection.timer = self.call_later(self.handshake_timeout, connection._on_handshake_timeout)
+        if received:
+            connection.protocol.feed(received)
+            connection.on_readable(read=False)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_reader.recv(128):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class AsyncUnixServer(AsyncTCPServer):
+    """
+    Event-loop lock server listening on a Unix domain socket at `path`, for clients running on the same host
+    (they connect to 'unix:<path>'). To serve the same locks over TCP and over the Unix domain socket,
+    pass the `context` of the AsyncTCPServer (see UnixServer).
+    """
+
+    def __init__(self, path: str, lock_table_shards=None, context: Context = None, backlog: int = None,
+                 max_connections: int = None, handshake_timeout: float = None):
+        self._path = path
+        super().__init__(lock_table_shards=lock_table_shards, context=context, backlog=backlog,
+                         max_connections=max_connections, handshake_timeout=handshake_timeout)
+
+    def _create_socket(self, host, port) -> socket.socket:
+        remove_stale_unix_socket(self._path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self._path)
+            sock.listen(self.request_queue_size)
+        except:  # noqa: E722 we re-raise the exception
+            sock.close()
+            raise
+        return sock
+
+    @property
+    def port(self):
+        return None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def server_close(self):
+        super().server_close()
+        unlink_unix_socket(self._path)
@@ -1,52 +1,158 @@
-import collections
-import threading
 import typing
 
-from tcpnetlock.common import Counter
+from tcpnetlock.common import StripedCounter
+from tcpnetlock.server.histogram import Histogram
+from tcpnetlock.server.leases import LeaseTable
 from tcpnetlock.server.lock import Lock
+from tcpnetlock.server.lock_table import LockTable
+from tcpnetlock.server.top import TopLocks
+from tcpnetlock.timers import TimerThread
 
 
 class Context:
+    """
+    State shared by all the connections of a server. The counters are incremented from all the threads serving
+    the clients, so they're StripedCounter (exact, and threads incrementing at the same time rarely contend).
+    """
 
-    def __init__(self):
-        self._global_lock = threading.Lock()
-        """Global lock to serialize modification of LOCKS"""
+    def __init__(self, lock_table_shards: int = None, lease_token_prefix: str = ''):
+        self._locks = LockTable(shards=lock_table_shards)
+        """Contains the Lock instances"""
 
-        self._locks = collections.defaultdict(Lock)
-        """This dict contains the Lock instances"""
-
-        self._requests_count = Counter()
+        self._requests_count = StripedCounter()
         """How many requests were accepted"""
 
-        self._lock_acquired_count = Counter()
+        self._connections_closed_count = StripedCounter()
+        """How many of the accepted connections were closed"""
+
+        self._lock_acquired_count = StripedCounter()
         """How many times a lock was acquired"""
 
-        self._lock_not_acquired_count = Counter()
+        self._lock_not_acquired_count = StripedCounter()
         """How many times a lock was NOT acquired"""
 
-    @property
-    def global_lock(self) -> threading.Lock:
-        return self._global_lock
+        self._lock_revoked_count = StripedCounter()
+        """How many times locks were revoked, because the holder didn't send a keepalive in time"""
+
+        self._connections_rejected_count = StripedCounter()
+        """How many connections were refused with 'busy', because too many connections were open"""
+
+        self._handshake_timeout_count = StripedCounter()
+        """How many connections were closed because the client didn't send the request in time"""
+
+        self._request_latency = Histogram()
+        """Seconds from the connection being accepted to the request being dispatched"""
+
+        self._time_to_grant = Histogram()
+        """Seconds from the lock request being dispatched to the lock being granted (includes the wait)"""
+
+        self._hold_time = Histogram()
+        """Seconds from the lock being granted to the lock being released"""
+
+        self._top_locks = TopLocks()
+        """Lock names with most grants, 'not-granted' responses and time held"""
+
+        self._timers = TimerThread(name='timers')
+        """Runs the expiration of the leases, and the keepalive and handshake deadlines"""
+
+        self._leases = LeaseTable(self._locks, on_released=self.record_released, timers=self._timers,
+                                  token_prefix=lease_token_prefix)
+        """Locks granted with 'ttl', held without a connection"""
 
     @property
-    def locks(self) -> typing.Dict[str, Lock]:
+    def locks(self) -> LockTable:
         return self._locks
 
     @property
-    def requests_count(self) -> Counter:
+    def requests_count(self) -> StripedCounter:
         return self._requests_count
 
     @property
-    def lock_acquired_count(self) -> Counter:
+    def connections_closed_count(self) -> StripedCounter:
+        return self._connections_closed_count
+
+    @property
+    def active_connections(self) -> int:
+        # Read the closed connections first, so concurrent updates can't make the result negative
+        closed = self._connections_closed_count.count
+        return self._requests_count.count - closed
+
+    @property
+    def lock_acquired_count(self) -> StripedCounter:
         return self._lock_acquired_count
 
     @property
-    def lock_not_acquired_count(self) -> Counter:
+    def lock_not_acquired_count(self) -> StripedCounter:
         return self._lock_not_acquired_count
 
+    @property
+    def lock_revoked_count(self) -> StripedCounter:
+        return self._lock_revoked_count
+
+    @property
+    def connections_rejected_count(self) -> StripedCounter:
+        return self._connections_rejected_count
+
+    @property
+    def handshake_timeout_count(self) -> StripedCounter:
+        return self._handshake_timeout_count
+
+    @property
+    def timers(self) -> TimerThread:
+        return self._timers
+
+    @property
+    def request_latency(self) -> Histogram:
+        return self._request_latency
+
+    @property
+    def time_to_grant(self) -> Histogram:
+        return self._time_to_grant
+
+    @property
+    def hold_time(self) -> Histogram:
+        return self._hold_time
+
+    @property
+    def leases(self) -> LeaseTable:
+        return self._leases
+
+    @property
+    def top_locks(self) -> TopLocks:
+        return self._top_locks
+
+    def record_granted(self, locks: typing.List[Lock]):
+        """Called when the locks were granted to a client (all of them, as result of a single request)"""
+        self._lock_acquired_count.incr()
+        for lock in locks:
+            self._top_locks.acquired.add(lock.name)
+
+    def record_not_granted(self, busy_lock: Lock):
+        """Called when a lock request is refused, because `busy_lock` is held by other client"""
+        self._lock_not_acquired_count.incr()
+        self._top_locks.not_granted.add(busy_lock.name)
+
+    def record_released(self, locks: typing.List[Lock]):
+        """Called before releasing locks granted together (all of them were held for the same time)"""
+        # `age` is the time since `update()` was called, when the lock was granted
+        hold_time = locks[0].age
+        self._hold_time.record(hold_time)
+        for lock in locks:
+            self._top_locks.hold_time.add(lock.name, hold_time)
+
+    def histograms(self):
+        return {
+            'request_latency': self._request_latency.summary(),
+            'time_to_grant': self._time_to_grant.summary(),
+            'hold_time': self._hold_time.summary(),
+        }
+
     def counters(self):
         return {
             'requests_count': self._requests_count.count,
             'lock_acquired_count': self._lock_acquired_count.count,
             'lock_not_acquired_count': self._lock_not_acquired_count.count,
+            'lock_revoked_count': self._lock_revoked_count.count,
+            'connections_rejected_count': self._connections_rejected_count.count,
+            'handshake_timeout_count': self._handshake_timeout_count.count,
         }
@@ -0,0 +1,52 @@
+import functools
+import logging
+import typing
+
+from tcpnetlock import constants as const
+from tcpnetlock.protocol import Protocol
+from tcpnetlock.server import action_handlers as handlers
+from tcpnetlock.server.action import Action
+from tcpnetlock.server.context import Context
+from tcpnetlock.server.registry import ActionRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """
+    Maps the first line received from a client to the handler that will serve it.
+
+    This is shared by all the server implementations, so the protocol is the same no matter
+    how the connections are handled (thread per connection, event loop, etc).
+
+    The handlers are looked up in `actions`, by action name. They're called with the protocol and the action,
+    and are created once, when the server starts (see StatelessActionHandler). New actions can be added with
+    `actions.register()`.
+    """
+
+    def __init__(self, server, context: Context):
+        self.actions = ActionRegistry(default=handlers.InvalidActionActionHandler())
+        self.actions.register(const.ACTION_LOCK, handlers.LockActionHandler(context))
+        self.actions.register(const.ACTION_RENEW, handlers.RenewLeaseActionHandler(context))
+        self.actions.register(const.ACTION_RELEASE, handlers.ReleaseLeaseActionHandler(context))
+        self.actions.register(const.ACTION_SESSION, functools.partial(handlers.SessionActionHandler, context=context))
+        self.actions.register(const.ACTION_SERVER_SHUTDOWN, handlers.ShutdownActionHandler(server))
+        self.actions.register(const.ACTION_PING, handlers.PingActionHandler())
+        self.actions.register(const.ACTION_STATS, handlers.StatsActionHandler(context))
+        self.actions.register(const.ACTION_TOP, handlers.TopActionHandler(context))
+
+        self.invalid_request = handlers.InvalidRequestActionHandler()
+        self.line_too_long = handlers.LineTooLongActionHandler()
+
+    def dispatch(self, protocol: Protocol, line: str) -> typing.Optional[handlers.ActionHandler]:
+        """
+        Serves the request. Returns None if the response was sent and the connection closed, or the handler
+        that will serve the connection from now on: an InteractiveActionHandler (ex: the lock was granted,
+        and the returned LockGrantedActionHandler already owns the lock), or a LockWaitActionHandler if the lock
+        is busy and the client asked to wait for it.
+        """
+        action = Action.from_line(line)
+        if not action.is_valid():
+            return self.invalid_request(protocol, action)
+        logger.debug("Received valid action: '%s'", action)
+        return self.actions.get(action.name)(protocol, action)
@@ -0,0 +1,96 @@
+import math
+import threading
+import typing
+
+from tcpnetlock.common import get_thread_slot
+
+
+class _HistogramShard:
+
+    __slots__ = ('mutex', 'counts', 'sum')
+
+    def __init__(self, bucket_count: int):
+        self.mutex = threading.Lock()
+        self.counts = [0] * bucket_count
+        self.sum = 0.0
+
+
+class Histogram:
+    """
+    Distribution of durations (in seconds), in logarithmic buckets (like HDR histograms): each power of 2 is divided
+    in `SUB_BUCKETS` buckets, so the value reported for a percentile is at most 1/SUB_BUCKETS above the real one.
+
+    The memory used is fixed (a list of counts, from `MIN_VALUE` to `MIN_VALUE * 2 ** OCTAVES`; values out of
+    that range are counted in the first/last bucket), and recording a value is O(1).
+
+    Values are recorded from many threads: the counts are split in shards, assigned to the threads round-robin
+    (see `get_thread_slot()`), each with its own mutex, so threads recording at the same time rarely wait for
+    each other.
+    """
+
+    MIN_VALUE = 0.000001
+    SUB_BUCKETS = 16
+    OCTAVES = 32
+    SHARDS = 8
+    PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+    def __init__(self):
+        self._bucket_count = self.SUB_BUCKETS * self.OCTAVES
+        self._shards = tuple(_HistogramShard(self._bucket_count) for _ in range(self.SHARDS))
+
+    def _get_index(self, value: float) -> int:
+        if value <= self.MIN_VALUE:
+            return 0
+        mantissa, exponent = math.frexp(value / self.MIN_VALUE)
+        index = (exponent - 1) * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+        return min(index, self._bucket_count - 1)
+
+    def _get_upper_bound(self, index: int) -> float:
+        """Returns the highest value counted in the bucket"""
+        octave, sub_bucket = divmod(index, self.SUB_BUCKETS)
+        return self.MIN_VALUE * 2 ** octave * (1 + (sub_bucket + 1) / self.SUB_BUCKETS)
+
+    def record(self, value: float):
+        index = self._get_index(value)
+        shard = self._shards[get_thread_slot() % self.SHARDS]
+        with shard.mutex:
+            shard.counts[index] += 1
+            shard.sum += value
+
+    def counts(self) -> typing.List[int]:
+        """Returns the count of each bucket (adding up the shards)"""
+        merged = [0] * self._bucket_count
+        for shard in self._shards:
+            with shard.mutex:
+                shard_counts = list(shard.counts)
+            for index, count in enumerate(shard_counts):
+                merged[index] += count
+        return merged
+
+    def sum(self) -> float:
+        """Returns the sum of the values recorded"""
+        total = 0.0
+        for shard in self._shards:
+            with shard.mutex:
+                total += shard.sum
+        return total
+
+    def summary(self) -> dict:
+        """Returns the number of values recorded, and the percentiles in `PERCENTILES` (in seconds)"""
+        counts = self.counts()
+        total = sum(counts)
+        summary = {'count': total, 'sum': round(self.sum(), 6)}
+        for name, fraction in self.PERCENTILES:
+            summary[name] = self._get_percentile(counts, total, fraction)
+        return summary
+
+    def _get_percentile(self, counts: typing.List[int], total: int, fraction: float):
+        if not total:
+            return None
+        rank = max(1, math.ceil(total * fraction))
+        accumulated = 0
+        for index, count in enumerate(counts):
+            accumulated += count
+            if accumulated >= rank:
+                break
+        return round(self._get_upper_bound(index), 9)
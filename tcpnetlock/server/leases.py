@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+import typing
+import uuid
+
+from tcpnetlock.server.lock import Lock
+from tcpnetlock.server.lock_table import LockTable
+from tcpnetlock.timers import Timer
+from tcpnetlock.timers import TimerThread
+
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    """Locks held without a connection, until the lease is released or expires"""
+
+    __slots__ = ('token', 'locks', 'ttl', 'timer')
+
+    def __init__(self, token: str, locks: typing.List[Lock], ttl: float):
+        self.token = token
+        self.locks = locks
+        self.ttl = ttl
+        self.timer = None
+
+    def __str__(self):
+        return "Lease: '{token}', locks: {locks}, ttl: {ttl}".format(
+            token=self.token, locks=', '.join(lock.name for lock in self.locks), ttl=self.ttl)
+
+
+class LeaseTable:
+    """
+    Contains the leases, by token. A lease owns locks already acquired (and referenced in the LockTable),
+    and releases them when it expires (`ttl` seconds after it was created or renewed) or is released.
+
+    Expiration is driven by a TimerThread: each lease has a timer, so the cost of an expiration doesn't depend
+    on how many leases exist.
+    """
+
+    def __init__(self, lock_table: LockTable, on_released=None, timers: TimerThread = None, token_prefix: str = ''):
+        self._lock_table = lock_table
+        self._on_released = on_released
+        """Called with the locks of the lease before releasing them"""
+        self._mutex = threading.Lock()
+        """Serializes the modification of `_leases`"""
+        self._leases = {}
+        self._timers = timers or TimerThread(name='lease-timers')
+        self._token_prefix = token_prefix
+        """Added to the tokens (ex: to know which process created the lease)"""
+
+    def create(self, locks: typing.List[Lock], ttl: float) -> Lease:
+        """Creates a lease for `locks` (that must be already held), which expires in `ttl` seconds"""
+        lease = Lease(self._token_prefix + uuid.uuid4().hex, locks, ttl)
+        with self._mutex:
+            self._leases[lease.token] = lease
+            lease.timer = self._schedule(lease)
+        logger.info("Lease created: %s", lease)
+        return lease
+
+    def renew(self, token: str, ttl: float = None) -> bool:
+        """Postpones the expiration of the lease `ttl` seconds from now. Returns False if the lease doesn't exist"""
+        with self._mutex:
+            lease = self._leases.get(token)
+            if lease is None:
+                return False
+            lease.timer.cancel()
+            lease.ttl = ttl or lease.ttl
+            lease.timer = self._schedule(lease)
+        logger.debug("Lease renewed: %s", lease)
+        return True
+
+    def release(self, token: str) -> bool:
+        """Releases the lease. Returns False if the lease doesn't exist (never existed, or expired)"""
+        with self._mutex:
+            lease = self._leases.pop(token, None)
+            if lease is None:
+                return False
+            lease.timer.cancel()
+        logger.info("Lease released: %s", lease)
+        self._release_locks(lease)
+        return True
+
+    def _schedule(self, lease: Lease) -> Timer:
+        return self._timers.schedule(lease.ttl, lambda: self._expire(lease))
+
+    def _expire(self, lease: Lease):
+        with self._mutex:
+            if self._leases.get(lease.token) is not lease or lease.timer.deadline > time.monotonic():
+                return  # released or renewed in the meantime
+            del self._leases[lease.token]
+        logger.info("Lease expired: %s", lease)
+        self._release_locks(lease)
+
+    def _release_locks(self, lease: Lease):
+        if self._on_released is not None:
+            self._on_released(lease.locks)
+        for lock in lease.locks:
+            lock.release()
+        self._lock_table.dereference_all(lease.locks)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self._leases
+
+    def __len__(self):
+        return len(self._leases)
@@ -1,33 +1,105 @@
+import collections
 import threading
 import time
 
 
+class Waiter:
+    """
+    A client waiting for a Lock. When the lock is released, the ownership is transferred to the first
+    waiter in the queue, and its `callback` is called (from the thread that released the lock).
+    """
+
+    __slots__ = ('callback', 'granted', 'cancelled')
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.granted = False
+        self.cancelled = False
+
+
 class Lock:
 
-    def __init__(self):
-        self._lock = threading.Lock()
-        self._name = None
+    def __init__(self, name: str):
+        self._mutex = threading.Lock()
+        """Serializes the modification of `_held` and `_waiters`"""
+        self._held = False
+        self._waiters = collections.deque()
+        """FIFO of Waiter instances. Cancelled waiters are removed lazily, when they reach the head"""
+        self._name = name
         self._timestamp = 0
         self._client_id = None
+        self.refs = 0
+        """How many holders/waiters are using this instance. Modified by LockTable"""
 
     def acquire_non_blocking(self):
-        return self._lock.acquire(blocking=False)
+        with self._mutex:
+            if self._held:
+                return False
+            self._held = True
+            return True
+
+    def add_waiter(self, waiter: Waiter) -> bool:
+        """
+        Acquires the lock if it's free, and returns True. Otherwise, queues the waiter and returns False:
+        the waiter will be notified when it is granted the lock.
+        """
+        with self._mutex:
+            if not self._held:
+                self._held = True
+                return True
+            self._waiters.append(waiter)
+            return False
 
-    def update(self, lock_name, client_id):
-        if self._name is None:
-            self._name = lock_name
-        else:
-            assert self._name == lock_name
+    def cancel_waiter(self, waiter: Waiter) -> bool:
+        """
+        Cancels the wait. Returns False if it couldn't be cancelled because the lock was already granted
+        to the waiter: in that case the caller owns the lock, and must release it.
+        """
+        with self._mutex:
+            if waiter.granted:
+                return False
+            waiter.cancelled = True
+            return True
 
+    def acquire(self, timeout: float) -> bool:
+        """Waits up to `timeout` seconds for the lock. Returns True if it was acquired"""
+        event = threading.Event()
+        waiter = Waiter(event.set)
+        if self.add_waiter(waiter):
+            return True
+        event.wait(timeout)
+        return not self.cancel_waiter(waiter)
+
+    def update(self, client_id):
         self._timestamp = time.monotonic()
         self._client_id = client_id
 
     def release(self):
-        self._lock.release()
+        """Releases the lock, or hands it off to the first waiter (in FIFO order)"""
+        with self._mutex:
+            assert self._held
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.cancelled:
+                    waiter.granted = True
+                    break
+            else:
+                self._held = False
+                return
+        waiter.callback()
+
+    @property
+    def name(self):
+        return self._name
 
     @property
     def locked(self):
-        return self._lock.locked()
+        return self._held
+
+    @property
+    def waiting(self):
+        """Number of waiters (including cancelled ones not yet removed from the queue)"""
+        return len(self._waiters)
 
     @property
     def age(self):
@@ -0,0 +1,133 @@
+import os
+import threading
+import typing
+
+from tcpnetlock.common import StripedCounter
+from tcpnetlock.server.lock import Lock
+
+
+class LockTableShard:
+    """A subset of the lock names, with its own mutex"""
+
+    __slots__ = ('mutex', 'locks', 'contention')
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        """Serializes modification of `locks`"""
+
+        self.locks = {}
+        """This dict contains the Lock instances"""
+
+        self.contention = StripedCounter()
+        """How many times a thread had to wait for `mutex` (incremented by many threads at once, outside of it)"""
+
+    def acquire(self):
+        if not self.mutex.acquire(blocking=False):
+            self.contention.incr()
+            self.mutex.acquire()
+
+    def release(self):
+        self.mutex.release()
+
+
+class LockTable:
+    """
+    Contains the Lock instances, partitioned in shards by the hash of the lock name.
+
+    Each shard has its own mutex, so requests for lock names that live in different shards never contend.
+
+    Entries are reference counted: a Lock is in the table only while somebody holds it or is trying to get it,
+    so the memory used tracks the live locks.
+    """
+
+    DEFAULT_SHARDS = int(os.environ.get('TCPNETLOCK_LOCK_TABLE_SHARDS', '16'))
+
+    def __init__(self, shards: int = None):
+        shards = shards or self.DEFAULT_SHARDS
+        assert shards > 0
+        self._shards = tuple(LockTableShard() for _ in range(shards))
+
+    def _get_shard(self, lock_name: str) -> LockTableShard:
+        return self._shards[hash(lock_name) % len(self._shards)]
+
+    def reference(self, lock_name: str) -> Lock:
+        """
+        Returns the Lock for `lock_name`, creating it if it doesn't exists, and increments its reference count.
+        Every call must be paired with a call to `dereference()` once the caller (holder or waiter) is done
+        with the lock.
+
+        Done while holding the mutex of the shard, to avoid 2 concurrent clients creating
+        2 instances of the same lock at the same time.
+        """
+        shard = self._get_shard(lock_name)
+        shard.acquire()
+        try:
+            lock = shard.locks.get(lock_name)
+            if lock is None:
+                lock = shard.locks[lock_name] = Lock(lock_name)
+            lock.refs += 1
+            return lock
+        finally:
+            shard.release()
+
+    def dereference(self, lock: Lock):
+        """Decrements the reference count of the Lock. The last one to leave removes it from the table"""
+        shard = self._get_shard(lock.name)
+        shard.acquire()
+        try:
+            assert lock.refs > 0
+            lock.refs -= 1
+            if lock.refs == 0:
+                del shard.locks[lock.name]
+        finally:
+            shard.release()
+
+    def reference_all(self, lock_names: typing.Iterable[str]) -> typing.List[Lock]:
+        """
+        References the locks, and returns them sorted by name. Acquiring many locks always in this
+        canonical order avoids deadlocks between clients that wait for them.
+        """
+        return [self.reference(lock_name) for lock_name in sorted(set(lock_names))]
+
+    def dereference_all(self, locks: typing.Iterable[Lock]):
+        for lock in locks:
+            self.dereference(lock)
+
+    @staticmethod
+    def acquire_non_blocking_all(locks: typing.List[Lock]) -> int:
+        """
+        Acquires the locks in order, stopping at the first one that is busy.
+        Returns how many locks were acquired (those locks are the first ones of the list).
+        """
+        for acquired, lock in enumerate(locks):
+            if not lock.acquire_non_blocking():
+                return acquired
+        return len(locks)
+
+    def keys(self) -> typing.List[str]:
+        """Returns the lock names. Each shard is copied while holding its mutex, never the whole table at once"""
+        keys = []
+        for shard in self._shards:
+            shard.acquire()
+            try:
+                keys.extend(shard.locks.keys())
+            finally:
+                shard.release()
+        return keys
+
+    @property
+    def shard_count(self) -> int:
+        return len(self._shards)
+
+    def contention(self) -> typing.List[int]:
+        """Returns, for each shard, how many times a thread had to wait for the mutex of the shard"""
+        return [shard.contention.count for shard in self._shards]
+
+    def __getitem__(self, lock_name: str) -> Lock:
+        return self._get_shard(lock_name).locks[lock_name]
+
+    def __contains__(self, lock_name: str) -> bool:
+        return lock_name in self._get_shard(lock_name).locks
+
+    def __len__(self):
+        return sum(len(shard.locks) for shard in self._shards)
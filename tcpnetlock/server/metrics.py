@@ -0,0 +1,151 @@
+import http.server
+import logging
+import threading
+import time
+
+from tcpnetlock.server.context import Context
+from tcpnetlock.server.histogram import Histogram
+
+"""
+Exposes the statistics of the server in the OpenMetrics text format (the format scraped by Prometheus).
+
+The metrics are served over HTTP, from its own listening socket and thread, so scrapes never compete
+with the lock traffic. The text is rendered from a snapshot of the Context, which is reused for
+`SNAPSHOT_MAX_AGE` seconds: frequent scrapes (or many scrapers) don't add work to the server.
+"""
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+class MetricsRenderer:
+    """Renders the metrics of the Context, caching the result for `SNAPSHOT_MAX_AGE` seconds"""
+
+    SNAPSHOT_MAX_AGE = 1.0
+    TOP_COUNT = 10
+    """How many lock names are exported for each of the top locks metrics"""
+
+    def __init__(self, context: Context):
+        self._context = context
+        self._mutex = threading.Lock()
+        self._snapshot = None
+        self._snapshot_time = None
+
+    def get_snapshot(self) -> bytes:
+        with self._mutex:
+            now = time.monotonic()
+            if self._snapshot is None or now - self._snapshot_time > self.SNAPSHOT_MAX_AGE:
+                self._snapshot = self.render().encode()
+                self._snapshot_time = now
+            return self._snapshot
+
+    def render(self) -> str:
+        context = self._context
+        lines = []
+        self._add_counter(lines, 'tcpnetlock_requests', "Connections accepted", context.requests_count.count)
+        self._add_counter(lines, 'tcpnetlock_lock_acquired', "Locks granted", context.lock_acquired_count.count)
+        self._add_counter(lines, 'tcpnetlock_lock_not_acquired', "Locks not granted",
+                          context.lock_not_acquired_count.count)
+        self._add_counter(lines, 'tcpnetlock_lock_revoked', "Locks revoked because the holder missed its keepalive",
+                          context.lock_revoked_count.count)
+        self._add_counter(lines, 'tcpnetlock_connections_rejected', "Connections refused with 'busy' (too many open)",
+                          context.connections_rejected_count.count)
+        self._add_counter(lines, 'tcpnetlock_handshake_timeouts', "Connections closed without a request in time",
+                          context.handshake_timeout_count.count)
+        self._add_gauge(lines, 'tcpnetlock_active_connections', "Connections open", context.active_connections)
+        self._add_gauge(lines, 'tcpnetlock_threads', "Threads of the server process", threading.active_count())
+        self._add_gauge(lines, 'tcpnetlock_lock_table_size', "Locks in the lock table (held or waited for)",
+                        len(context.locks))
+        self._add_gauge(lines, 'tcpnetlock_leases', "Leases (locks granted with ttl) not yet expired or released",
+                        len(context.leases))
+        self._add_summary(lines, 'tcpnetlock_request_latency_seconds',
+                          "Time from the connection being accepted to the request being dispatched",
+                          context.request_latency)
+        self._add_summary(lines, 'tcpnetlock_time_to_grant_seconds',
+                          "Time from the lock request to the lock being granted", context.time_to_grant)
+        self._add_summary(lines, 'tcpnetlock_hold_time_seconds',
+                          "Time from the lock being granted to the lock being released", context.hold_time)
+        top = context.top_locks
+        self._add_top(lines, 'tcpnetlock_top_lock_acquired', "Lock names with most grants (estimated)",
+                      top.acquired.top(self.TOP_COUNT))
+        self._add_top(lines, 'tcpnetlock_top_lock_not_granted', "Lock names with most not-granted (estimated)",
+                      top.not_granted.top(self.TOP_COUNT))
+        self._add_top(lines, 'tcpnetlock_top_lock_hold_time_seconds', "Lock names held for longest (estimated)",
+                      top.hold_time.top(self.TOP_COUNT))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _add_counter(lines: list, name: str, help_text: str, value: int):
+        lines.append('# HELP {name} {help}'.format(name=name, help=help_text))
+        lines.append('# TYPE {name} counter'.format(name=name))
+        lines.append('{name}_total {value}'.format(name=name, value=value))
+
+    @staticmethod
+    def _add_gauge(lines: list, name: str, help_text: str, value: int):
+        lines.append('# HELP {name} {help}'.format(name=name, help=help_text))
+        lines.append('# TYPE {name} gauge'.format(name=name))
+        lines.append('{name} {value}'.format(name=name, value=value))
+
+    @staticmethod
+    def _add_summary(lines: list, name: str, help_text: str, histogram: Histogram):
+        summary = histogram.summary()
+        lines.append('# HELP {name} {help}'.format(name=name, help=help_text))
+        lines.append('# TYPE {name} summary'.format(name=name))
+        if summary['count']:
+            for key, fraction in Histogram.PERCENTILES:
+                lines.append('{name}{{quantile="{quantile}"}} {value}'.format(
+                    name=name, quantile=fraction, value=summary[key]))
+        lines.append('{name}_count {value}'.format(name=name, value=summary['count']))
+        lines.append('{name}_sum {value}'.format(name=name, value=summary['sum']))
+
+    @staticmethod
+    def _add_top(lines: list, name: str, help_text: str, top: list):
+        lines.append('# HELP {name} {help}'.format(name=name, help=help_text))
+        lines.append('# TYPE {name} gauge'.format(name=name))
+        for lock_name, value, _ in top:
+            # Lock names only contain [a-zA-Z0-9_-], no need to escape them
+            lines.append('{name}{{lock="{lock_name}"}} {value}'.format(
+                name=name, lock_name=lock_name, value=round(value, 6)))
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.renderer.get_snapshot()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request from %s: %s", self.address_string(), format % args)
+
+
+class MetricsServer(http.server.HTTPServer):
+    """
+    HTTP server that serves the metrics of the Context. Call `start()` to serve from a daemon thread.
+    """
+
+    def __init__(self, context: Context, host='localhost', port=0):
+        super().__init__((host, port), MetricsRequestHandler)
+        self.renderer = MetricsRenderer(context)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.socket.getsockname()[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
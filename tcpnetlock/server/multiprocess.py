@@ -0,0 +1,249 @@
+import array
+import errno
+import logging
+import multiprocessing
+import signal
+import socket
+import typing
+import zlib
+
+from tcpnetlock import constants as const
+from tcpnetlock.common import TcpKeepalive
+from tcpnetlock.protocol import Protocol
+from tcpnetlock.server import action_handlers as handlers
+from tcpnetlock.server.action import Action
+from tcpnetlock.server.async_server import AsyncTCPServer
+from tcpnetlock.server.async_server import Connection
+from tcpnetlock.server.context import Context
+from tcpnetlock.server.registry import ActionRegistry
+
+"""
+Multi-process implementation of the lock server, to use more than one core.
+
+The lock names are partitioned (by hash) between N worker processes (shards), each one with its own Context,
+serving its connections with an event loop (see ShardWorkerServer). The acceptor process (ShardedTCPServer)
+accepts the connections and reads the first line: then it sends the connection (the file descriptor, with
+SCM_RIGHTS, over a Unix socket) and the data already received to the shard that owns the lock. From then on,
+the acceptor is not involved: the client talks to the shard directly.
+
+Each lock is owned by a single process, so the semantics of the locks are the same as in a single process.
+The requests that could involve more than one shard are refused: sessions, and multi-lock requests for locks
+owned by different shards. Lease tokens include the shard that created them, so 'renew' and 'release' are sent
+to the right shard. '.stats' and '.top' are served by the shard in the 'shard' parameter (default 0).
+
+Passing file descriptors over Unix sockets with SOCK_SEQPACKET requires Linux (or other system supporting it).
+"""
+
+logger = logging.getLogger(__name__)
+
+HANDOFF_MAX_SIZE = max(Protocol.MIN_BUFFER_SIZE, Protocol.MAX_LINE_LENGTH + 1)
+"""Max. data sent with a connection: the acceptor never has more than a full buffer of the Protocol"""
+
+LEASE_TOKEN_SEPARATOR = '.'
+"""Separates the shard from the rest of the lease token"""
+
+
+def get_shard(lock_name: str, shards: int) -> int:
+    """Returns the shard that owns the lock. Unlike `hash()`, the result is the same in all the processes"""
+    return zlib.crc32(lock_name.encode()) % shards
+
+
+def send_connection(handoff_socket: socket.socket, sock: socket.socket, received: bytes):
+    """Sends the connection `sock`, and the data already received from it, to other process"""
+    fds = array.array('i', [sock.fileno()])
+    handoff_socket.sendmsg([received], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+
+
+def receive_connection(handoff_socket: socket.socket) -> typing.Optional[typing.Tuple[socket.socket, bytes]]:
+    """
+    Receives a connection sent with `send_connection()`. Returns the socket and the data already received,
+    or None if the other process closed the handoff socket.
+
+    Raises OSError (EMFILE) if the connection was lost because this process has no file descriptors left
+    (the kernel drops the file descriptor and reports the control data as truncated).
+    """
+    fds = array.array('i')
+    data, ancdata, flags, _ = handoff_socket.recvmsg(HANDOFF_MAX_SIZE, socket.CMSG_SPACE(fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    if not fds:
+        if flags & socket.MSG_CTRUNC:
+            raise OSError(errno.EMFILE, "Connection received without file descriptor (control data truncated)")
+        return None
+    return socket.socket(fileno=fds[0]), data
+
+
+class NotSupportedActionHandler(handlers.StatelessActionHandler):
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __call__(self, protocol: Protocol, action: Action):
+        logger.warning("Refused request: '%s' (%s)", action, self.reason)
+        protocol.send(const.RESPONSE_ERR + ',' + self.reason)
+        protocol.close()
+
+
+class ShardWorkerServer(AsyncTCPServer):
+    """
+    Serves the connections for the locks owned by a shard. Instead of accepting connections, it receives them
+    from the acceptor (over `handoff_socket`), with the data already received. Stops when the acceptor closes
+    the handoff socket.
+    """
+
+    def __init__(self, handoff_socket: socket.socket, shard: int, lock_table_shards=None):
+        self._handoff_socket = handoff_socket
+        self.shard = shard
+        context = Context(lock_table_shards=lock_table_shards,
+                          lease_token_prefix='{shard}{sep}'.format(shard=shard, sep=LEASE_TOKEN_SEPARATOR))
+        super().__init__(context=context)
+
+    def _create_socket(self, host, port) -> socket.socket:
+        return self._handoff_socket
+
+    @property
+    def port(self):
+        return None
+
+    def _accept(self):
+        try:
+            handed_off = receive_connection(self.socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            return self._accept_failed(err)
+        if handed_off is None:
+            logger.info("The acceptor closed the handoff socket. Shard %s will shut down", self.shard)
+            self._shutdown_request = True
+            return
+        sock, received = handed_off
+        self._add_connection(sock, received)
+
+
+def run_worker(handoff_socket: socket.socket, inherited: list, shard: int, lock_table_shards: int):
+    # Only the acceptor handles Ctrl+C: workers stop once the acceptor closes the handoff socket
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for sock in inherited:
+        sock.close()
+    server = ShardWorkerServer(handoff_socket, shard, lock_table_shards=lock_table_shards)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class AcceptorConnection(Connection):
+    """Reads the first line sent by the client, and sends the connection to the shard that serves it"""
+
+    __slots__ = ()
+
+    def _handle_request(self, line: str):
+        shard = self.server.route(line)
+        if shard is None:
+            # Served by the acceptor (ex: '.ping', or refused)
+            return super()._handle_request(line)
+        received = (line + '\n').encode() + self.protocol.pending_data()
+        self.server.hand_off(shard, self.protocol.socket, received)
+        self._close()
+
+
+class ShardedTCPServer(AsyncTCPServer):
+    """
+    Lock server that uses `workers` processes (by default, one per core) to serve the locks (see module docs).
+    Exposes the same interface used from TCPServer (`serve_forever()`, `shutdown()`, `port`).
+
+    The acceptor looks up the action in `routes`: the callables are called with the action, and return the shard
+    that serves the request, or None if the acceptor serves it (with its dispatcher).
+    """
+
+    connection_class = AcceptorConnection
+
+    def __init__(self, host='localhost', port=AsyncTCPServer.DEFAULT_PORT, lock_table_shards=None,
+                 tcp_keepalive: TcpKeepalive = None, workers: int = None, backlog: int = None,
+                 handshake_timeout: float = None):
+        super().__init__(host, port, lock_table_shards=lock_table_shards, tcp_keepalive=tcp_keepalive,
+                         backlog=backlog, handshake_timeout=handshake_timeout)
+        self.workers = workers or multiprocessing.cpu_count()
+
+        self.routes = ActionRegistry(default=lambda action: 0)
+        self.routes.register(const.ACTION_LOCK, self._route_lock)
+        self.routes.register(const.ACTION_RENEW, self._route_lease)
+        self.routes.register(const.ACTION_RELEASE, self._route_lease)
+        self.routes.register(const.ACTION_STATS, self._route_shard_param)
+        self.routes.register(const.ACTION_TOP, self._route_shard_param)
+        for action_name in (const.ACTION_SESSION, const.ACTION_PING, const.ACTION_SERVER_SHUTDOWN):
+            self.routes.register(action_name, lambda action: None)
+
+        # The requests not handed off to a shard, and not served by the acceptor, are refused
+        actions = self.dispatcher.actions
+        actions.register(const.ACTION_LOCK, NotSupportedActionHandler('locks owned by different workers'))
+        actions.register(const.ACTION_SESSION, NotSupportedActionHandler('sessions not supported with workers'))
+        actions.register(const.ACTION_STATS, handlers.InvalidParameterActionHandler('shard'))
+        actions.register(const.ACTION_TOP, handlers.InvalidParameterActionHandler('shard'))
+
+        self._handoff_sockets = []
+        self._processes = []
+        self._start_workers(lock_table_shards)
+
+    def _start_workers(self, lock_table_shards: int):
+        # Fork: the workers are ready as soon as this returns, and need nothing pickled
+        mp_context = multiprocessing.get_context('fork')
+        pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET) for _ in range(self.workers)]
+        for shard, (acceptor_end, worker_end) in enumerate(pairs):
+            # The workers must not keep open the sockets of the acceptor (or the listening socket)
+            inherited = [self.socket, self._wakeup_reader, self._wakeup_writer]
+            inherited += [sock for pair in pairs for sock in pair if sock is not worker_end]
+            process = mp_context.Process(target=run_worker, args=(worker_end, inherited, shard, lock_table_shards),
+                                         name='tcpnetlock-shard-{}'.format(shard), daemon=True)
+            process.start()
+            self._processes.append(process)
+        for acceptor_end, worker_end in pairs:
+            worker_end.close()
+            self._handoff_sockets.append(acceptor_end)
+        logger.info("Started %s workers", self.workers)
+
+    def route(self, line: str) -> typing.Optional[int]:
+        """Returns the shard that serves the request, or None if the acceptor serves it"""
+        action = Action.from_line(line)
+        if not action.is_valid():
+            return None
+        return self.routes.get(action.name)(action)
+
+    def _route_lock(self, action: Action) -> typing.Optional[int]:
+        lock_names = handlers.get_lock_names(action)
+        if lock_names is None:
+            return 0  # invalid: any shard can refuse it
+        shards = {get_shard(lock_name, self.workers) for lock_name in lock_names}
+        if len(shards) > 1:
+            return None
+        return shards.pop()
+
+    def _route_lease(self, action: Action) -> int:
+        shard, _, _ = action.params.get('token', '').partition(LEASE_TOKEN_SEPARATOR)
+        try:
+            shard = int(shard)
+        except ValueError:
+            return 0  # invalid (or unknown) token: any shard can refuse it
+        return shard if 0 <= shard < self.workers else 0
+
+    def _route_shard_param(self, action: Action) -> typing.Optional[int]:
+        try:
+            shard = int(action.params.get('shard', 0))
+        except ValueError:
+            return None
+        return shard if 0 <= shard < self.workers else None
+
+    def hand_off(self, shard: int, sock: socket.socket, received: bytes):
+        send_connection(self._handoff_sockets[shard], sock, received)
+
+    def server_close(self):
+        """Closes the listening socket, and stops the workers (releasing their locks)"""
+        super().server_close()
+        for handoff_socket in self._handoff_sockets:
+            handoff_socket.close()
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                logger.warning("Worker %s didn't stop. Terminating it...", process.name)
+                process.terminate()
@@ -0,0 +1,24 @@
+class ActionRegistry:
+    """
+    Maps action names to the callables that handle them. The loops that read the lines sent by the clients
+    look up the action here, instead of comparing the name against every known action, and new actions
+    can be added with `register()` without modifying those loops.
+
+    The callables are created once and reused for all the requests. The arguments they receive depend on
+    the loop that uses the registry (see where each registry is created).
+    """
+
+    def __init__(self, default):
+        self._handlers = {}
+        self.default = default
+        """Called for the actions that are not registered"""
+
+    def register(self, action_name: str, handler):
+        self._handlers[action_name] = handler
+
+    def get(self, action_name: str):
+        """Returns the callable for the action, or `default` if the action is not registered"""
+        return self._handlers.get(action_name, self.default)
+
+    def __contains__(self, action_name: str) -> bool:
+        return action_name in self._handlers
@@ -1,13 +1,19 @@
+import functools
 import logging
+import os
+import socket
 import socketserver
+import stat
+import time
 
-from tcpnetlock import constants as const
+from tcpnetlock import constants
 from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.common import LineTooLongError
+from tcpnetlock.common import TcpKeepalive
 from tcpnetlock.protocol import Protocol
-from tcpnetlock.server import action_handlers as handlers
-from tcpnetlock.server.action import Action
-from tcpnetlock.server.background_thread import BackgroundThread
 from tcpnetlock.server.context import Context
+from tcpnetlock.server.dispatch import Dispatcher
+from tcpnetlock.timers import Deadline
 
 """
 This implement a very simple network lock server based on just TCP.
@@ -36,23 +42,153 @@ The simplest way to use:
 logger = logging.getLogger(__name__)
 
 
-class TCPServer(socketserver.ThreadingTCPServer):
+def reject_connection(sock: socket.socket):
+    """
+    Refuses a connection accepted while the server is over capacity: sends 'busy' and closes it, without reading
+    the request, and without blocking (the response is dropped if it doesn't fit in the socket buffer).
+    """
+    try:
+        sock.send((constants.RESPONSE_SERVER_BUSY + '\n').encode(), socket.MSG_DONTWAIT)
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    sock.close()
+
+
+class AdmissionControlMixIn:
+    """
+    Counts the connections accepted by the server, and refuses them with 'busy' (before starting a thread
+    to serve them) while `max_connections` connections are open. Connections that don't send the request
+    in `handshake_timeout` seconds are closed (see TCPHandler).
+    """
+    max_connections = None
+    handshake_timeout = None
+
+    def process_request(self, request, client_address):
+        context = self.context
+        if self.max_connections and context.active_connections >= self.max_connections:
+            logger.debug("Too many connections (%s). Refusing connection from %s",
+                         self.max_connections, client_address)
+            context.connections_rejected_count.incr()
+            reject_connection(request)
+            return
+        context.requests_count.incr()
+        super().process_request(request, client_address)
+
+
+class TCPServer(AdmissionControlMixIn, socketserver.ThreadingTCPServer):
     allow_reuse_address = True
     daemon_threads = True
-    DEFAULT_PORT = 7654
-
-    def __init__(self, host='localhost', port=DEFAULT_PORT):
+    request_queue_size = socket.SOMAXCONN
+    """Backlog of the listening socket: connections not yet accepted. Bursts of connections beyond it are
+    retried by the clients' kernel (with SYN retransmits, which take seconds)"""
+    DEFAULT_PORT = constants.DEFAULT_PORT
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, lock_table_shards=None,
+                 tcp_keepalive: TcpKeepalive = None, context: Context = None, backlog: int = None,
+                 max_connections: int = None, handshake_timeout: float = None):
+        if backlog:
+            self.request_queue_size = backlog
+        self.max_connections = max_connections
+        self.handshake_timeout = handshake_timeout
         super().__init__((host, port), TCPHandler)
-        self._context = Context()
-        self._background_thread = BackgroundThread(self._context)
+        self._context = context or Context(lock_table_shards=lock_table_shards)
+        self._dispatcher = Dispatcher(self, self._context)
+        self._tcp_keepalive = tcp_keepalive
+
+    @property
+    def dispatcher(self) -> Dispatcher:
+        return self._dispatcher
+
+    @property
+    def context(self) -> Context:
+        return self._context
 
     @property
     def port(self):
         return self.socket.getsockname()[1]
 
-    def serve_forever(self, *args, **kwargs):
-        self._background_thread.start()
-        super().serve_forever(*args, **kwargs)
+    def get_request(self):
+        sock, client_address = super().get_request()
+        if self._tcp_keepalive is not None:
+            self._tcp_keepalive.apply(sock)
+        return sock, client_address
+
+
+def remove_stale_unix_socket(path: str):
+    """
+    Removes the Unix domain socket at `path` if no server is listening on it (ex: the server was killed),
+    so a new server can be bound to it. Sockets in use, and other kind of files, are left untouched.
+    """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        logger.info("Removing stale Unix domain socket '%s'", path)
+        os.unlink(path)
+    except OSError:
+        pass
+    finally:
+        probe.close()
+
+
+def unlink_unix_socket(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class UnixServer(AdmissionControlMixIn, socketserver.ThreadingUnixStreamServer):
+    """
+    Lock server listening on a Unix domain socket at `path`, for clients running on the same host (they connect
+    to 'unix:<path>'). Serves the connections exactly like TCPServer. To serve the same locks over TCP
+    and over the Unix domain socket, pass the `context` of the TCPServer.
+    """
+    daemon_threads = True
+    request_queue_size = TCPServer.request_queue_size
+    _bound = False
+
+    def __init__(self, path: str, lock_table_shards=None, context: Context = None, backlog: int = None,
+                 max_connections: int = None, handshake_timeout: float = None):
+        if backlog:
+            self.request_queue_size = backlog
+        self.max_connections = max_connections
+        self.handshake_timeout = handshake_timeout
+        remove_stale_unix_socket(path)
+        super().__init__(path, TCPHandler)
+        self._context = context or Context(lock_table_shards=lock_table_shards)
+        self._dispatcher = Dispatcher(self, self._context)
+
+    @property
+    def dispatcher(self) -> Dispatcher:
+        return self._dispatcher
+
+    @property
+    def context(self) -> Context:
+        return self._context
+
+    @property
+    def port(self):
+        return None
+
+    @property
+    def path(self) -> str:
+        return self.server_address
+
+    def server_bind(self):
+        super().server_bind()
+        self._bound = True
+
+    def server_close(self):
+        super().server_close()
+        if self._bound:  # if bind() failed, the socket file could belong to other server
+            unlink_unix_socket(self.path)
 
 
 class TCPHandler(socketserver.BaseRequestHandler):
@@ -60,61 +196,51 @@ class TCPHandler(socketserver.BaseRequestHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def _invalid_request(self, protocol: Protocol, line: str):
-        logger.warning("Received invalid request: '%s'", line)
-        protocol.send(const.RESPONSE_INVALID_REQUEST)
-        self.request.close()
-
     @property
     def _context(self) -> Context:
         return self.server._context
 
     def handle(self):
-        self._context.requests_count.incr()
+        accepted = time.monotonic()
         protocol = Protocol(self.request)
         try:
-            line = protocol.readline()
+            line = self._read_request(protocol)
         except ClientDisconnected:
             logger.info("Client disconnected before getting line.")
             protocol.close()
             return
+        except LineTooLongError:
+            self.server.dispatcher.line_too_long(protocol, None)
+            return
+
+        handler = self.server.dispatcher.dispatch(protocol, line)
+        self._context.request_latency.record(time.monotonic() - accepted)
+        if handler is not None:
+            handler.handle_action()
+
+    def _read_request(self, protocol: Protocol) -> str:
+        """
+        Reads the first line. If it doesn't arrive in `handshake_timeout` seconds, the socket is shut down from
+        the timers thread (so ClientDisconnected is raised). The thread serving the connection is blocked in
+        recv() meanwhile: the deadline doesn't make waiting connections cheaper, it limits how long they wait.
+        """
+        timeout = self.server.handshake_timeout
+        if not timeout:
+            return protocol.readline()
+        deadline = Deadline(self._context.timers, timeout, functools.partial(self._handshake_timed_out, protocol))
+        try:
+            return protocol.readline()
+        finally:
+            # Once cancelled, the deadline can't shut down the socket: it can be closed (and the fd reused)
+            deadline.cancel()
+
+    def _handshake_timed_out(self, protocol: Protocol):
+        logger.info("No request received in %s seconds. Will close the connection.", self.server.handshake_timeout)
+        self._context.handshake_timeout_count.incr()
+        try:
+            protocol.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # already closed
 
-        action = Action.from_line(line)
-        if action.is_valid():
-            logger.debug("Received valid action: '%s'", action)
-        else:
-            return self._invalid_request(protocol, line)
-
-        if action.name == const.ACTION_SERVER_SHUTDOWN:
-            return handlers.ShutdownActionHandler(protocol, action, server=self.server).handle_action()
-
-        if action.name == const.ACTION_PING:
-            return handlers.PingActionHandler(protocol, action).handle_action()
-
-        if action.name == const.ACTION_STATS:
-            return handlers.StatsActionHandler(protocol, action, context=self._context).handle_action()
-
-        if action.name != const.ACTION_LOCK:
-            return handlers.InvalidActionActionHandler(protocol, action).handle_action()
-
-        lock_name = action.params.get('name')
-        if not const.VALID_LOCK_NAME_RE.match(lock_name):
-            return handlers.InvalidLockActionHandler(protocol, action, lock_name=lock_name).handle_action()
-
-        # Get the Lock, only while holding the GLOBAL LOCK
-        # This is done to avoid 2 concurrent clients creating 2 instances of the same lock at the same time
-        with self._context.global_lock:
-            lock = self._context.locks[lock_name]
-
-        # Acquire lock and proceed, or return failure.
-        # If multiple concurrent clients try to get the lock, only one will proceed
-        if lock.acquire_non_blocking():
-            self._context.lock_acquired_count.incr()
-            try:
-                return handlers.LockGrantedActionHandler(
-                    protocol, action, lock=lock, lock_name=lock_name).handle_action()
-            finally:
-                lock.release()
-        else:
-            self._context.lock_not_acquired_count.incr()
-            return handlers.LockNotGrantedActionHandler(protocol, action, lock_name=lock_name).handle_action()
+    def finish(self):
+        self._context.connections_closed_count.incr()
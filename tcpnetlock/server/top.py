@@ -0,0 +1,88 @@
+import heapq
+import threading
+import typing
+
+
+class SpaceSaving:
+    """
+    Finds the heaviest items of a stream using a fixed amount of memory (the "space-saving" algorithm).
+
+    At most `capacity` items are tracked. When a new item arrives and the table is full, the lightest item is
+    replaced by the new one, which inherits its weight (recorded as the `error` of the new item). Any item whose
+    real total is bigger than `total weight / capacity` is guaranteed to be tracked, and the reported weight is
+    never below the real one (and at most `error` above it).
+
+    The lightest item is found with a heap. Entries of the heap are not updated when an item gets heavier:
+    outdated entries are discarded when they reach the top (or when the heap grows too much).
+    """
+
+    def __init__(self, capacity: int):
+        assert capacity > 0
+        self._capacity = capacity
+        self._mutex = threading.Lock()
+        self._items = {}
+        """Maps the item to [weight, error]"""
+        self._heap = []
+        """(weight, item) entries. An entry is current if `weight` is the weight of the item in `_items`"""
+
+    def add(self, item: str, weight: float = 1):
+        with self._mutex:
+            entry = self._items.get(item)
+            if entry is not None:
+                entry[0] += weight
+            else:
+                error = 0
+                if len(self._items) >= self._capacity:
+                    error = self._evict_lightest()
+                entry = self._items[item] = [error + weight, error]
+            heapq.heappush(self._heap, (entry[0], item))
+            if len(self._heap) > 4 * self._capacity:
+                self._rebuild_heap()
+
+    def _evict_lightest(self) -> float:
+        while True:
+            weight, item = heapq.heappop(self._heap)
+            entry = self._items.get(item)
+            if entry is not None and entry[0] == weight:
+                del self._items[item]
+                return weight
+
+    def _rebuild_heap(self):
+        self._heap = [(entry[0], item) for item, entry in self._items.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, count: int) -> typing.List[typing.Tuple[str, float, float]]:
+        """Returns up to `count` (item, weight, error) tuples, heaviest first"""
+        with self._mutex:
+            items = [(item, entry[0], entry[1]) for item, entry in self._items.items()]
+        return heapq.nlargest(count, items, key=lambda item: item[1])
+
+    def __len__(self):
+        return len(self._items)
+
+
+class TopLocks:
+    """
+    The lock names with most grants, most 'not-granted' responses, and most time held. Each one is tracked
+    with a SpaceSaving instance, so the memory used is bounded no matter how many different lock names are used.
+    """
+
+    CAPACITY = 256
+
+    def __init__(self, capacity: int = None):
+        capacity = capacity or self.CAPACITY
+        self.acquired = SpaceSaving(capacity)
+        self.not_granted = SpaceSaving(capacity)
+        self.hold_time = SpaceSaving(capacity)
+        """Seconds each lock was held"""
+
+    def top(self, count: int) -> dict:
+        return {
+            'acquired': self._as_dicts(self.acquired.top(count)),
+            'not_granted': self._as_dicts(self.not_granted.top(count)),
+            'hold_time': self._as_dicts(self.hold_time.top(count)),
+        }
+
+    @staticmethod
+    def _as_dicts(top: list) -> typing.List[dict]:
+        return [{'name': name, 'value': round(value, 6), 'error': round(error, 6)} for name, value, error in top]
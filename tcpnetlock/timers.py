@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """A callback scheduled to be called at `deadline` (time.monotonic())"""
+
+    __slots__ = ('deadline', 'callback', 'cancelled')
+
+    def __init__(self, deadline: float, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        # The timer stays in the heap until its deadline: don't keep alive what the callback references
+        self.callback = None
+
+
+def run_callbacks(timers: typing.List[Timer]):
+    for timer in timers:
+        callback = timer.callback
+        if callback is None:
+            continue  # cancelled (from other thread) after being popped
+        try:
+            callback()
+        except Exception:  # a failing callback must not prevent the others from running
+            logger.exception("Exception detected while running timer callback")
+
+
+class TimerHeap:
+    """
+    Timers ordered by deadline (a binary heap). Scheduling is O(log n), and cancelling is O(1):
+    cancelled timers are discarded when they reach the top of the heap, or when the heap doubled its size
+    since the last time it was compacted (so cancelled timers with distant deadlines don't accumulate).
+
+    It's not thread safe: it's meant to be used from a single thread (like an event loop), which
+    calls `run_expired()` and waits up to `next_timeout()` for other events.
+    """
+
+    MIN_COMPACT_SIZE = 64
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+        """Used to break ties, so Timer instances are never compared"""
+        self._compact_size = self.MIN_COMPACT_SIZE
+        """The heap is compacted when it grows beyond this size"""
+
+    def schedule(self, delay: float, callback) -> Timer:
+        """Schedules `callback` to be called in `delay` seconds"""
+        timer = Timer(time.monotonic() + delay, callback)
+        heapq.heappush(self._heap, (timer.deadline, next(self._sequence), timer))
+        if len(self._heap) > self._compact_size:
+            self._compact()
+        return timer
+
+    def _compact(self):
+        # O(n), but done only after the heap doubled its size: amortized O(1) per scheduled timer
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._compact_size = max(self.MIN_COMPACT_SIZE, 2 * len(self._heap))
+
+    def next_timeout(self):
+        """Returns the seconds until the next timer expires, or None if there are no timers"""
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def pop_expired(self) -> typing.List[Timer]:
+        """Removes the expired timers from the heap, and returns them (without calling the callbacks)"""
+        now = time.monotonic()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self._heap)
+            if not timer.cancelled:
+                expired.append(timer)
+        return expired
+
+    def run_expired(self):
+        """Calls the callback of the expired timers"""
+        run_callbacks(self.pop_expired())
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class TimerThread:
+    """
+    Runs the callbacks of a TimerHeap from a dedicated (daemon) thread, started when the first timer is scheduled.
+    Timers can be scheduled and cancelled from any thread.
+
+    The thread sleeps until the next deadline: there is no periodic scan, so the cost doesn't depend on how many
+    timers are pending. The callbacks are called without holding the internal lock, so they can schedule timers.
+    """
+
+    def __init__(self, name: str = 'timers'):
+        self._name = name
+        self._heap = TimerHeap()
+        self._condition = threading.Condition(threading.Lock())
+        self._thread = None
+
+    def schedule(self, delay: float, callback) -> Timer:
+        """Schedules `callback` to be called (from the timers thread) in `delay` seconds"""
+        with self._condition:
+            timer = self._heap.schedule(delay, callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return timer
+
+    def _run(self):
+        while True:
+            with self._condition:
+                timeout = self._heap.next_timeout()
+                while timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+                    timeout = self._heap.next_timeout()
+                expired = self._heap.pop_expired()
+            run_callbacks(expired)
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class Deadline:
+    """
+    Calls `callback` (from the timers thread) once `timeout` seconds pass without `touch()` being called.
+
+    Touching only records the time: when the timer fires, it's re-scheduled if the deadline was postponed in the
+    meantime. This way there is a single pending timer per Deadline, no matter how often it's touched.
+
+    The callback is called holding the internal mutex: once `cancel()` returns, the callback is not running
+    and will not be called.
+    """
+
+    __slots__ = ('timeout', '_timers', '_callback', '_mutex', '_last_touched', '_timer', '_cancelled')
+
+    def __init__(self, timers: TimerThread, timeout: float, callback):
+        self.timeout = timeout
+        self._timers = timers
+        self._callback = callback
+        self._mutex = threading.Lock()
+        self._last_touched = time.monotonic()
+        self._cancelled = False
+        self._timer = timers.schedule(timeout, self._check)
+
+    def touch(self):
+        """Postpones the deadline `timeout` seconds from now"""
+        self._last_touched = time.monotonic()
+
+    def cancel(self):
+        with self._mutex:
+            self._cancelled = True
+            self._timer.cancel()
+
+    def _check(self):
+        with self._mutex:
+            if self._cancelled:
+                return
+            remaining = self._last_touched + self.timeout - time.monotonic()
+            if remaining > 0:
+                self._timer = self._timers.schedule(remaining, self._check)
+                return
+            self._cancelled = True
+            self._callback()
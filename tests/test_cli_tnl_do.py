@@ -4,20 +4,27 @@ Tests for `tcpnetlock.cli.tnl_do` package.
 
 import re
 import subprocess
+import threading
 
 import pytest
 
 from tcpnetlock.cli import tnl_do
 from tcpnetlock.client.client import LockClient
 
+from .test_utils import MAX_CONNECTIONS
 from .test_utils import ServerThread
+from .test_utils import UnixServerThread
 from .test_utils import lock_server
 from .test_utils import lock_name
 from .test_utils import free_tcp_port
+from .test_utils import limited_lock_server
+from .test_utils import unix_lock_server
 
 assert lock_server
 assert lock_name
 assert free_tcp_port
+assert unix_lock_server
+assert limited_lock_server
 
 
 class TestRunWithLock:
@@ -108,6 +115,37 @@ class TestRunWithLock:
             '--', 'vmstat', '1', '1')
         assert completed_process.returncode == tnl_do.ERR_CONNECTION_REFUSED
 
+    def test_cli_uses_unix_socket(self, unix_lock_server: UnixServerThread, lock_name: str):
+        host_arg = '--host=unix:{path}'.format(path=unix_lock_server.path)
+        completed_process = self._run(lock_name, unix_lock_server, host_arg, '--', 'true')
+        assert completed_process.returncode == 0
+
+        # The locks are the same for TCP and Unix domain socket clients
+        holder = unix_lock_server.get_client(host='localhost')
+        holder.connect()
+        assert holder.lock(lock_name)
+        completed_process = self._run(lock_name, unix_lock_server, host_arg, '--', 'true')
+        assert completed_process.returncode == tnl_do.ERR_LOCK_NOT_GRANTED
+        holder.close()
+
+    def test_cli_fails_if_unix_socket_does_not_exist(self, lock_server: ServerThread, lock_name: str, tmp_path):
+        completed_process = self._run(lock_name, lock_server,
+                                      '--host=unix:{path}'.format(path=tmp_path / 'missing.sock'), '--', 'true')
+        assert completed_process.returncode == tnl_do.ERR_CONNECTION_REFUSED
+
+    def test_cli_fails_if_server_busy(self, limited_lock_server: ServerThread, lock_name: str):
+        holders = []
+        for index in range(MAX_CONNECTIONS):
+            holder = limited_lock_server.get_client()
+            holder.connect()
+            assert holder.lock('{}-{}'.format(lock_name, index))
+            holders.append(holder)
+
+        completed_process = self._run(lock_name, limited_lock_server, '--', 'true')
+        assert completed_process.returncode == tnl_do.ERR_SERVER_BUSY
+        for holder in holders:
+            holder.close()
+
     def test_cli_fails_with_exit_status_of_command(self, lock_server: ServerThread, lock_name: str):
         completed_process = self._run(lock_name + '1', lock_server, '--shell', 'exit 5')
         assert completed_process.returncode == 5
@@ -125,3 +163,41 @@ class TestRunWithLock:
         ]
         completed_process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         assert completed_process.returncode == tnl_do.ERR_CONNECTION_REFUSED
+
+    def test_cli_waits_for_lock(self, lock_server: ServerThread, lock_name: str):
+        lock_client = lock_server.get_client()
+        lock_client.connect()
+        assert lock_client.lock(lock_name)
+        threading.Timer(1, lock_client.release).start()
+
+        completed_process = self._run(lock_name, lock_server, '--wait=10', '--', 'true')
+        assert completed_process.returncode == 0
+
+    def test_cli_exec_keeps_the_lock_while_the_command_runs(self, lock_server: ServerThread, lock_name: str):
+        args = [
+            'python', '-m', 'tcpnetlock.cli.tnl_do',
+            '--port={port}'.format(port=lock_server.port),
+            '--lock-name={lock_name}'.format(lock_name=lock_name),
+            '--exec', '--shell',
+            '--', 'echo "fd: ${TCPNETLOCK_LOCK_FD}"; sleep 1; exit 3',
+        ]
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert re.match(r'^fd: [0-9]+$', process.stdout.readline().decode())
+
+        lock_client = lock_server.get_client()
+        lock_client.connect()
+        assert not lock_client.lock(lock_name)
+
+        assert process.wait(10) == 3
+        lock_client = lock_server.get_client()
+        lock_client.connect()
+        assert lock_client.lock(lock_name, wait=5)
+        lock_client.release()
+
+    def test_cli_exec_fails_file_not_found(self, lock_server: ServerThread, lock_name: str):
+        completed_process = self._run(lock_name, lock_server, '--exec', '--', '/non/existing/binary')
+        assert completed_process.returncode == tnl_do.ERR_FILE_NOT_FOUND
+
+    def test_cli_exec_rejects_keep_alive(self, lock_server: ServerThread, lock_name: str):
+        completed_process = self._run(lock_name, lock_server, '--exec', '--keep-alive', '--', 'true')
+        assert completed_process.returncode == tnl_do.ERR_INVALID_OPTIONS
@@ -1,13 +1,18 @@
 """
 Tests for `tcpnetlock.client` and `tcpnetlock.server` packages.
 """
+import os
 import subprocess
+import time
 
 from tcpnetlock.cli import tnl_server
+from tcpnetlock.client.client import LockClient
 from .test_utils import BaseTest
 from .test_utils import ServerThread
+from .test_utils import lock_name
 from .test_utils import lock_server
 
+assert lock_name
 assert lock_server
 
 
@@ -29,3 +34,48 @@ class TestServerCli(BaseTest):
         completed_process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         assert completed_process.returncode == tnl_server.ERR_SERVER_BIND
         assert completed_process.stderr.decode().find('[Errno 13]') >= 0
+
+    def test_report_bind_to_used_port_with_async_engine(self, lock_server: ServerThread):
+        args = [
+            'python', '-m', 'tcpnetlock.cli.tnl_server',
+            '--engine=async',
+            '--port={port}'.format(port=lock_server.port),
+        ]
+        completed_process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert completed_process.returncode == tnl_server.ERR_SERVER_BIND
+        assert completed_process.stderr.decode().find('[Errno 98]') >= 0
+
+    def test_serves_locks_over_unix_socket_only(self, tmp_path, lock_name):
+        path = str(tmp_path / 'tcpnetlock.sock')
+        args = [
+            'python', '-m', 'tcpnetlock.cli.tnl_server',
+            '--no-tcp',
+            '--unix-socket={path}'.format(path=path),
+        ]
+        with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as server_process:
+            client = LockClient('unix:' + path)
+            for _ in range(50):
+                try:
+                    client.connect()
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    time.sleep(0.1)
+            assert client.lock(lock_name)
+            client.close()
+
+            client = LockClient('unix:' + path)
+            client.connect()
+            client.server_shutdown()
+            client.close()
+            assert server_process.wait(5) == 0
+
+        assert not os.path.exists(path)
+
+    def test_no_tcp_requires_unix_socket(self):
+        args = [
+            'python', '-m', 'tcpnetlock.cli.tnl_server',
+            '--no-tcp',
+        ]
+        completed_process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert completed_process.returncode == 2
+        assert completed_process.stderr.decode().find('--no-tcp requires --unix-socket') >= 0
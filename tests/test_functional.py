@@ -1,6 +1,7 @@
 """
 Tests for `tcpnetlock.client` and `tcpnetlock.server` packages.
 """
+import threading
 import time
 import uuid
 
@@ -9,6 +10,9 @@ import pytest
 from tcpnetlock import common
 from tcpnetlock import constants
 from tcpnetlock.client.client import LockClient
+from tcpnetlock.client.client import LockSession
+from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.protocol import Protocol
 from .test_utils import BaseTest
 from .test_utils import ServerThread
 from .test_utils import lock_name
@@ -207,6 +211,224 @@ class TestWithLockGranted(BaseTest):
         client.keepalive()
         client.close()
 
+    def test_keepalives_postpone_the_keepalive_timeout(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name, keepalive_timeout=0.3)
+        for _ in range(4):
+            time.sleep(0.15)
+            holder.keepalive()
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(lock_name)
+        holder.release()
+
+    def test_lock_is_revoked_without_keepalives(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name, keepalive_timeout=0.2)
+
+        # The waiter gets the lock once the holder's lock is revoked
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name, wait=5)
+
+        with pytest.raises((ClientDisconnected, ConnectionError)):
+            holder._protocol.readline()
+        assert lock_server.server.context.lock_revoked_count.count >= 1
+        client.release()
+
+    def test_scheduled_keepalives_keep_the_lock(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name, keepalive_timeout=0.3)
+        holder.start_keepalives(0.1)
+        time.sleep(0.6)
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(lock_name)
+        holder.release()
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
+
+    def test_wait_until_lost(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name, keepalive_timeout=0.3)
+        assert not holder.wait_until_lost(timeout=0.1)
+        assert holder.wait_until_lost(timeout=5)
+
+    def test_on_lost_callback(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name, keepalive_timeout=0.2)
+        lost = threading.Event()
+        holder.on_lost(lost.set).join(5)
+        assert lost.is_set()
+
+    def test_server_rejects_invalid_keepalive_timeout(self, lock_server: ServerThread, lock_name):
+        for line in ('lock,name:{},keepalive-timeout:0',
+                     'lock,name:{},keepalive-timeout:x',
+                     'lock,name:{},keepalive-timeout:10,ttl:10'):
+            client = lock_server.get_client()
+            client.connect()
+            client._protocol.send(line.format(lock_name))
+            assert client._protocol.readline() == 'err,invalid keepalive-timeout'
+            client.close()
+
+
+class TestWaitForLock(BaseTest):
+
+    def _start_waiter(self, lock_server: ServerThread, lock_name, wait, results: list) -> threading.Thread:
+        def wait_for_lock():
+            client = lock_server.get_client()
+            client.connect()
+            results.append((client, client.lock(lock_name, wait=wait)))
+
+        thread = threading.Thread(target=wait_for_lock, daemon=True)
+        thread.start()
+        return thread
+
+    def _wait_for_waiters(self, lock_server: ServerThread, lock_name, count):
+        for _ in range(100):
+            if lock_server.server._context.locks[lock_name].waiting >= count:
+                return
+            time.sleep(0.05)
+        raise AssertionError("Waiter didn't get queued")
+
+    def test_waiter_is_granted_when_holder_releases(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        results = []
+        thread = self._start_waiter(lock_server, lock_name, 10, results)
+        self._wait_for_waiters(lock_server, lock_name, 1)
+
+        holder.release()
+        thread.join(2)
+        assert not thread.is_alive(), "Lock was not handed off to the waiter"
+        client, acquired = results[0]
+        assert acquired
+        client.release()
+
+    def test_waiter_is_granted_when_holder_disconnects(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        results = []
+        thread = self._start_waiter(lock_server, lock_name, 10, results)
+        self._wait_for_waiters(lock_server, lock_name, 1)
+
+        holder.close()
+        thread.join(2)
+        assert not thread.is_alive(), "Lock was not handed off to the waiter"
+        assert results[0][1]
+        results[0][0].close()
+
+    def test_waiter_times_out(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        client = lock_server.get_client()
+        client.connect()
+        start = time.monotonic()
+        assert not client.lock(lock_name, wait=0.5)
+        assert time.monotonic() - start >= 0.5
+        client.close()
+
+        # The holder is not affected, and the lock is handed to nobody once released
+        holder.keepalive()
+        holder.release()
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
+
+    def test_waiters_are_granted_in_fifo_order(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        results = []
+        threads = []
+        for index in range(3):
+            threads.append(self._start_waiter(lock_server, lock_name, 10, results))
+            self._wait_for_waiters(lock_server, lock_name, index + 1)
+
+        holder.release()
+        for thread in threads:
+            thread.join(2)
+            assert not thread.is_alive(), "Lock was not handed off to the waiter"
+            client, acquired = results[-1]
+            assert acquired
+            assert results.index((client, acquired)) == threads.index(thread)
+            client.release()
+
+    def test_waiter_that_disconnects_leaves_the_queue(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('lock,name:{},wait:10'.format(lock_name))
+        self._wait_for_waiters(lock_server, lock_name, 1)
+        lock = lock_server.server._context.locks[lock_name]
+        assert lock.refs == 2
+
+        # The server notices the disconnection while the lock is still held
+        client.close()
+        for _ in range(100):
+            if lock.refs == 1:
+                break
+            time.sleep(0.05)
+        else:
+            raise AssertionError("Waiter was not removed when the client disconnected")
+
+        results = []
+        thread = self._start_waiter(lock_server, lock_name, 10, results)
+        self._wait_for_waiters(lock_server, lock_name, 2)
+        holder.release()
+        thread.join(2)
+        assert not thread.is_alive(), "Lock was not handed off to the next waiter"
+        client, acquired = results[0]
+        assert acquired
+        client.release()
+
+    def test_waiter_that_sends_a_line_too_long_leaves_the_queue(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('lock,name:{},wait:30'.format(lock_name))
+        self._wait_for_waiters(lock_server, lock_name, 1)
+        lock = lock_server.server._context.locks[lock_name]
+        try:
+            client._protocol.socket.sendall(b'x' * (Protocol.MAX_LINE_LENGTH + Protocol.MIN_BUFFER_SIZE))
+        except ConnectionError:
+            pass  # the server already closed the connection
+        for _ in range(100):
+            if lock.refs == 1:
+                break
+            time.sleep(0.05)
+        else:
+            raise AssertionError("Waiter was not removed when the client sent a line too long")
+        client.close()
+
+        holder.release()
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
+
+    def test_server_rejects_invalid_wait(self, lock_server: ServerThread, lock_name):
+        for invalid in ('abc', '-1', 'nan'):
+            client = lock_server.get_client()
+            client.connect()
+            client._protocol.send('lock,name:{},wait:{}'.format(lock_name, invalid))
+            assert client._protocol.readline() == constants.RESPONSE_ERR + ',invalid wait'
+            client.close()
+
 
 class TestAction(BaseTest):
 
@@ -226,6 +448,17 @@ class TestAction(BaseTest):
         line = client._protocol.readline()
         assert line == "bad-request"
 
+    def test_registered_action_is_dispatched(self, lock_server):
+        def echo(protocol, action):
+            protocol.send(action.params.get('text'))
+            protocol.close()
+
+        lock_server.server.dispatcher.actions.register('.test-echo', echo)
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('.test-echo,text:hello')
+        assert client._protocol.readline() == 'hello'
+
 
 class TestProtocol(BaseTest):
 
@@ -256,6 +489,90 @@ class TestProtocol(BaseTest):
     #     with pytest.raises(ClientDisconnected):
     #         client.check_connection()
 
+    def test_line_too_long_is_rejected(self, lock_server: ServerThread, lock_name):
+        client = lock_server.get_client()
+        client.connect()
+        # Rejected without waiting for the end of the line
+        client._protocol.socket.sendall(b'x' * (Protocol.MAX_LINE_LENGTH + 1))
+        assert client._protocol.readline() == constants.RESPONSE_INVALID_REQUEST
+
+    def test_line_too_long_releases_the_lock(self, lock_server: ServerThread, lock_name):
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name)
+        client._protocol.socket.sendall(b'x' * (Protocol.MAX_LINE_LENGTH + 1))
+        with pytest.raises((ClientDisconnected, ConnectionError)):
+            client._protocol.readline()
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
+
+
+class TestLease(BaseTest):
+
+    def _lease(self, lock_server: ServerThread, lock_name, ttl):
+        client = lock_server.get_client()
+        client.connect()
+        token = client.lease(lock_name, ttl=ttl)
+        client.close()
+        return token
+
+    def _call(self, lock_server: ServerThread, method, *args, **kwargs):
+        client = lock_server.get_client()
+        client.connect()
+        result = getattr(client, method)(*args, **kwargs)
+        client.close()
+        return result
+
+    def test_lease_outlives_the_connection(self, lock_server: ServerThread, lock_name):
+        token = self._lease(lock_server, lock_name, ttl=60)
+        assert token
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(lock_name)
+        assert self._lease(lock_server, lock_name, ttl=60) is None
+
+        assert self._call(lock_server, 'release_lease', token)
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
+
+    def test_lease_expires(self, lock_server: ServerThread, lock_name):
+        assert self._lease(lock_server, lock_name, ttl=0.2)
+        time.sleep(0.4)
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
+
+    def test_renew(self, lock_server: ServerThread, lock_name):
+        token = self._lease(lock_server, lock_name, ttl=0.3)
+        for _ in range(3):
+            time.sleep(0.15)
+            assert self._call(lock_server, 'renew', token)
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(lock_name)
+        assert self._call(lock_server, 'release_lease', token)
+
+    def test_waiting_client_gets_the_lock_when_the_lease_expires(self, lock_server: ServerThread, lock_name):
+        assert self._lease(lock_server, lock_name, ttl=0.3)
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name, wait=5)
+
+    def test_unknown_token(self, lock_server: ServerThread):
+        assert not self._call(lock_server, 'renew', 'unknown-token')
+        assert not self._call(lock_server, 'release_lease', 'unknown-token')
+
+    def test_invalid_parameters(self, lock_server: ServerThread, lock_name):
+        for line, response in (('lock,name:{},ttl:0', 'err,invalid ttl'),
+                               ('lock,name:{},ttl:x', 'err,invalid ttl'),
+                               ('lock,name:{},ttl:10,wait:10', 'err,invalid wait'),
+                               ('renew,token:x,ttl:-1', 'err,invalid ttl'),
+                               ('renew', 'err,invalid token'),
+                               ('release', 'err,invalid token')):
+            client = lock_server.get_client()
+            client.connect()
+            client._protocol.send(line.format(lock_name))
+            assert client._protocol.readline() == response
+            client.close()
+
 
 class TestGetStats(BaseTest):
 
@@ -271,21 +588,309 @@ class TestGetStats(BaseTest):
         assert 'lock_count' in stats
         assert 'lock_not_acquired_count' in stats
         assert 'maxrss' in stats
+        assert 'lock_table_shards' in stats
+        assert len(stats['lock_table_contention']) == stats['lock_table_shards']
 
-
-class TestBackgroundThread(BaseTest):
-
-    def test_background_task_cleanups(self, lock_server: ServerThread, lock_name):
+    def test_stats_include_histograms(self, lock_server: ServerThread, lock_name):
         client = lock_server.get_client()
         client.connect()
-        assert lock_name not in lock_server.server._context._locks
         assert client.lock(lock_name)
-        assert lock_name in lock_server.server._context._locks
+        time.sleep(0.05)
         client.release()
+        # The hold time is recorded after the response to 'release' is sent
+        time.sleep(0.1)
+
+        client = lock_server.get_client()
+        client.connect()
+        _, stats = client.stats()
+        for name in ('request_latency', 'time_to_grant', 'hold_time'):
+            assert stats[name]['count'] >= 1
+            assert stats[name]['p50'] <= stats[name]['p90'] <= stats[name]['p99'] <= stats[name]['p999']
+        assert stats['hold_time']['p999'] >= 0.05
+
+
+class TestGetTopLocks(BaseTest):
+
+    def test_server_serves_top_locks(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+        for _ in range(3):
+            client = lock_server.get_client()
+            client.connect()
+            assert not client.lock(lock_name)
+            client.close()
+        holder.release()
+
+        client = lock_server.get_client()
+        client.connect()
+        response_code, top = client.top(count=20)
+        assert response_code == constants.RESPONSE_TOP_COMING
+        assert {'name': lock_name, 'value': 3, 'error': 0} in top['not_granted']
+        assert len(top['acquired']) >= 1
+        assert len(top['hold_time']) >= 1
+
+    def test_invalid_count(self, lock_server: ServerThread):
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('.top,count:1000')
+        assert client._protocol.readline() == constants.RESPONSE_ERR + ',invalid count'
+
 
-        # Now wait until lock is cleaned up
-        for _ in range(150):
+class TestLockCleanup(BaseTest):
+
+    def _wait_until_removed(self, lock_server: ServerThread, lock_name):
+        # The server sends the response before releasing the lock, so it could take a moment
+        for _ in range(50):
             if lock_name not in lock_server.server._context._locks:
                 break
             time.sleep(0.1)
         assert lock_name not in lock_server.server._context._locks, "Lock was NOT cleaned up"
+
+    def test_lock_is_removed_when_released(self, lock_server: ServerThread, lock_name):
+        client = lock_server.get_client()
+        client.connect()
+        assert lock_name not in lock_server.server._context._locks
+        assert client.lock(lock_name)
+        assert lock_name in lock_server.server._context._locks
+        client.release()
+
+        self._wait_until_removed(lock_server, lock_name)
+
+    def test_lock_is_removed_when_client_disconnects(self, lock_server: ServerThread, lock_name):
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name)
+        client.close()
+
+        self._wait_until_removed(lock_server, lock_name)
+
+    def test_lock_not_granted_keeps_lock_of_holder(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(lock_name)
+        client.close()
+
+        assert lock_name in lock_server.server._context._locks
+        assert lock_server.server._context._locks[lock_name].refs == 1
+
+        holder.release()
+        self._wait_until_removed(lock_server, lock_name)
+
+
+class TestSession(BaseTest):
+
+    def _get_session(self, lock_server: ServerThread, **kwargs) -> LockSession:
+        session = LockSession('localhost', lock_server.port, **kwargs)
+        session.connect()
+        return session
+
+    def test_many_locks_over_one_connection(self, lock_server: ServerThread, lock_name):
+        session = self._get_session(lock_server, client_id='batch-worker')
+        names = ['{}-{}'.format(lock_name, index) for index in range(20)]
+        for name in names:
+            assert session.lock(name)
+        assert session.held == frozenset(names)
+        session.keepalive()
+
+        # Locks are held: other clients can't get them
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(names[0])
+        client.close()
+
+        session.close()
+
+    def test_lock_held_by_other_session_is_not_granted(self, lock_server: ServerThread, lock_name):
+        session_1 = self._get_session(lock_server)
+        session_2 = self._get_session(lock_server)
+        assert session_1.lock(lock_name)
+        assert not session_2.lock(lock_name)
+        assert not session_1.lock(lock_name)  # locks are not reentrant
+        session_1.close()
+        session_2.close()
+
+    def test_release_single_lock(self, lock_server: ServerThread, lock_name):
+        session = self._get_session(lock_server)
+        assert session.lock(lock_name + '-1')
+        assert session.lock(lock_name + '-2')
+
+        session.release(lock_name + '-1')
+        assert session.held == frozenset([lock_name + '-2'])
+        assert self.get_client_with_lock_acquired(lock_server, lock_name + '-1')
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(lock_name + '-2')
+        client.close()
+        session.close()
+
+    def test_disconnect_releases_all_locks(self, lock_server: ServerThread, lock_name):
+        session = self._get_session(lock_server)
+        names = ['{}-{}'.format(lock_name, index) for index in range(5)]
+        for name in names:
+            assert session.lock(name)
+        session.close()
+
+        for name in names:
+            assert self.get_client_with_lock_acquired(lock_server, name)
+
+    def test_responses_include_request_id(self, lock_server: ServerThread, lock_name):
+        session = self._get_session(lock_server)
+        protocol = session._protocol
+
+        protocol.send('lock,name:{},rid:a1'.format(lock_name))
+        assert protocol.readline() == 'ok,rid:a1'
+        protocol.send('release,name:{},rid:a2'.format(lock_name))
+        assert protocol.readline() == 'released,rid:a2'
+        protocol.send('release,name:{},rid:a3'.format(lock_name))
+        assert protocol.readline() == 'err,rid:a3,reason:lock not held'
+        protocol.send('invalid,rid:a4')
+        assert protocol.readline() == constants.RESPONSE_INVALID_ACTION + ',rid:a4'
+        protocol.send('lock,name:{}'.format(lock_name))
+        assert protocol.readline() == constants.RESPONSE_INVALID_REQUEST
+
+        # session still works
+        session.keepalive()
+        session.close()
+
+    def test_unsupported_parameters_are_rejected(self, lock_server: ServerThread, lock_name):
+        session = self._get_session(lock_server)
+        protocol = session._protocol
+
+        for param in ('wait', 'ttl', 'keepalive-timeout'):
+            protocol.send('lock,name:{},rid:r1,{}:10'.format(lock_name, param))
+            assert protocol.readline() == 'err,rid:r1,reason:{} is not supported in sessions'.format(param)
+        assert session.held == frozenset()
+
+        # the lock was not acquired
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
+        session.close()
+
+
+class TestMultiLock(BaseTest):
+
+    def _get_names(self, lock_name, count=3):
+        return ['{}-{}'.format(lock_name, index) for index in range(count)]
+
+    def test_all_locks_are_granted(self, lock_server: ServerThread, lock_name):
+        names = self._get_names(lock_name)
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock_many(names)
+        assert client.acquired
+
+        for name in names:
+            other = lock_server.get_client()
+            other.connect()
+            assert not other.lock(name)
+            other.close()
+
+        client.keepalive()
+        client.release()
+        for name in names:
+            assert self.get_client_with_lock_acquired(lock_server, name)
+
+    def test_none_is_granted_if_one_is_busy(self, lock_server: ServerThread, lock_name):
+        names = self._get_names(lock_name)
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(names[1])
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock_many(names)
+        client.close()
+
+        # The locks acquired before finding the busy one were released
+        for name in (names[0], names[2]):
+            other = lock_server.get_client()
+            other.connect()
+            assert other.lock(name)
+            other.close()
+        holder.close()
+
+    def test_wait_for_all_locks(self, lock_server: ServerThread, lock_name):
+        names = self._get_names(lock_name)
+        holder_1 = lock_server.get_client()
+        holder_1.connect()
+        assert holder_1.lock(names[0])
+        holder_2 = lock_server.get_client()
+        holder_2.connect()
+        assert holder_2.lock(names[2])
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(client.lock_many(names, wait=10)), daemon=True)
+        client = lock_server.get_client()
+        client.connect()
+        thread.start()
+
+        holder_2.release()
+        time.sleep(0.2)
+        assert thread.is_alive()
+        holder_1.release()
+        thread.join(2)
+        assert results == [True]
+        client.close()
+
+    def test_wait_for_all_locks_times_out(self, lock_server: ServerThread, lock_name):
+        names = self._get_names(lock_name)
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(names[2])
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock_many(names, wait=0.3)
+        client.close()
+
+        for name in names[:2]:
+            other = lock_server.get_client()
+            other.connect()
+            assert other.lock(name)
+            other.close()
+        holder.close()
+
+    def test_overlapping_waiters_do_not_deadlock(self, lock_server: ServerThread, lock_name):
+        names = self._get_names(lock_name, 4)
+        results = []
+
+        def worker(lock_names):
+            for _ in range(5):
+                client = lock_server.get_client()
+                client.connect()
+                results.append(client.lock_many(lock_names, wait=10))
+                client.release()
+
+        threads = [
+            threading.Thread(target=worker, args=(names[0:3],), daemon=True),
+            threading.Thread(target=worker, args=(list(reversed(names[1:4])),), daemon=True),
+            threading.Thread(target=worker, args=([names[3], names[0]],), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            assert not thread.is_alive(), "Deadlock detected"
+        assert results == [True] * 15
+
+    def test_server_rejects_invalid_names(self, lock_server: ServerThread, lock_name):
+        for line in ('lock,names:valid;in valid', 'lock,names:valid;', 'lock,name:x,names:y'):
+            client = lock_server.get_client()
+            client.connect()
+            client._protocol.send(line)
+            assert client._protocol.readline() == constants.RESPONSE_ERR + ',invalid lock name'
+            client.close()
+
+    def test_lock_many_in_session(self, lock_server: ServerThread, lock_name):
+        names = self._get_names(lock_name)
+        session = LockSession('localhost', lock_server.port)
+        session.connect()
+        assert session.lock_many(names)
+        assert not session.lock_many([lock_name + '-other', names[0]])
+        assert session.held == frozenset(names)
+        session.close()
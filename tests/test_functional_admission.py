@@ -0,0 +1,146 @@
+"""
+Tests for the admission control of the servers (`max_connections`, `backlog` and `handshake_timeout`).
+"""
+import functools
+import gc
+import socket
+import time
+
+import pytest
+
+from tcpnetlock import constants
+from tcpnetlock.client.client import LockSession
+from tcpnetlock.common import ServerBusyError
+from tcpnetlock.protocol import Protocol
+from tcpnetlock.server.async_server import AsyncTCPServer
+from tcpnetlock.server.server import TCPServer
+from .test_utils import BaseTest
+from .test_utils import HANDSHAKE_TIMEOUT
+from .test_utils import MAX_CONNECTIONS
+from .test_utils import ServerThread
+from .test_utils import _shutdown_server
+from .test_utils import _start_server
+from .test_utils import handshake_lock_server
+from .test_utils import limited_lock_server
+from .test_utils import lock_name
+
+assert handshake_lock_server
+assert limited_lock_server
+assert lock_name
+
+
+class TestAdmissionControl(BaseTest):
+
+    def _get_holders(self, lock_server: ServerThread, lock_name: str, count: int) -> list:
+        holders = []
+        for index in range(count):
+            holder = lock_server.get_client()
+            holder.connect()
+            assert holder.lock('{}-{}'.format(lock_name, index))
+            holders.append(holder)
+        return holders
+
+    def test_connections_over_the_limit_are_refused(self, limited_lock_server: ServerThread, lock_name):
+        holders = self._get_holders(limited_lock_server, lock_name, MAX_CONNECTIONS)
+
+        client = limited_lock_server.get_client()
+        client.connect()
+        with pytest.raises(ServerBusyError):
+            client.lock(lock_name)
+        client.close()
+
+        context = limited_lock_server.server.context
+        assert context.connections_rejected_count.count == 1
+        assert context.counters()['connections_rejected_count'] == 1
+        assert context.active_connections == MAX_CONNECTIONS
+
+        # Once a connection is closed, new connections are accepted again
+        holders.pop().release()
+        for _ in range(50):
+            if context.active_connections < MAX_CONNECTIONS:
+                break
+            time.sleep(0.05)
+        client = limited_lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name)
+        client.close()
+        for holder in holders:
+            holder.close()
+
+    def test_busy_is_sent_without_reading_the_request(self, limited_lock_server: ServerThread, lock_name):
+        holders = self._get_holders(limited_lock_server, lock_name, MAX_CONNECTIONS)
+
+        sock = socket.create_connection(('localhost', limited_lock_server.port))
+        sock.settimeout(5)
+        assert sock.recv(1024) == (constants.RESPONSE_SERVER_BUSY + '\n').encode()
+        assert sock.recv(1024) == b''
+        sock.close()
+        for holder in holders:
+            holder.close()
+
+    def test_session_is_refused(self, limited_lock_server: ServerThread, lock_name):
+        holders = self._get_holders(limited_lock_server, lock_name, MAX_CONNECTIONS)
+
+        session = LockSession('localhost', limited_lock_server.port)
+        with pytest.raises(ServerBusyError):
+            session.connect()
+        session.close()
+        for holder in holders:
+            holder.close()
+
+    def test_backlog(self, limited_lock_server: ServerThread):
+        assert limited_lock_server.server.request_queue_size == 16
+        assert TCPServer.request_queue_size == socket.SOMAXCONN
+
+
+class TestHandshakeTimeout(BaseTest):
+
+    def _assert_closed_by_server(self, sock: socket.socket):
+        sock.settimeout(HANDSHAKE_TIMEOUT * 10)
+        start = time.monotonic()
+        assert sock.recv(1024) == b''
+        assert time.monotonic() - start < HANDSHAKE_TIMEOUT * 5
+        sock.close()
+
+    def test_idle_connection_is_closed(self, handshake_lock_server: ServerThread):
+        counter = handshake_lock_server.server.context.handshake_timeout_count
+        timeouts = counter.count
+        sock = socket.create_connection(('localhost', handshake_lock_server.port))
+        self._assert_closed_by_server(sock)
+        assert counter.count == timeouts + 1
+        assert handshake_lock_server.server.context.counters()['handshake_timeout_count'] == timeouts + 1
+
+    def test_incomplete_line_is_not_enough(self, handshake_lock_server: ServerThread, lock_name):
+        sock = socket.create_connection(('localhost', handshake_lock_server.port))
+        sock.sendall('lock,name:{}'.format(lock_name).encode())
+        self._assert_closed_by_server(sock)
+
+    def test_deadline_stops_once_the_request_is_received(self, handshake_lock_server: ServerThread, lock_name):
+        client = handshake_lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name)
+        time.sleep(HANDSHAKE_TIMEOUT * 2)
+        client.keepalive()
+        client.release()
+
+    def test_many_idle_connections_are_closed(self, handshake_lock_server: ServerThread):
+        socks = [socket.create_connection(('localhost', handshake_lock_server.port)) for _ in range(50)]
+        for sock in socks:
+            self._assert_closed_by_server(sock)
+
+    @pytest.mark.parametrize('server_class', [TCPServer, AsyncTCPServer])
+    def test_finished_connections_are_not_referenced(self, server_class):
+        server_thread = _start_server(functools.partial(server_class, handshake_timeout=30))
+        # The deadline of this connection is the first to expire: the cancelled ones stay behind it
+        idle = socket.create_connection(('localhost', server_thread.port))
+        for _ in range(500):
+            client = server_thread.get_client()
+            client.connect()
+            client.ping()
+            client.close()
+
+        gc.collect()
+        protocols = [obj for obj in gc.get_objects() if isinstance(obj, Protocol)]
+        assert len(protocols) < 50
+        idle.close()
+        _shutdown_server(server_thread)
@@ -0,0 +1,101 @@
+"""
+Tests for `tcpnetlock.server.async_server`.
+
+Runs the functional tests of `test_functional` against the event-loop server.
+"""
+import logging
+import socket
+import time
+
+import pytest
+
+from tcpnetlock import constants
+from tcpnetlock.protocol import Protocol
+from tcpnetlock.server.async_server import AsyncTCPServer
+from .test_functional import TestAction
+from .test_functional import TestGetStats
+from .test_functional import TestGetTopLocks
+from .test_functional import TestLock
+from .test_functional import TestLease
+from .test_functional import TestLockCleanup
+from .test_functional import TestMultiLock
+from .test_functional import TestProtocol
+from .test_functional import TestSession
+from .test_functional import TestWaitForLock
+from .test_functional import TestWithLockGranted
+from .test_utils import BaseTest
+from .test_utils import ServerThread
+from .test_utils import async_lock_server
+from .test_utils import lock_name
+from .test_utils import no_free_file_descriptors
+
+assert TestAction
+assert TestGetStats
+assert TestGetTopLocks
+assert TestLock
+assert TestLease
+assert TestLockCleanup
+assert TestMultiLock
+assert TestProtocol
+assert TestSession
+assert TestWaitForLock
+assert TestWithLockGranted
+assert async_lock_server
+assert lock_name
+
+
+@pytest.fixture(scope='module')
+def lock_server(async_lock_server) -> ServerThread:
+    """Overrides the `lock_server` fixture, so the imported tests run against the AsyncTCPServer"""
+    return async_lock_server
+
+
+class TestAsyncServer(BaseTest):
+
+    def test_many_holders_are_served_from_a_single_thread(self, lock_server: ServerThread, lock_name):
+        clients = []
+        for index in range(50):
+            client = lock_server.get_client()
+            client.connect()
+            assert client.lock('{}-{}'.format(lock_name, index))
+            clients.append(client)
+
+        for client in clients:
+            client.keepalive()
+
+        assert len(lock_server.server._connections) >= len(clients)
+
+        for client in clients:
+            client.release()
+            client.close()
+
+    def test_running_out_of_file_descriptors_does_not_stop_the_server(self, lock_server: ServerThread, caplog):
+        caplog.set_level(logging.ERROR, logger='tcpnetlock.server.async_server')
+        clients = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in range(3)]
+        with no_free_file_descriptors():
+            for client in clients:
+                client.connect(lock_server.server.socket.getsockname())
+            time.sleep(AsyncTCPServer.ACCEPT_RETRY_DELAY * 3)
+        assert 'Too many open files' in caplog.text
+        assert lock_server.is_alive()
+
+        # The connections are accepted once file descriptors are available again
+        for client in clients:
+            protocol = Protocol(client)
+            protocol.send(constants.ACTION_PING)
+            assert protocol.readline(timeout=5) == constants.RESPONSE_PONG
+            client.close()
+
+    def test_lock_twice_fails_while_other_client_holds_it(self, lock_server: ServerThread, lock_name):
+        client_1 = lock_server.get_client()
+        client_1.connect()
+        assert client_1.lock(lock_name)
+
+        client_2 = lock_server.get_client()
+        client_2.connect()
+        assert not client_2.lock(lock_name)
+        client_2.close()
+
+        client_1.release()
+        client_1.close()
+        assert self.get_client_with_lock_acquired(lock_server, lock_name)
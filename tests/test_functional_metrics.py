@@ -0,0 +1,80 @@
+"""
+Tests for `tcpnetlock.server.metrics` package.
+"""
+import urllib.error
+import urllib.request
+
+import pytest
+
+from tcpnetlock.server.metrics import CONTENT_TYPE
+from tcpnetlock.server.metrics import MetricsRenderer
+from tcpnetlock.server.metrics import MetricsServer
+from .test_utils import BaseTest
+from .test_utils import ServerThread
+from .test_utils import lock_name
+from .test_utils import lock_server
+
+assert lock_name
+assert lock_server
+
+
+@pytest.fixture
+def metrics_server(lock_server: ServerThread) -> MetricsServer:
+    metrics_server = MetricsServer(lock_server.server.context)
+    metrics_server.start()
+    yield metrics_server
+    metrics_server.stop()
+
+
+def scrape(metrics_server: MetricsServer, path='/metrics'):
+    url = 'http://localhost:{port}{path}'.format(port=metrics_server.port, path=path)
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.headers['Content-Type'], response.read().decode()
+
+
+def parse_samples(text: str) -> dict:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetrics(BaseTest):
+
+    def test_metrics_are_served(self, lock_server: ServerThread, metrics_server: MetricsServer, lock_name):
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name)
+
+        content_type, text = scrape(metrics_server)
+        assert content_type == CONTENT_TYPE
+        assert text.endswith('# EOF\n')
+
+        samples = parse_samples(text)
+        assert samples['tcpnetlock_requests_total'] >= 1
+        assert samples['tcpnetlock_lock_acquired_total'] >= 1
+        assert samples['tcpnetlock_connections_rejected_total'] >= 0
+        assert samples['tcpnetlock_handshake_timeouts_total'] >= 0
+        assert samples['tcpnetlock_active_connections'] >= 1
+        assert samples['tcpnetlock_lock_table_size'] >= 1
+        assert samples['tcpnetlock_threads'] >= 1
+        assert samples['tcpnetlock_time_to_grant_seconds_count'] >= 1
+        assert 'tcpnetlock_request_latency_seconds{quantile="0.99"}' in samples
+        assert samples['tcpnetlock_top_lock_acquired{{lock="{}"}}'.format(lock_name)] >= 1
+        client.close()
+
+    def test_unknown_path(self, metrics_server: MetricsServer):
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            scrape(metrics_server, '/other')
+        assert excinfo.value.code == 404
+
+    def test_snapshot_is_cached(self, lock_server: ServerThread):
+        renderer = MetricsRenderer(lock_server.server.context)
+        snapshot = renderer.get_snapshot()
+        lock_server.server.context.requests_count.incr()
+        assert renderer.get_snapshot() is snapshot
+
+        renderer.SNAPSHOT_MAX_AGE = 0
+        assert renderer.get_snapshot() is not snapshot
@@ -0,0 +1,164 @@
+"""
+Tests for `tcpnetlock.server.multiprocess`: runs tests of `test_functional` against the ShardedTCPServer
+(the ones that don't inspect the state of the server), and tests specific to the multi-process mode.
+"""
+import socket
+
+import pytest
+
+from tcpnetlock.server.multiprocess import get_shard
+from tcpnetlock.server.multiprocess import receive_connection
+from tcpnetlock.server.multiprocess import send_connection
+from .test_functional import TestLease
+from .test_functional import TestLock
+from .test_functional import TestProtocol
+from .test_utils import BaseTest
+from .test_utils import ServerThread
+from .test_utils import lock_name
+from .test_utils import no_free_file_descriptors
+from .test_utils import sharded_lock_server
+
+assert TestLease
+assert TestLock
+assert TestProtocol
+assert sharded_lock_server
+assert lock_name
+
+
+@pytest.fixture(scope='module')
+def lock_server(sharded_lock_server) -> ServerThread:
+    """Overrides the `lock_server` fixture, so the imported tests run against the ShardedTCPServer"""
+    return sharded_lock_server
+
+
+def get_names_by_shard(lock_name: str, shards: int = 2) -> dict:
+    """Returns a lock name owned by each shard"""
+    names = {}
+    index = 0
+    while len(names) < shards:
+        name = '{}-{}'.format(lock_name, index)
+        names.setdefault(get_shard(name, shards), name)
+        index += 1
+    return names
+
+
+class TestShardedServer(BaseTest):
+
+    def _stats(self, lock_server: ServerThread, shard: int) -> dict:
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('.stats,shard:{}'.format(shard))
+        response_code, stats = client._protocol.readline().split(',', 1)
+        client.close()
+        assert response_code == 'stats'
+        return stats
+
+    def test_locks_are_served_by_their_shard(self, lock_server: ServerThread, lock_name):
+        holders = []
+        for shard, name in sorted(get_names_by_shard(lock_name).items()):
+            holder = lock_server.get_client()
+            holder.connect()
+            assert holder.lock(name)
+            holders.append(holder)
+
+            client = lock_server.get_client()
+            client.connect()
+            assert not client.lock(name)
+            client.close()
+
+        for holder in holders:
+            holder.keepalive()
+            holder.release()
+
+    def test_wait_for_lock_held_by_other_client(self, lock_server: ServerThread, lock_name):
+        holder = lock_server.get_client()
+        holder.connect()
+        assert holder.lock(lock_name)
+
+        client = lock_server.get_client()
+        client.connect()
+        assert not client.lock(lock_name, wait=0.2)
+
+        holder.release()
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name, wait=5)
+        client.release()
+
+    def test_multi_lock_in_same_shard(self, lock_server: ServerThread, lock_name):
+        names = [name for name in ('{}-{}'.format(lock_name, index) for index in range(20))
+                 if get_shard(name, 2) == 0][:3]
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock_many(names)
+        client.release()
+
+    def test_multi_lock_in_different_shards_is_refused(self, lock_server: ServerThread, lock_name):
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('lock,names:{}'.format(';'.join(get_names_by_shard(lock_name).values())))
+        assert client._protocol.readline() == 'err,locks owned by different workers'
+        client.close()
+
+    def test_session_is_refused(self, lock_server: ServerThread):
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('session')
+        assert client._protocol.readline().startswith('err,')
+        client.close()
+
+    def test_lease_token_includes_the_shard(self, lock_server: ServerThread, lock_name):
+        for shard, name in get_names_by_shard(lock_name).items():
+            client = lock_server.get_client()
+            client.connect()
+            token = client.lease(name, ttl=60)
+            assert token.startswith('{}.'.format(shard))
+
+            client = lock_server.get_client()
+            client.connect()
+            assert client.release_lease(token)
+
+    def test_stats_of_each_shard(self, lock_server: ServerThread):
+        assert self._stats(lock_server, 0)
+        assert self._stats(lock_server, 1)
+
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.send('.stats,shard:2')
+        assert client._protocol.readline() == 'err,invalid shard'
+        client.close()
+
+    def test_pipelined_lines_are_handed_off(self, lock_server: ServerThread, lock_name):
+        client = lock_server.get_client()
+        client.connect()
+        client._protocol.socket.sendall('lock,name:{}\n.keepalive\n'.format(lock_name).encode())
+        assert client._protocol.readline() == 'ok'
+        assert client._protocol.readline() == 'alive'
+        client.release()
+
+
+class TestHandoff:
+
+    def test_connection_is_received(self):
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sock, peer = socket.socketpair()
+        send_connection(sender, sock, b'ping\n')
+        received, data = receive_connection(receiver)
+        assert data == b'ping\n'
+        received.sendall(b'pong')
+        assert peer.recv(4) == b'pong'
+
+        sender.close()
+        assert receive_connection(receiver) is None
+        for item in (receiver, sock, peer, received):
+            item.close()
+
+    def test_connection_lost_for_lack_of_file_descriptors_is_not_end_of_handoff(self):
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sock, peer = socket.socketpair()
+        send_connection(sender, sock, b'ping\n')
+        with no_free_file_descriptors():
+            with pytest.raises(OSError):
+                receive_connection(receiver)
+        for item in (sender, receiver, sock, peer):
+            item.close()
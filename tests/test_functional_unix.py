@@ -0,0 +1,85 @@
+"""
+Tests for `tcpnetlock.server.server.UnixServer` and `tcpnetlock.server.async_server.AsyncUnixServer`.
+
+Runs the functional tests of `test_functional` with the clients connected to the Unix domain socket.
+"""
+import os
+import socket
+
+import pytest
+
+from tcpnetlock.client.client import LockClient
+from tcpnetlock.server.async_server import AsyncUnixServer
+from tcpnetlock.server.server import UnixServer
+from .test_functional import TestLease
+from .test_functional import TestLock
+from .test_functional import TestLockCleanup
+from .test_functional import TestMultiLock
+from .test_functional import TestProtocol
+from .test_functional import TestWaitForLock
+from .test_functional import TestWithLockGranted
+from .test_utils import BaseTest
+from .test_utils import UnixServerThread
+from .test_utils import lock_name
+from .test_utils import unix_lock_server
+
+assert TestLease
+assert TestLock
+assert TestLockCleanup
+assert TestMultiLock
+assert TestProtocol
+assert TestWaitForLock
+assert TestWithLockGranted
+assert lock_name
+assert unix_lock_server
+
+
+@pytest.fixture(scope='module')
+def lock_server(unix_lock_server) -> UnixServerThread:
+    """Overrides the `lock_server` fixture, so the imported tests use the Unix domain socket"""
+    return unix_lock_server
+
+
+class TestUnixSocket(BaseTest):
+
+    def test_locks_are_shared_with_tcp(self, lock_server: UnixServerThread, lock_name):
+        unix_client = lock_server.get_client()
+        unix_client.connect()
+        assert unix_client.lock(lock_name)
+
+        tcp_client = lock_server.get_client(host='localhost')
+        tcp_client.connect()
+        assert not tcp_client.lock(lock_name)
+        tcp_client.close()
+
+        unix_client.release()
+        tcp_client = self.get_client_with_lock_acquired(lock_server, lock_name)
+        assert tcp_client is not None
+        tcp_client.close()
+
+    def test_connect_fails_if_socket_does_not_exist(self, tmp_path):
+        client = LockClient('unix:' + str(tmp_path / 'missing.sock'))
+        with pytest.raises(FileNotFoundError):
+            client.connect()
+
+    @pytest.mark.parametrize('server_class', [UnixServer, AsyncUnixServer])
+    def test_stale_socket_is_replaced(self, server_class, tmp_path):
+        path = str(tmp_path / 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()  # like a killed server: the socket file is left behind
+
+        unix_server = server_class(path)
+        assert os.path.exists(path)
+        unix_server.server_close()
+        assert not os.path.exists(path)
+
+    @pytest.mark.parametrize('server_class', [UnixServer, AsyncUnixServer])
+    def test_socket_in_use_is_not_replaced(self, server_class, lock_server: UnixServerThread, lock_name):
+        with pytest.raises(OSError):
+            server_class(lock_server.path)
+
+        client = lock_server.get_client()
+        client.connect()
+        assert client.lock(lock_name)
+        client.close()
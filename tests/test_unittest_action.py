@@ -29,3 +29,42 @@ class TestActionStr:
         act = action.Action.from_line('action_name,:nokey')
         assert not act.is_valid()
         str(act)
+
+
+class TestActionFromLine:
+
+    def test_action_without_params(self):
+        act = action.Action.from_line('.keepalive')
+        assert act.is_valid()
+        assert act.name == '.keepalive'
+        assert act.params == {}
+
+    def test_action_with_one_param(self):
+        act = action.Action.from_line('lock,name:resource-1')
+        assert act.is_valid()
+        assert act.name == 'lock'
+        assert act.params == {'name': 'resource-1'}
+
+    def test_action_with_many_params(self):
+        act = action.Action.from_line('lock,name:resource-1,client-id:host@123,wait:30')
+        assert act.is_valid()
+        assert act.params == {'name': 'resource-1', 'client-id': 'host@123', 'wait': '30'}
+
+    def test_spaces_are_stripped(self):
+        act = action.Action.from_line(' lock , name : resource-1 , wait:1 ')
+        assert act.name == 'lock'
+        assert act.params == {'name': 'resource-1', 'wait': '1'}
+
+    def test_param_without_value(self):
+        act = action.Action.from_line('lock,name,other:')
+        assert act.is_valid()
+        assert act.params == {'name': '', 'other': ''}
+
+    def test_value_can_contain_colon(self):
+        act = action.Action.from_line('lock,name:a:b')
+        assert act.params == {'name': 'a:b'}
+
+    def test_empty_param_key_is_invalid(self):
+        assert not action.Action.from_line('lock,').is_valid()
+        assert not action.Action.from_line('lock,name:x,:y').is_valid()
+        assert not action.Action.from_line('').is_valid()
@@ -0,0 +1,45 @@
+"""
+Unittests for the counters in `tcpnetlock.common`.
+"""
+import threading
+
+from tcpnetlock.common import StripedCounter
+
+
+class TestStripedCounter:
+
+    def test_incr(self):
+        counter = StripedCounter()
+        assert counter.count == 0
+        counter.incr()
+        counter.incr()
+        assert counter.count == 2
+
+    def test_count_is_exact_with_many_threads(self):
+        counter = StripedCounter()
+        start = threading.Event()
+
+        def worker():
+            start.wait()
+            for _ in range(20000):
+                counter.incr()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        assert counter.count == 8 * 20000
+
+    def test_memory_does_not_grow_with_threads(self):
+        counter = StripedCounter()
+        for _ in range(50):
+            thread = threading.Thread(target=counter.incr)
+            thread.start()
+            thread.join()
+        counter.incr()
+
+        assert counter.count == 51
+        assert len(counter._cells) == StripedCounter.CELLS
+        assert len([cell for cell in counter._cells if cell.value]) > 1  # the threads use different cells
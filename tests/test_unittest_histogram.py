@@ -0,0 +1,67 @@
+"""
+Unittests for `tcpnetlock.server.histogram` package.
+"""
+import threading
+
+import pytest
+
+from tcpnetlock.server.histogram import Histogram
+
+
+class TestHistogram:
+
+    def test_empty_histogram(self):
+        summary = Histogram().summary()
+        assert summary['count'] == 0
+        assert summary['p50'] is None
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 1001):
+            histogram.record(value / 1000)
+
+        summary = histogram.summary()
+        assert summary['count'] == 1000
+        assert summary['p50'] == pytest.approx(0.5, rel=1 / Histogram.SUB_BUCKETS)
+        assert summary['p90'] == pytest.approx(0.9, rel=1 / Histogram.SUB_BUCKETS)
+        assert summary['p99'] == pytest.approx(0.99, rel=1 / Histogram.SUB_BUCKETS)
+        assert summary['p999'] == pytest.approx(0.999, rel=1 / Histogram.SUB_BUCKETS)
+
+    def test_reported_value_is_not_below_recorded_value(self):
+        for value in (0.0000013, 0.000250, 0.0123, 1.7, 300.0):
+            histogram = Histogram()
+            histogram.record(value)
+            assert value <= histogram.summary()['p50'] <= value * (1 + 1 / Histogram.SUB_BUCKETS) + 0.000001
+
+    def test_out_of_range_values(self):
+        histogram = Histogram()
+        histogram.record(0)
+        histogram.record(-1)
+        histogram.record(10 ** 9)
+        counts = histogram.counts()
+        assert counts[0] == 2
+        assert counts[-1] == 1
+
+    def test_records_from_many_threads(self):
+        histogram = Histogram()
+
+        def worker():
+            for _ in range(5000):
+                histogram.record(0.001)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert histogram.summary()['count'] == 8 * 5000
+
+    def test_threads_are_spread_over_the_shards(self):
+        histogram = Histogram()
+        threads = [threading.Thread(target=histogram.record, args=(0.001,)) for _ in range(Histogram.SHARDS)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+
+        used_shards = [shard for shard in histogram._shards if sum(shard.counts)]
+        assert len(used_shards) > 1
@@ -0,0 +1,35 @@
+"""
+Guards the startup time of the client and the command line tools: checks (with `python -X importtime`)
+that they don't import the server, nor modules only needed by some features.
+"""
+import subprocess
+import sys
+
+import pytest
+
+NOT_IMPORTED_BY_CLIENTS = (
+    'tcpnetlock.server',
+    'tcpnetlock.timers',
+    'tcpnetlock.client.keepalive',
+    'socketserver',
+    'http',
+    'json',
+)
+
+
+def get_imported_modules(module: str) -> list:
+    """Imports `module` in a new interpreter, and returns the names of the modules imported"""
+    completed_process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                       stderr=subprocess.PIPE, check=True)
+    return [line.rsplit('|', 1)[1].strip()
+            for line in completed_process.stderr.decode().splitlines()
+            if line.startswith('import time:') and 'cumulative' not in line]
+
+
+@pytest.mark.parametrize('module', ['tcpnetlock.client.client', 'tcpnetlock.cli.tnl_do', 'tcpnetlock.cli.tnl_client'])
+def test_clients_do_not_import_server(module):
+    imported = get_imported_modules(module)
+    assert module in imported
+    unexpected = [name for name in imported
+                  if any(name == prefix or name.startswith(prefix + '.') for prefix in NOT_IMPORTED_BY_CLIENTS)]
+    assert not unexpected, "Modules imported by {}: {}".format(module, unexpected)
@@ -0,0 +1,82 @@
+"""
+Unittests for `tcpnetlock.client.keepalive` package.
+"""
+import socket
+import threading
+import time
+
+import pytest
+
+from tcpnetlock.client.client import LockClient
+from tcpnetlock.client.keepalive import KeepaliveScheduler
+from tcpnetlock.common import ClientDisconnected
+
+
+class FakeClient:
+
+    def __init__(self, error: Exception = None):
+        self.keepalives = 0
+        self.error = error
+        self.sent = threading.Event()
+
+    def keepalive(self, timeout: float = None):
+        self.keepalives += 1
+        self.sent.set()
+        if self.error is not None:
+            raise self.error
+
+
+class TestKeepaliveScheduler:
+
+    def test_keepalives_are_sent_for_all_the_clients(self):
+        scheduler = KeepaliveScheduler()
+        clients = [FakeClient() for _ in range(3)]
+        for client in clients:
+            scheduler.add(client, 0.05)
+        time.sleep(0.3)
+        for client in clients:
+            scheduler.remove(client)
+        assert all(client.keepalives >= 2 for client in clients)
+        assert len(scheduler) == 0
+
+    def test_removed_client_gets_no_more_keepalives(self):
+        scheduler = KeepaliveScheduler()
+        client = FakeClient()
+        scheduler.add(client, 0.05)
+        assert client.sent.wait(2)
+        scheduler.remove(client)
+        keepalives = client.keepalives
+        time.sleep(0.2)
+        assert client.keepalives == keepalives
+
+    @pytest.mark.parametrize('error', [ClientDisconnected(), AssertionError("Invalid response: 'x'")])
+    def test_client_is_removed_on_error(self, error):
+        scheduler = KeepaliveScheduler()
+        client = FakeClient(error=error)
+        scheduler.add(client, 0.05)
+        assert client.sent.wait(2)
+        time.sleep(0.2)
+        assert client not in scheduler
+        assert client.keepalives == 1
+
+    def test_client_without_response_does_not_stop_the_rest(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('localhost', 0))
+        listener.listen(1)  # the connection is never accepted: keepalives get no response
+        silent_client = LockClient('localhost', listener.getsockname()[1])
+        silent_client.connect()
+
+        scheduler = KeepaliveScheduler()
+        client = FakeClient()
+        scheduler.add(silent_client, 0.1)
+        scheduler.add(client, 0.1)
+        time.sleep(1)
+        scheduler.remove(client)
+        assert silent_client not in scheduler
+        assert client.keepalives >= 5
+
+        silent_client.close()
+        listener.close()
+
+    def test_default_scheduler_is_shared(self):
+        assert KeepaliveScheduler.default() is KeepaliveScheduler.default()
@@ -0,0 +1,59 @@
+"""
+Unittests for `tcpnetlock.server.leases` package.
+"""
+import time
+
+from tcpnetlock.server.leases import LeaseTable
+from tcpnetlock.server.lock_table import LockTable
+
+
+def get_held_locks(lock_table: LockTable, *lock_names):
+    locks = lock_table.reference_all(lock_names)
+    assert lock_table.acquire_non_blocking_all(locks) == len(locks)
+    return locks
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestLeaseTable:
+
+    def test_release(self):
+        lock_table = LockTable()
+        released = []
+        leases = LeaseTable(lock_table, on_released=released.append)
+        locks = get_held_locks(lock_table, 'lock-1', 'lock-2')
+        lease = leases.create(locks, ttl=60)
+
+        assert lease.token in leases
+        assert leases.release(lease.token)
+        assert lease.token not in leases
+        assert released == [locks]
+        assert len(lock_table) == 0
+        assert not leases.release(lease.token)
+
+    def test_expiration(self):
+        lock_table = LockTable()
+        leases = LeaseTable(lock_table)
+        lease = leases.create(get_held_locks(lock_table, 'lock-1'), ttl=0.1)
+
+        assert wait_until(lambda: lease.token not in leases)
+        assert len(lock_table) == 0
+        assert not leases.renew(lease.token)
+
+    def test_renew_postpones_expiration(self):
+        lock_table = LockTable()
+        leases = LeaseTable(lock_table)
+        lease = leases.create(get_held_locks(lock_table, 'lock-1'), ttl=0.2)
+
+        for _ in range(4):
+            time.sleep(0.1)
+            assert leases.renew(lease.token)
+        assert lease.token in leases
+        assert leases.renew(lease.token, ttl=0.1)
+        assert wait_until(lambda: lease.token not in leases)
+        assert len(lock_table) == 0
@@ -0,0 +1,71 @@
+"""
+Unittests for `tcpnetlock.server.lock` package.
+"""
+import threading
+
+from tcpnetlock.server.lock import Lock
+from tcpnetlock.server.lock import Waiter
+
+
+class TestLock:
+
+    def test_acquire_non_blocking(self):
+        lock = Lock('lock1')
+        assert lock.acquire_non_blocking()
+        assert lock.locked
+        assert not lock.acquire_non_blocking()
+        lock.release()
+        assert not lock.locked
+
+    def test_release_hands_off_to_waiters_in_fifo_order(self):
+        lock = Lock('lock1')
+        assert lock.acquire_non_blocking()
+
+        granted = []
+        waiters = [Waiter(lambda index=index: granted.append(index)) for index in range(3)]
+        for waiter in waiters:
+            assert not lock.add_waiter(waiter)
+
+        for expected in range(3):
+            lock.release()
+            assert granted == list(range(expected + 1))
+            assert lock.locked  # ownership was transferred, never released
+
+        lock.release()
+        assert not lock.locked
+
+    def test_new_clients_dont_barge_ahead_of_waiters(self):
+        lock = Lock('lock1')
+        assert lock.acquire_non_blocking()
+        assert not lock.add_waiter(Waiter(lambda: None))
+        lock.release()
+        assert not lock.acquire_non_blocking()
+
+    def test_cancelled_waiters_are_skipped(self):
+        lock = Lock('lock1')
+        assert lock.acquire_non_blocking()
+
+        granted = []
+        waiter_1 = Waiter(lambda: granted.append(1))
+        waiter_2 = Waiter(lambda: granted.append(2))
+        lock.add_waiter(waiter_1)
+        lock.add_waiter(waiter_2)
+
+        assert lock.cancel_waiter(waiter_1)
+        lock.release()
+        assert granted == [2]
+        assert not lock.cancel_waiter(waiter_2)  # too late, it owns the lock
+
+    def test_acquire_with_timeout(self):
+        lock = Lock('lock1')
+        assert lock.acquire(timeout=0.1)
+        assert not lock.acquire(timeout=0.1)
+
+        result = []
+        thread = threading.Thread(target=lambda: result.append(lock.acquire(timeout=10)))
+        thread.start()
+        while not lock.waiting:
+            thread.join(0.01)
+        lock.release()
+        thread.join()
+        assert result == [True]
@@ -0,0 +1,59 @@
+"""
+Unittests for `tcpnetlock.server.lock_table` package.
+"""
+import threading
+
+from tcpnetlock.server.lock_table import LockTable
+
+
+class TestLockTable:
+
+    def test_reference_returns_same_instance(self):
+        table = LockTable(shards=4)
+        lock = table.reference('lock1')
+        assert table.reference('lock1') is lock
+        assert 'lock1' in table
+        assert table['lock1'] is lock
+        assert lock.refs == 2
+        assert len(table) == 1
+
+    def test_last_dereference_removes_the_lock(self):
+        table = LockTable(shards=4)
+        lock = table.reference('lock1')
+        table.reference('lock1')
+
+        table.dereference(lock)
+        assert 'lock1' in table
+
+        table.dereference(lock)
+        assert 'lock1' not in table
+        assert len(table) == 0
+
+        assert table.reference('lock1') is not lock
+
+    def test_locks_are_distributed_among_shards(self):
+        table = LockTable(shards=4)
+        names = ['lock-{}'.format(i) for i in range(100)]
+        for name in names:
+            table.reference(name)
+
+        assert len(table) == len(names)
+        assert sorted(table.keys()) == sorted(names)
+        assert table.shard_count == 4
+        assert all(len(shard.locks) > 0 for shard in table._shards)
+
+    def test_contention_is_reported_per_shard(self):
+        table = LockTable(shards=2)
+        assert table.contention() == [0, 0]
+
+        shard = table._get_shard('lock1')
+        shard.mutex.acquire()
+        thread = threading.Thread(target=table.reference, args=('lock1',))
+        thread.start()
+        while shard.contention.count == 0:
+            thread.join(0.01)
+        shard.mutex.release()
+        thread.join()
+
+        assert sum(table.contention()) == 1
+        assert table.contention()[table._shards.index(shard)] == 1
@@ -3,56 +3,78 @@ Unittests for `tcpnetlock.protocol` package.
 """
 
 import socket
+import time
 from unittest import mock
 
 import pytest
 
 from tcpnetlock.common import ClientDisconnected
+from tcpnetlock.common import LineTooLongError
 from tcpnetlock.protocol import Protocol
 
 
+def recv_into_mock(*side_effect):
+    """
+    Returns a mock for `socket.recv_into()`: copies each item into the buffer (or raises it if it's an exception).
+    Like `recv_into()`, items that don't fit in the buffer are received in many calls.
+    """
+    items = list(side_effect)
+
+    def recv_into(buffer):
+        item = items.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        if len(item) > len(buffer):
+            items.insert(0, item[len(buffer):])
+            item = item[:len(buffer)]
+        buffer[:len(item)] = item
+        return len(item)
+
+    return mock.MagicMock(side_effect=recv_into)
+
+
 class TestProtocol:
 
     def test_non_blocking_protocol(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=[socket.timeout()])
+        mock_socket.recv_into = recv_into_mock(socket.timeout())
         protocol = Protocol(mock_socket)
         line = protocol.readline(0.1)
         assert line is None
 
     def test_reading_full_line_non_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["full-line\n".encode()])
+        mock_socket.recv_into = recv_into_mock("full-line\n".encode())
         protocol = Protocol(mock_socket)
         line = protocol.readline(0.1)
         assert line == 'full-line'
 
     def test_reading_full_line_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["full-line\n".encode()])
+        mock_socket.recv_into = recv_into_mock("full-line\n".encode())
         protocol = Protocol(mock_socket)
         line = protocol.readline()
         assert line == 'full-line'
 
     def test_reading_partial_line_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["partial-".encode(),
-                                                       "line\n".encode()])
+        mock_socket.recv_into = recv_into_mock("partial-".encode(),
+                                               "line\n".encode())
         protocol = Protocol(mock_socket)
         line = protocol.readline()
         assert line == 'partial-line'
 
     def test_reading_partial_line_non_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["partial-".encode(),
-                                                       "line\n".encode()])
+        mock_socket.recv_into = recv_into_mock("partial-".encode(),
+                                               "line\n".encode())
         protocol = Protocol(mock_socket)
         line = protocol.readline(0.1)
         assert line == 'partial-line'
 
     def test_reading_after_receiving_multiple_lines_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["line1\nline2\nline3\n".encode()])
+        mock_socket.recv_into = recv_into_mock("line1\nline2\nline3\n".encode())
         protocol = Protocol(mock_socket)
 
         line = protocol.readline()
@@ -66,7 +88,7 @@ class TestProtocol:
 
     def test_reading_after_receiving_multiple_lines_non_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["line1\nline2\nline3\n".encode()])
+        mock_socket.recv_into = recv_into_mock("line1\nline2\nline3\n".encode())
         protocol = Protocol(mock_socket)
 
         line = protocol.readline(0.1)
@@ -80,8 +102,8 @@ class TestProtocol:
 
     def test_disconnect_is_detected_non_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["partial-".encode(),
-                                                       ''.encode()])
+        mock_socket.recv_into = recv_into_mock("partial-".encode(),
+                                               ''.encode())
         protocol = Protocol(mock_socket)
 
         with pytest.raises(ClientDisconnected):
@@ -89,9 +111,93 @@ class TestProtocol:
 
     def test_disconnect_is_detected_blocking(self):
         mock_socket = mock.Mock()
-        mock_socket.recv = mock.MagicMock(side_effect=["partial-".encode(),
-                                                       ''.encode()])
+        mock_socket.recv_into = recv_into_mock("partial-".encode(),
+                                               ''.encode())
         protocol = Protocol(mock_socket)
 
         with pytest.raises(ClientDisconnected):
             protocol.readline()
+
+    def test_line_too_long_is_rejected_before_end_of_line(self):
+        mock_socket = mock.Mock()
+        mock_socket.recv_into = recv_into_mock(b'x' * 10, b'x' * 10)
+        protocol = Protocol(mock_socket, max_line_length=15)
+
+        with pytest.raises(LineTooLongError):
+            protocol.readline()
+        assert mock_socket.recv_into.call_count == 2
+
+    def test_line_too_long_received_with_end_of_line(self):
+        mock_socket = mock.Mock()
+        mock_socket.recv_into = recv_into_mock(b'short\n' + b'x' * 20 + b'\n')
+        protocol = Protocol(mock_socket, max_line_length=15)
+
+        assert protocol.readline() == 'short'
+        with pytest.raises(LineTooLongError):
+            protocol.readline()
+
+    def test_line_of_max_length_is_accepted(self):
+        mock_socket = mock.Mock()
+        mock_socket.recv_into = recv_into_mock(b'x' * 15 + b'\n')
+        protocol = Protocol(mock_socket, max_line_length=15)
+        assert protocol.readline() == 'x' * 15
+
+    def test_pending_data_is_moved_to_the_beginning_of_the_buffer(self):
+        mock_socket = mock.Mock()
+        size = Protocol.MIN_BUFFER_SIZE
+        first_line = b'a' * (size - 11) + b'\n'
+        mock_socket.recv_into = recv_into_mock(first_line + b'partial-', b'li', b'ne\nline2\n')
+        protocol = Protocol(mock_socket, max_line_length=size - 1)
+
+        assert protocol.readline() == 'a' * (size - 11)
+        assert protocol.readline() == 'partial-line'
+        assert protocol.readline() == 'line2'
+
+    def test_buffer_grows_only_for_long_lines(self):
+        mock_socket = mock.Mock()
+        long_line = b'b' * 1000
+        mock_socket.recv_into = recv_into_mock(b'short\n', long_line + b'\n')
+        protocol = Protocol(mock_socket)
+
+        assert protocol.readline() == 'short'
+        assert len(protocol._buffer) == Protocol.INITIAL_BUFFER_SIZE
+        assert protocol.readline() == long_line.decode()
+        assert Protocol.INITIAL_BUFFER_SIZE < len(protocol._buffer) <= protocol.max_buffer_size
+
+    def test_buffer_does_not_grow_beyond_max_size(self):
+        mock_socket = mock.Mock()
+        mock_socket.recv_into = recv_into_mock(b'c' * (Protocol.MIN_BUFFER_SIZE * 8))
+        protocol = Protocol(mock_socket, max_line_length=Protocol.MIN_BUFFER_SIZE * 4)
+        with pytest.raises(LineTooLongError):
+            protocol.readline()
+        assert len(protocol._buffer) == protocol.max_buffer_size == Protocol.MIN_BUFFER_SIZE * 4 + 1
+
+    def test_non_ascii_line(self):
+        mock_socket = mock.Mock()
+        mock_socket.recv_into = recv_into_mock('ñandú\n'.encode()[:3], 'ñandú\n'.encode()[3:])
+        protocol = Protocol(mock_socket)
+        assert protocol.readline() == 'ñandú'
+
+    def test_wait_until_closed(self):
+        sock, peer = socket.socketpair()
+        protocol = Protocol(sock)
+        assert not protocol.wait_until_closed(timeout=0.05)
+
+        # Data received while waiting is kept for readline()
+        peer.sendall(b'alive\n')
+        peer.close()
+        assert protocol.wait_until_closed(timeout=1)
+        assert protocol.readline() == 'alive'
+        sock.close()
+
+    def test_wait_until_closed_is_interrupted(self):
+        sock, peer = socket.socketpair()
+        interrupt, notify = socket.socketpair()
+        protocol = Protocol(sock)
+
+        notify.send(b'\0')
+        start = time.monotonic()
+        assert not protocol.wait_until_closed(timeout=10, interrupt=interrupt)
+        assert time.monotonic() - start < 5
+        for item in (sock, peer, interrupt, notify):
+            item.close()
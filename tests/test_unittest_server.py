@@ -2,6 +2,7 @@
 Unittests for `tcpnetlock.server` package.
 """
 from tcpnetlock.server.action import Action
+from tcpnetlock.server.registry import ActionRegistry
 
 
 class TestActions:
@@ -38,3 +39,17 @@ class TestActions:
         action = Action.from_line('action,:value')
         assert action
         assert not action.is_valid()
+
+
+class TestActionRegistry:
+
+    def test_registered_handler_is_returned(self):
+        registry = ActionRegistry(default='default-handler')
+        registry.register('lock', 'lock-handler')
+        assert 'lock' in registry
+        assert registry.get('lock') == 'lock-handler'
+
+    def test_default_is_returned_for_unknown_actions(self):
+        registry = ActionRegistry(default='default-handler')
+        assert 'unknown' not in registry
+        assert registry.get('unknown') == 'default-handler'
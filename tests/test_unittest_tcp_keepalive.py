@@ -0,0 +1,49 @@
+"""
+Unittests for `tcpnetlock.common.TcpKeepalive`.
+"""
+import socket
+
+import pytest
+
+from tcpnetlock.client.client import LockClient
+from tcpnetlock.common import TcpKeepalive
+from tcpnetlock.server.server import TCPServer
+
+
+def get_tcp_option(sock: socket.socket, name: str):
+    if not hasattr(socket, name):
+        pytest.skip("{} not available in this platform".format(name))
+    return sock.getsockopt(socket.IPPROTO_TCP, getattr(socket, name))
+
+
+class TestTcpKeepalive:
+
+    def test_apply(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            TcpKeepalive(idle=7, interval=2, count=4).apply(sock)
+            assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+            assert get_tcp_option(sock, 'TCP_KEEPIDLE') == 7
+            assert get_tcp_option(sock, 'TCP_KEEPINTVL') == 2
+            assert get_tcp_option(sock, 'TCP_KEEPCNT') == 4
+
+    def test_apply_user_timeout(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            TcpKeepalive(user_timeout=1.5).apply(sock)
+            assert get_tcp_option(sock, 'TCP_USER_TIMEOUT') == 1500
+
+    def test_client_socket(self):
+        lock_client = LockClient(tcp_keepalive=TcpKeepalive(idle=9))
+        assert lock_client._socket.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        assert get_tcp_option(lock_client._socket, 'TCP_KEEPIDLE') == 9
+        lock_client.close()
+
+    def test_accepted_socket(self):
+        server = TCPServer('localhost', 0, tcp_keepalive=TcpKeepalive(idle=11))
+        try:
+            with socket.create_connection(('localhost', server.port)):
+                sock, _ = server.get_request()
+                with sock:
+                    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+                    assert get_tcp_option(sock, 'TCP_KEEPIDLE') == 11
+        finally:
+            server.server_close()
@@ -0,0 +1,103 @@
+"""
+Unittests for `tcpnetlock.timers` package.
+"""
+import threading
+import time
+
+from tcpnetlock.timers import Deadline
+from tcpnetlock.timers import TimerHeap
+from tcpnetlock.timers import TimerThread
+
+
+class TestTimerHeap:
+
+    def test_expired_timers_are_run_in_order(self):
+        timers = TimerHeap()
+        called = []
+        timers.schedule(0.02, lambda: called.append(2))
+        timers.schedule(0.01, lambda: called.append(1))
+        timers.schedule(60, lambda: called.append(3))
+
+        time.sleep(0.05)
+        timers.run_expired()
+        assert called == [1, 2]
+        assert 59 < timers.next_timeout() <= 60
+
+    def test_cancelled_timers_are_not_run(self):
+        timers = TimerHeap()
+        called = []
+        timer = timers.schedule(0, lambda: called.append(1))
+        timer.cancel()
+        assert timers.next_timeout() is None
+
+        timers.run_expired()
+        assert called == []
+        assert len(timers) == 0
+
+    def test_cancelled_timers_are_removed(self):
+        timers = TimerHeap()
+        timers.schedule(60, lambda: None)
+        for _ in range(1000):
+            timer = timers.schedule(30, lambda: None)
+            timer.cancel()
+            assert timer.callback is None  # what the callback references can be garbage collected
+        assert len(timers) <= TimerHeap.MIN_COMPACT_SIZE + 1
+
+    def test_failing_callback_does_not_stop_others(self):
+        timers = TimerHeap()
+        called = []
+        timers.schedule(0, lambda: 1 / 0)
+        timers.schedule(0, lambda: called.append(1))
+        timers.run_expired()
+        assert called == [1]
+
+
+class TestTimerThread:
+
+    def test_callbacks_are_called_in_deadline_order(self):
+        timer_thread = TimerThread()
+        called = []
+        done = threading.Event()
+        timer_thread.schedule(0.2, lambda: (called.append('second'), done.set()))
+        timer_thread.schedule(0.1, lambda: called.append('first'))
+        assert done.wait(2)
+        assert called == ['first', 'second']
+
+    def test_cancelled_timer_is_not_called(self):
+        timer_thread = TimerThread()
+        called = []
+        done = threading.Event()
+        timer_thread.schedule(0.1, lambda: called.append('cancelled')).cancel()
+        timer_thread.schedule(0.2, done.set)
+        assert done.wait(2)
+        assert called == []
+
+    def test_callback_can_schedule_timers(self):
+        timer_thread = TimerThread()
+        done = threading.Event()
+        timer_thread.schedule(0.05, lambda: timer_thread.schedule(0.05, done.set))
+        assert done.wait(2)
+
+
+class TestDeadline:
+
+    def test_callback_is_called_when_not_touched(self):
+        expired = threading.Event()
+        Deadline(TimerThread(), 0.1, expired.set)
+        assert expired.wait(2)
+
+    def test_touch_postpones_the_deadline(self):
+        timer_thread = TimerThread()
+        expired = threading.Event()
+        deadline = Deadline(timer_thread, 0.2, expired.set)
+        for _ in range(4):
+            time.sleep(0.1)
+            deadline.touch()
+        assert not expired.is_set()
+        assert len(timer_thread) == 1  # touching doesn't schedule timers
+        assert expired.wait(2)
+
+    def test_cancelled_deadline_is_not_called(self):
+        expired = threading.Event()
+        Deadline(TimerThread(), 0.1, expired.set).cancel()
+        assert not expired.wait(0.3)
@@ -0,0 +1,61 @@
+"""
+Unittests for `tcpnetlock.server.top` package.
+"""
+import random
+
+from tcpnetlock.server.top import SpaceSaving
+from tcpnetlock.server.top import TopLocks
+
+
+class TestSpaceSaving:
+
+    def test_counts_are_exact_while_under_capacity(self):
+        sketch = SpaceSaving(10)
+        for item, count in (('a', 5), ('b', 3), ('c', 1)):
+            for _ in range(count):
+                sketch.add(item)
+        assert sketch.top(2) == [('a', 5, 0), ('b', 3, 0)]
+
+    def test_memory_is_bounded(self):
+        sketch = SpaceSaving(20)
+        for index in range(10000):
+            sketch.add('item-{}'.format(index))
+        assert len(sketch) == 20
+        assert len(sketch._heap) <= 4 * 20
+
+    def test_heavy_hitters_are_found(self):
+        rnd = random.Random(1234)
+        sketch = SpaceSaving(50)
+        for _ in range(20000):
+            if rnd.random() < 0.3:
+                sketch.add(rnd.choice(['hot-1', 'hot-2', 'hot-3']))
+            else:
+                sketch.add('cold-{}'.format(rnd.randrange(100000)))
+
+        top = sketch.top(3)
+        assert sorted(item for item, _, _ in top) == ['hot-1', 'hot-2', 'hot-3']
+        for _, weight, error in top:
+            # The estimation is never below the real count (~2000), and the error is bounded
+            assert weight - error <= 2000 * 1.2
+            assert weight >= 2000 * 0.8
+
+    def test_weighted(self):
+        sketch = SpaceSaving(2)
+        sketch.add('a', 1.5)
+        sketch.add('b', 0.5)
+        sketch.add('c', 0.25)  # replaces 'b'
+        assert sketch.top(2) == [('a', 1.5, 0), ('c', 0.75, 0.5)]
+
+
+class TestTopLocks:
+
+    def test_top(self):
+        top_locks = TopLocks(capacity=5)
+        top_locks.acquired.add('lock-1')
+        top_locks.not_granted.add('lock-2')
+        top_locks.hold_time.add('lock-1', 2.5)
+        assert top_locks.top(10) == {
+            'acquired': [{'name': 'lock-1', 'value': 1, 'error': 0}],
+            'not_granted': [{'name': 'lock-2', 'value': 1, 'error': 0}],
+            'hold_time': [{'name': 'lock-1', 'value': 2.5, 'error': 0}],
+        }
@@ -1,3 +1,7 @@
+import contextlib
+import functools
+import os
+import resource
 import socket
 import threading
 import time
@@ -6,7 +10,12 @@ import uuid
 import pytest
 
 from tcpnetlock.client.client import LockClient
+from tcpnetlock import constants
+from tcpnetlock.server.async_server import AsyncTCPServer
+from tcpnetlock.server.async_server import AsyncUnixServer
+from tcpnetlock.server.multiprocess import ShardedTCPServer
 from tcpnetlock.server.server import TCPServer
+from tcpnetlock.server.server import UnixServer
 
 
 class BaseTest:
@@ -36,9 +45,9 @@ class ServerThread(threading.Thread):
     """
     Thread impl to run the server in a subthread
     """
-    def __init__(self, port=0):
+    def __init__(self, port=0, server_class=TCPServer):
         super().__init__(daemon=True)
-        self.server = TCPServer("localhost", port)
+        self.server = server_class("localhost", port)
         self.port = self.server.port
 
     def get_client(self, **kwargs) -> LockClient:
@@ -51,18 +60,46 @@ class ServerThread(threading.Thread):
         self.server.serve_forever()
 
 
-@pytest.fixture(scope='module')
-def lock_server() -> ServerThread:
+@contextlib.contextmanager
+def no_free_file_descriptors():
+    """Lowers the limit of open files of this process, so no file descriptor can be created until exiting"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    lowest_free = os.open(os.devnull, os.O_RDONLY)
+    os.close(lowest_free)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (lowest_free, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+class UnixServerThread(ServerThread):
     """
-    Fixture, returns the server process running a TCPServer ready to use
+    Runs a server listening on TCP, and other listening on a Unix domain socket sharing its Context.
+    The clients connect to the Unix domain socket, unless other `host` is used.
     """
+    def __init__(self, path, server_class=TCPServer, unix_server_class=UnixServer):
+        super().__init__(server_class=server_class)
+        self.path = path
+        self.unix_server = unix_server_class(path, context=self.server.context)
+
+    def get_client(self, **kwargs) -> LockClient:
+        kwargs.setdefault('host', constants.UNIX_ADDRESS_PREFIX + self.path)
+        return super().get_client(**kwargs)
 
-    server_thread = ServerThread()
+    def run(self):
+        threading.Thread(target=self.unix_server.serve_forever, daemon=True).start()
+        super().run()
+
+
+def _start_server(server_class) -> ServerThread:
+    server_thread = ServerThread(server_class=server_class)
     server_thread.start()
+    return server_thread
 
-    yield server_thread
 
-    client = server_thread.get_client()
+def _shutdown_server(server_thread: ServerThread):
+    client = server_thread.get_client(host='localhost')
     client.connect()
     client.server_shutdown()
     client.close()
@@ -71,6 +108,91 @@ def lock_server() -> ServerThread:
     assert not server_thread.is_alive(), "Server didn't shut down cleanly"
 
 
+@pytest.fixture(scope='module')
+def lock_server() -> ServerThread:
+    """
+    Fixture, returns the server process running a TCPServer ready to use
+    """
+    server_thread = _start_server(TCPServer)
+    yield server_thread
+    _shutdown_server(server_thread)
+
+
+@pytest.fixture(scope='module')
+def async_lock_server() -> ServerThread:
+    """
+    Fixture, returns the server process running an AsyncTCPServer ready to use
+    """
+    server_thread = _start_server(AsyncTCPServer)
+    yield server_thread
+    _shutdown_server(server_thread)
+
+
+@pytest.fixture(scope='module')
+def sharded_lock_server() -> ServerThread:
+    """
+    Fixture, returns the server process running a ShardedTCPServer (with 2 workers) ready to use
+    """
+    server_thread = _start_server(functools.partial(ShardedTCPServer, workers=2))
+    yield server_thread
+    _shutdown_server(server_thread)
+    server_thread.server.server_close()
+
+
+@pytest.fixture(scope='module', params=['threading', 'async'])
+def unix_lock_server(request, tmp_path_factory) -> UnixServerThread:
+    """
+    Fixture, returns the server process running a TCPServer and an UnixServer (or their event-loop versions)
+    ready to use. The clients returned by `get_client()` use the Unix domain socket.
+    """
+    server_classes = {
+        'threading': (TCPServer, UnixServer),
+        'async': (AsyncTCPServer, AsyncUnixServer),
+    }[request.param]
+    path = str(tmp_path_factory.mktemp('unix') / 'tcpnetlock.sock')
+    server_thread = UnixServerThread(path, *server_classes)
+    server_thread.start()
+    yield server_thread
+    _shutdown_server(server_thread)
+    server_thread.unix_server.shutdown()
+    server_thread.unix_server.server_close()
+
+
+MAX_CONNECTIONS = 3
+"""Connections accepted at the same time by `limited_lock_server`"""
+
+
+@pytest.fixture(params=[TCPServer, AsyncTCPServer])
+def limited_lock_server(request) -> ServerThread:
+    """
+    Fixture, returns the server process running a TCPServer (or AsyncTCPServer) that accepts up to
+    MAX_CONNECTIONS connections at the same time
+    """
+    server_thread = _start_server(functools.partial(request.param, max_connections=MAX_CONNECTIONS, backlog=16))
+    yield server_thread
+    # The connections closed by the test may still be open at the server: the shutdown request would be refused
+    for _ in range(50):
+        if server_thread.server.context.active_connections < MAX_CONNECTIONS:
+            break
+        time.sleep(0.05)
+    _shutdown_server(server_thread)
+
+
+HANDSHAKE_TIMEOUT = 0.3
+"""Seconds `handshake_lock_server` waits for the request"""
+
+
+@pytest.fixture(scope='module', params=[TCPServer, AsyncTCPServer])
+def handshake_lock_server(request) -> ServerThread:
+    """
+    Fixture, returns the server process running a TCPServer (or AsyncTCPServer) that closes the connections
+    that don't send the request in HANDSHAKE_TIMEOUT seconds
+    """
+    server_thread = _start_server(functools.partial(request.param, handshake_timeout=HANDSHAKE_TIMEOUT))
+    yield server_thread
+    _shutdown_server(server_thread)
+
+
 @pytest.fixture()
 def lock_name() -> str:
     return str(uuid.uuid4())